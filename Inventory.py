@@ -1,7 +1,14 @@
-import tkinter as tk
-from tkinter import ttk, messagebox, scrolledtext
+import bisect
+import csv
+import json
+import os
+import queue
 import sqlite3
-from datetime import datetime
+import sys
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 
 
 # ============================================================
@@ -9,6 +16,9 @@ from datetime import datetime
 # ============================================================
 
 class Producto:
+    __slots__ = ('id_producto', 'codigo', 'nombre', 'precio_compra', 'precio_venta',
+                 'stock_actual', 'stock_minimo', 'categoria')
+    
     def __init__(self, codigo, nombre, precio_compra, precio_venta, 
                  stock_actual, stock_minimo, categoria, id_producto=None):
         
@@ -36,13 +46,26 @@ class Producto:
         self.stock_minimo = int(stock_minimo)
         self.categoria = str(categoria).strip()
     
+    @classmethod
+    def desde_fila(cls, fila):
+        # Filas leídas de nuestra propia base: ya se validaron al guardarse
+        producto = cls.__new__(cls)
+        (producto.id_producto, producto.codigo, producto.nombre, producto.precio_compra,
+         producto.precio_venta, producto.stock_actual, producto.stock_minimo,
+         producto.categoria) = fila
+        return producto
+    
     def necesita_reabastecimiento(self):
         return self.stock_actual <= self.stock_minimo
 
 
 class Movimiento:
+    __slots__ = ('id_movimiento', 'fecha', 'tipo', 'producto_codigo', 'producto_nombre',
+                 'cantidad', 'responsable', 'motivo', 'tipo_perdida', 'precio_compra', 'precio_venta')
+    
     def __init__(self, tipo, producto_codigo, producto_nombre, cantidad, 
-                 responsable, motivo=None, fecha=None, id_movimiento=None):
+                 responsable, motivo=None, fecha=None, id_movimiento=None, tipo_perdida=None,
+                 precio_compra=None, precio_venta=None):
         
         if tipo not in ["ENTRADA", "SALIDA", "DEVOLUCION", "PERDIDA"]:
             raise ValueError("Tipo inválido")
@@ -61,21 +84,579 @@ class Movimiento:
         self.cantidad = int(cantidad)
         self.responsable = str(responsable).strip()
         self.motivo = str(motivo).strip() if motivo else None
+        self.tipo_perdida = str(tipo_perdida).strip().lower() if tipo == "PERDIDA" and tipo_perdida else None
+        # Precios del producto en el momento del movimiento; si faltan se
+        # toman de productos al guardarlo
+        self.precio_compra = float(precio_compra) if precio_compra is not None else None
+        self.precio_venta = float(precio_venta) if precio_venta is not None else None
+    
+    @classmethod
+    def desde_fila(cls, fila):
+        movimiento = cls.__new__(cls)
+        (movimiento.id_movimiento, fecha, movimiento.tipo, movimiento.producto_codigo,
+         movimiento.producto_nombre, movimiento.cantidad, movimiento.responsable,
+         movimiento.motivo, movimiento.tipo_perdida, movimiento.precio_compra,
+         movimiento.precio_venta) = fila
+        movimiento.fecha = entero_a_fecha(fecha)
+        return movimiento
+
+
+SIGNO_MOVIMIENTO = {"ENTRADA": 1, "SALIDA": -1, "DEVOLUCION": 1, "PERDIDA": -1}
+
+ETIQUETA_MOVIMIENTO = {"ENTRADA": "Entrada", "SALIDA": "Salida",
+                       "DEVOLUCION": "Devolución", "PERDIDA": "Pérdida"}
+
+TIPOS_PERDIDA = ['robo', 'merma', 'caducidad', 'daño']
+
+
+def tipo_perdida_de_motivo(motivo):
+    # Motivos antiguos: "[ROBO] descripción"
+    for tipo in TIPOS_PERDIDA:
+        if motivo and tipo.upper() in motivo:
+            return tipo
+    return None
 
 
 # ============================================================
 # BASE DE DATOS
 # ============================================================
 
+# Las fechas de los movimientos se guardan como microsegundos desde 1970
+# de la hora local, la misma cuenta que strftime('%s') hace en SQLite
+EPOCA = datetime(1970, 1, 1)
+MICROSEGUNDO = timedelta(microseconds=1)
+
+
+def fecha_a_entero(fecha):
+    return (fecha - EPOCA) // MICROSEGUNDO
+
+
+# Día de un movimiento en resumen_diario: días desde 1970, hora local
+MICROSEGUNDOS_DIA = 86400 * 1000000
+
+
+def dia_de(fecha, redondear_arriba=False):
+    entero = fecha_a_entero(fecha)
+    if redondear_arriba:
+        return -(-entero // MICROSEGUNDOS_DIA)
+    return entero // MICROSEGUNDOS_DIA
+
+
+def entero_a_fecha(valor):
+    return EPOCA + timedelta(0, 0, valor)
+
+
+INDICES_MOVIMIENTOS = [
+    'CREATE INDEX IF NOT EXISTS idx_movimientos_tipo_fecha ON movimientos (tipo, fecha)',
+    'CREATE INDEX IF NOT EXISTS idx_movimientos_fecha ON movimientos (fecha)',
+    'CREATE INDEX IF NOT EXISTS idx_movimientos_producto_fecha ON movimientos (producto_codigo, fecha)'
+]
+
+
+def _migrar_fecha_entera(cursor):
+    # SQLite no cambia el tipo de una columna: se reconstruye la tabla
+    cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'movimientos'")
+    fila = cursor.fetchone()
+    
+    cursor.execute('''
+        CREATE TABLE movimientos_nueva (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            fecha INTEGER NOT NULL,
+            tipo TEXT NOT NULL,
+            producto_codigo TEXT NOT NULL,
+            producto_nombre TEXT NOT NULL,
+            cantidad INTEGER NOT NULL,
+            responsable TEXT NOT NULL,
+            motivo TEXT
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO movimientos_nueva (id, fecha, tipo, producto_codigo, producto_nombre,
+                                     cantidad, responsable, motivo)
+        SELECT id,
+               CASE WHEN typeof(fecha) = 'integer' THEN fecha
+                    ELSE CAST(strftime('%s', fecha) AS INTEGER) * 1000000 END,
+               tipo, producto_codigo, producto_nombre, cantidad, responsable, motivo
+        FROM movimientos
+    ''')
+    cursor.execute('DROP TABLE movimientos')
+    cursor.execute('ALTER TABLE movimientos_nueva RENAME TO movimientos')
+    
+    if fila:
+        cursor.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'movimientos'", (fila[0],))
+    
+    for sql in INDICES_MOVIMIENTOS:
+        cursor.execute(sql)
+
+
+def _migrar_busqueda_texto(cursor):
+    # Índice FTS5 sobre el catálogo, sincronizado por triggers. Sin FTS5
+    # (SQLite compilado sin él) la búsqueda sigue con LIKE.
+    try:
+        cursor.execute('''
+            CREATE VIRTUAL TABLE productos_fts USING fts5(
+                nombre, codigo, categoria,
+                content='productos', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2', prefix='2 3 4'
+            )
+        ''')
+    except sqlite3.OperationalError:
+        return
+    
+    cursor.execute('''
+        CREATE TRIGGER productos_fts_insertar AFTER INSERT ON productos BEGIN
+            INSERT INTO productos_fts (rowid, nombre, codigo, categoria)
+            VALUES (new.id, new.nombre, new.codigo, new.categoria);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER productos_fts_eliminar AFTER DELETE ON productos BEGIN
+            INSERT INTO productos_fts (productos_fts, rowid, nombre, codigo, categoria)
+            VALUES ('delete', old.id, old.nombre, old.codigo, old.categoria);
+        END
+    ''')
+    # Solo los cambios de texto tocan el índice; los de stock no
+    cursor.execute('''
+        CREATE TRIGGER productos_fts_actualizar AFTER UPDATE OF nombre, codigo, categoria ON productos BEGIN
+            INSERT INTO productos_fts (productos_fts, rowid, nombre, codigo, categoria)
+            VALUES ('delete', old.id, old.nombre, old.codigo, old.categoria);
+            INSERT INTO productos_fts (rowid, nombre, codigo, categoria)
+            VALUES (new.id, new.nombre, new.codigo, new.categoria);
+        END
+    ''')
+    cursor.execute("INSERT INTO productos_fts (productos_fts) VALUES ('rebuild')")
+
+
+def _migrar_tipo_perdida(cursor):
+    cursor.execute('ALTER TABLE movimientos ADD COLUMN tipo_perdida TEXT')
+    
+    # Mismo orden de prioridad con el que antes se buscaba en el motivo
+    casos = ' '.join(f"WHEN instr(motivo, '{t.upper()}') > 0 THEN '{t}'" for t in TIPOS_PERDIDA)
+    cursor.execute(f"UPDATE movimientos SET tipo_perdida = CASE {casos} END WHERE tipo = 'PERDIDA'")
+    
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_movimientos_tipo_perdida '
+                   'ON movimientos (tipo, tipo_perdida, fecha)')
+
+
+def _migrar_precios_movimiento(cursor):
+    cursor.execute('ALTER TABLE movimientos ADD COLUMN precio_compra REAL')
+    cursor.execute('ALTER TABLE movimientos ADD COLUMN precio_venta REAL')
+    
+    # Para el histórico solo se conoce el precio actual del producto;
+    # los movimientos de productos ya eliminados quedan sin precio
+    cursor.execute('''
+        UPDATE movimientos SET
+            precio_compra = (SELECT p.precio_compra FROM productos p WHERE p.codigo = movimientos.producto_codigo),
+            precio_venta = (SELECT p.precio_venta FROM productos p WHERE p.codigo = movimientos.producto_codigo)
+    ''')
+    
+    # Cubren las valoraciones por tipo y rango de fechas sin leer la tabla;
+    # el de pérdidas se amplía para agrupar por tipo_perdida igual
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_movimientos_valoracion
+        ON movimientos (tipo, fecha, cantidad, precio_compra, precio_venta)
+    ''')
+    cursor.execute('DROP INDEX IF EXISTS idx_movimientos_tipo_perdida')
+    cursor.execute('''
+        CREATE INDEX idx_movimientos_tipo_perdida
+        ON movimientos (tipo, tipo_perdida, fecha, cantidad, precio_compra)
+    ''')
+
+
+def _migrar_indice_ventas(cursor):
+    # El índice de valoración pasa a llevar también el producto, para
+    # agrupar ventas por producto en un rango de fechas sin leer la tabla
+    cursor.execute('DROP INDEX IF EXISTS idx_movimientos_valoracion')
+    cursor.execute('''
+        CREATE INDEX idx_movimientos_valoracion
+        ON movimientos (tipo, fecha, producto_codigo, cantidad, precio_compra, precio_venta)
+    ''')
+
+
+SQL_RECALCULAR_RESUMEN = '''
+    UPDATE resumen SET
+        total_productos = (SELECT COUNT(*) FROM productos),
+        categorias = (SELECT COUNT(*) FROM categorias),
+        valor_inventario = (SELECT COALESCE(SUM(precio_compra * stock_actual), 0) FROM productos),
+        productos_bajo_stock = (SELECT COUNT(*) FROM productos WHERE stock_actual <= stock_minimo),
+        total_movimientos = (SELECT COUNT(*) FROM movimientos)
+    WHERE id = 1
+'''
+
+
+def _migrar_resumen(cursor):
+    # Una sola fila con los totales del reporte general, mantenida por
+    # triggers en cada escritura para que leerla no dependa del tamaño
+    cursor.execute('''
+        CREATE TABLE resumen (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            total_productos INTEGER NOT NULL,
+            categorias INTEGER NOT NULL,
+            valor_inventario REAL NOT NULL,
+            productos_bajo_stock INTEGER NOT NULL,
+            total_movimientos INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('INSERT INTO resumen VALUES (1, 0, 0, 0, 0, 0)')
+    
+    cursor.execute('''
+        CREATE TRIGGER resumen_producto_insertar AFTER INSERT ON productos BEGIN
+            UPDATE resumen SET
+                total_productos = total_productos + 1,
+                valor_inventario = valor_inventario + new.precio_compra * new.stock_actual,
+                productos_bajo_stock = productos_bajo_stock + (new.stock_actual <= new.stock_minimo)
+            WHERE id = 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER resumen_producto_eliminar AFTER DELETE ON productos BEGIN
+            UPDATE resumen SET
+                total_productos = total_productos - 1,
+                valor_inventario = valor_inventario - old.precio_compra * old.stock_actual,
+                productos_bajo_stock = productos_bajo_stock - (old.stock_actual <= old.stock_minimo)
+            WHERE id = 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER resumen_producto_actualizar
+        AFTER UPDATE OF precio_compra, stock_actual, stock_minimo ON productos BEGIN
+            UPDATE resumen SET
+                valor_inventario = valor_inventario - old.precio_compra * old.stock_actual
+                                                    + new.precio_compra * new.stock_actual,
+                productos_bajo_stock = productos_bajo_stock - (old.stock_actual <= old.stock_minimo)
+                                                            + (new.stock_actual <= new.stock_minimo)
+            WHERE id = 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER resumen_movimiento_insertar AFTER INSERT ON movimientos BEGIN
+            UPDATE resumen SET total_movimientos = total_movimientos + 1 WHERE id = 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER resumen_movimiento_eliminar AFTER DELETE ON movimientos BEGIN
+            UPDATE resumen SET total_movimientos = total_movimientos - 1 WHERE id = 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER resumen_categoria_insertar AFTER INSERT ON categorias BEGIN
+            UPDATE resumen SET categorias = categorias + 1 WHERE id = 1;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER resumen_categoria_eliminar AFTER DELETE ON categorias BEGIN
+            UPDATE resumen SET categorias = categorias - 1 WHERE id = 1;
+        END
+    ''')
+    
+    cursor.execute(SQL_RECALCULAR_RESUMEN)
+
+
+SQL_RECONSTRUIR_RESUMEN_DIARIO = f'''
+    INSERT INTO resumen_diario (producto_codigo, dia, tipo, movimientos, cantidad,
+                                valor_compra, valor_venta)
+    SELECT producto_codigo, fecha / {MICROSEGUNDOS_DIA}, tipo, COUNT(*), SUM(cantidad),
+           COALESCE(SUM(cantidad * precio_compra), 0), COALESCE(SUM(cantidad * precio_venta), 0)
+    FROM movimientos
+    GROUP BY producto_codigo, fecha / {MICROSEGUNDOS_DIA}, tipo
+'''
+
+
+def _migrar_resumen_diario(cursor):
+    # Totales por producto, día y tipo de movimiento. Los triggers los
+    # mantienen en cada alta o baja de movimientos, así las series
+    # temporales no tienen que recorrer movimientos.
+    cursor.execute('''
+        CREATE TABLE resumen_diario (
+            producto_codigo TEXT NOT NULL,
+            dia INTEGER NOT NULL,
+            tipo TEXT NOT NULL,
+            movimientos INTEGER NOT NULL,
+            cantidad INTEGER NOT NULL,
+            valor_compra REAL NOT NULL,
+            valor_venta REAL NOT NULL,
+            PRIMARY KEY (producto_codigo, dia, tipo)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE INDEX idx_resumen_diario_tipo_dia
+        ON resumen_diario (tipo, dia, movimientos, cantidad, valor_compra, valor_venta)
+    ''')
+    
+    cursor.execute(f'''
+        CREATE TRIGGER resumen_diario_insertar AFTER INSERT ON movimientos BEGIN
+            INSERT INTO resumen_diario (producto_codigo, dia, tipo, movimientos, cantidad,
+                                        valor_compra, valor_venta)
+            VALUES (new.producto_codigo, new.fecha / {MICROSEGUNDOS_DIA}, new.tipo, 1, new.cantidad,
+                    new.cantidad * COALESCE(new.precio_compra, 0),
+                    new.cantidad * COALESCE(new.precio_venta, 0))
+            ON CONFLICT (producto_codigo, dia, tipo) DO UPDATE SET
+                movimientos = movimientos + 1,
+                cantidad = cantidad + excluded.cantidad,
+                valor_compra = valor_compra + excluded.valor_compra,
+                valor_venta = valor_venta + excluded.valor_venta;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER resumen_diario_eliminar AFTER DELETE ON movimientos BEGIN
+            UPDATE resumen_diario SET
+                movimientos = movimientos - 1,
+                cantidad = cantidad - old.cantidad,
+                valor_compra = valor_compra - old.cantidad * COALESCE(old.precio_compra, 0),
+                valor_venta = valor_venta - old.cantidad * COALESCE(old.precio_venta, 0)
+            WHERE producto_codigo = old.producto_codigo
+              AND dia = old.fecha / {MICROSEGUNDOS_DIA} AND tipo = old.tipo;
+            DELETE FROM resumen_diario
+            WHERE producto_codigo = old.producto_codigo
+              AND dia = old.fecha / {MICROSEGUNDOS_DIA} AND tipo = old.tipo AND movimientos <= 0;
+        END
+    ''')
+    
+    cursor.execute(SQL_RECONSTRUIR_RESUMEN_DIARIO)
+
+
+def _migrar_stock_bajo(cursor):
+    # Misma condición que Producto.necesita_reabastecimiento, calculada por
+    # SQLite; el índice parcial solo contiene los productos en stock bajo
+    cursor.execute('''
+        ALTER TABLE productos ADD COLUMN stock_bajo INTEGER
+        GENERATED ALWAYS AS (stock_actual <= stock_minimo) VIRTUAL
+    ''')
+    cursor.execute('CREATE INDEX idx_productos_stock_bajo ON productos (codigo) WHERE stock_bajo')
+    
+    # Cada vez que un producto entra en stock bajo queda una alerta
+    # pendiente; Gestor las entrega una sola vez a quien se suscriba
+    cursor.execute('''
+        CREATE TABLE alertas_stock (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            producto_codigo TEXT NOT NULL,
+            stock_actual INTEGER NOT NULL,
+            stock_minimo INTEGER NOT NULL,
+            fecha INTEGER NOT NULL,
+            notificada INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('CREATE INDEX idx_alertas_stock_pendientes ON alertas_stock (id) WHERE notificada = 0')
+    
+    # fecha en microsegundos de hora local, como en movimientos
+    fecha = "CAST((julianday('now', 'localtime') - 2440587.5) * 86400000000 AS INTEGER)"
+    cursor.execute(f'''
+        CREATE TRIGGER alertas_stock_insertar AFTER INSERT ON productos
+        WHEN new.stock_bajo BEGIN
+            INSERT INTO alertas_stock (producto_codigo, stock_actual, stock_minimo, fecha)
+            VALUES (new.codigo, new.stock_actual, new.stock_minimo, {fecha});
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER alertas_stock_actualizar AFTER UPDATE OF stock_actual, stock_minimo ON productos
+        WHEN new.stock_bajo AND NOT old.stock_bajo BEGIN
+            INSERT INTO alertas_stock (producto_codigo, stock_actual, stock_minimo, fecha)
+            VALUES (new.codigo, new.stock_actual, new.stock_minimo, {fecha});
+        END
+    ''')
+
+
+# Efecto de un movimiento en el stock, igual que SIGNO_MOVIMIENTO
+SQL_DELTA_STOCK = "CASE WHEN tipo IN ('ENTRADA', 'DEVOLUCION') THEN cantidad ELSE -cantidad END"
+
+
+def _migrar_conciliacion(cursor):
+    # Snapshots del libro de movimientos: saldo de cada producto contando
+    # los movimientos hasta movimiento_id. Conciliar solo repasa los
+    # movimientos posteriores al último snapshot.
+    cursor.execute('''
+        CREATE TABLE snapshots_stock (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            fecha INTEGER NOT NULL,
+            movimiento_id INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE saldos_snapshot (
+            snapshot_id INTEGER NOT NULL,
+            producto_codigo TEXT NOT NULL,
+            stock INTEGER NOT NULL,
+            PRIMARY KEY (snapshot_id, producto_codigo)
+        ) WITHOUT ROWID
+    ''')
+    
+    # Borrar un movimiento ya incluido en un snapshot lo descuenta de sus
+    # saldos. libro.borrados cuenta los borrados: si cambia mientras se
+    # calcula un snapshot, ese snapshot no se guarda.
+    cursor.execute('''
+        CREATE TABLE libro (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            borrados INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('INSERT INTO libro (id, borrados) VALUES (1, 0)')
+    cursor.execute('''
+        CREATE TRIGGER libro_eliminar AFTER DELETE ON movimientos BEGIN
+            UPDATE saldos_snapshot
+            SET stock = stock - CASE WHEN old.tipo IN ('ENTRADA', 'DEVOLUCION')
+                                     THEN old.cantidad ELSE -old.cantidad END
+            WHERE producto_codigo = old.producto_codigo
+              AND snapshot_id IN (SELECT id FROM snapshots_stock WHERE movimiento_id >= old.id)
+              AND old.id > COALESCE((SELECT movimiento_id FROM bajas_productos
+                                     WHERE producto_codigo = old.producto_codigo), 0);
+            UPDATE libro SET borrados = borrados + 1;
+        END
+    ''')
+    
+    # Los movimientos de un producto eliminado se quedan en el libro; si el
+    # código se vuelve a dar de alta, su saldo empieza de cero después del
+    # último movimiento que había al eliminarlo
+    cursor.execute('''
+        CREATE TABLE bajas_productos (
+            producto_codigo TEXT PRIMARY KEY,
+            movimiento_id INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER bajas_productos_eliminar AFTER DELETE ON productos BEGIN
+            INSERT OR REPLACE INTO bajas_productos (producto_codigo, movimiento_id)
+            VALUES (old.codigo, COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'movimientos'), 0));
+        END
+    ''')
+
+
+def _migrar_paginas_perdidas(cursor):
+    # Con id justo detrás de fecha, el índice de pérdidas da ya el orden
+    # (fecha, id) de las páginas filtradas por tipo de pérdida; antes el
+    # planificador prefería idx_movimientos_tipo_fecha y recorría las
+    # pérdidas de todos los tipos
+    cursor.execute('DROP INDEX IF EXISTS idx_movimientos_tipo_perdida')
+    cursor.execute('''
+        CREATE INDEX idx_movimientos_tipo_perdida
+        ON movimientos (tipo, tipo_perdida, fecha, id, cantidad, precio_compra)
+    ''')
+
+
+# Alertas de stock que se conservan sin recoger; las más antiguas se borran
+MAX_ALERTAS_STOCK = 10000
+
+
+def _migrar_limite_alertas(cursor):
+    # Sin nadie suscrito (servidor, línea de comandos) las alertas no se
+    # recogen: la tabla guarda solo las últimas MAX_ALERTAS_STOCK
+    cursor.execute(f'DELETE FROM alertas_stock WHERE notificada = 1 '
+                   f'OR id <= (SELECT MAX(id) FROM alertas_stock) - {MAX_ALERTAS_STOCK}')
+    cursor.execute(f'''
+        CREATE TRIGGER alertas_stock_limite AFTER INSERT ON alertas_stock BEGIN
+            DELETE FROM alertas_stock WHERE id <= new.id - {MAX_ALERTAS_STOCK};
+        END
+    ''')
+
+
+# Migraciones del esquema, en orden. Cada una es (versión, descripción, pasos)
+# y los pasos son sentencias SQL o funciones que reciben el cursor.
+# Se aplican al abrir la base y quedan anotadas en schema_version.
+MIGRACIONES = [
+    (1, "Índices de movimientos y productos", INDICES_MOVIMIENTOS + [
+        'CREATE INDEX IF NOT EXISTS idx_productos_categoria ON productos (categoria)'
+    ]),
+    (2, "Fecha de movimientos como entero (microsegundos)", [_migrar_fecha_entera]),
+    (3, "Búsqueda de texto completo (FTS5) en productos", [_migrar_busqueda_texto]),
+    (4, "Tipo de pérdida como columna de movimientos", [_migrar_tipo_perdida]),
+    (5, "Precios de compra y venta en cada movimiento", [_migrar_precios_movimiento]),
+    (6, "Producto en el índice de valoración para rankings de ventas", [_migrar_indice_ventas]),
+    (7, "Tabla resumen del reporte general mantenida por triggers", [_migrar_resumen]),
+    (8, "Resumen diario por producto y tipo de movimiento", [_migrar_resumen_diario]),
+    (9, "Stock bajo indexado y alertas al cruzar el mínimo", [_migrar_stock_bajo]),
+    (10, "Snapshots del libro de movimientos para conciliar el stock", [_migrar_conciliacion]),
+    (11, "Índice de pérdidas ordenado por (fecha, id) para paginar", [_migrar_paginas_perdidas]),
+    (12, "Límite de alertas de stock sin recoger", [_migrar_limite_alertas]),
+]
+
+
 class BD:
-    def __init__(self, archivo="inventario.db"):
+    PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -16000,
+        'mmap_size': 268435456,
+        'busy_timeout': 5000
+    }
+    
+    # Mismo orden que desempaquetan Producto.desde_fila y Movimiento.desde_fila
+    COLUMNAS_PRODUCTO = 'id, codigo, nombre, precio_compra, precio_venta, stock_actual, stock_minimo, categoria'
+    COLUMNAS_MOVIMIENTO = ('id, fecha, tipo, producto_codigo, producto_nombre, cantidad, responsable, '
+                           'motivo, tipo_perdida, precio_compra, precio_venta')
+    
+    def __init__(self, archivo="inventario.db", cached_statements=256, **pragmas):
+        for nombre in pragmas:
+            if nombre not in self.PRAGMAS:
+                raise ValueError(f"PRAGMA no soportado: {nombre}")
+        
         self.archivo = archivo
+        self.cached_statements = cached_statements
+        self.pragmas = dict(self.PRAGMAS, **pragmas)
+        
+        # Una conexión persistente por hilo, registradas para poder cerrarlas todas
+        self._local = threading.local()
+        self._conexiones = []
+        self._lock = threading.Lock()
+        
         self.crear_tablas()
+        self.migrar()
+        self.fts = self.existe_tabla('productos_fts')
     
     def conectar(self):
-        return sqlite3.connect(self.archivo)
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            return conn
+        
+        conn = sqlite3.connect(self.archivo,
+                               timeout=self.pragmas['busy_timeout'] / 1000,
+                               check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        for nombre, valor in self.pragmas.items():
+            conn.execute(f'PRAGMA {nombre}={valor}')
+        
+        self._local.conn = conn
+        with self._lock:
+            self._conexiones.append(conn)
+        return conn
+    
+    def cerrar_hilo(self):
+        # Cierra solo la conexión del hilo actual, para hilos de vida corta
+        # (p. ej. uno por cliente en el servidor)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            return
+        self._local.conn = None
+        with self._lock:
+            if conn in self._conexiones:
+                self._conexiones.remove(conn)
+        conn.close()
+    
+    def cerrar(self):
+        with self._lock:
+            conexiones = self._conexiones
+            self._conexiones = []
+            self._local = threading.local()
+        
+        for conn in conexiones:
+            try:
+                conn.close()
+            except sqlite3.ProgrammingError:
+                pass
+    
+    @contextmanager
+    def transaccion(self):
+        # BEGIN IMMEDIATE toma el bloqueo de escritura al inicio: dos terminales
+        # no pueden leer el mismo stock y escribirlo por separado
+        conn = self.conectar()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
     
     def crear_tablas(self):
+        # Esquema base (versión 0); los cambios posteriores van en MIGRACIONES
         conn = self.conectar()
         cursor = conn.cursor()
         
@@ -112,211 +693,760 @@ class BD:
             )
         ''')
         
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER PRIMARY KEY,
+                descripcion TEXT NOT NULL,
+                fecha TEXT NOT NULL
+            )
+        ''')
+        
         conn.commit()
-        conn.close()
     
-    def guardar_producto(self, producto):
-        conn = self.conectar()
-        cursor = conn.cursor()
+    def existe_tabla(self, nombre):
+        cursor = self.conectar().cursor()
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (nombre,))
+        return cursor.fetchone() is not None
+    
+    def version_esquema(self):
+        cursor = self.conectar().cursor()
+        cursor.execute('SELECT COALESCE(MAX(version), 0) FROM schema_version')
+        return cursor.fetchone()[0]
+    
+    def migrar(self):
+        aplicadas = []
+        for version, descripcion, pasos in MIGRACIONES:
+            if version <= self.version_esquema():
+                continue
+            
+            with self.transaccion() as conn:
+                cursor = conn.cursor()
+                # Otro proceso pudo aplicarla mientras esperábamos el bloqueo
+                cursor.execute('SELECT 1 FROM schema_version WHERE version = ?', (version,))
+                if cursor.fetchone():
+                    continue
+                
+                for paso in pasos:
+                    if callable(paso):
+                        paso(cursor)
+                    else:
+                        cursor.execute(paso)
+                
+                cursor.execute('INSERT INTO schema_version (version, descripcion, fecha) VALUES (?, ?, ?)',
+                               (version, descripcion, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+            aplicadas.append(version)
         
+        return aplicadas
+    
+    def guardar_producto(self, producto, entrada=None):
+        # El producto y la ENTRADA de su stock inicial (si se da) van en
+        # una misma transacción: nunca queda stock sin su movimiento
         try:
-            cursor.execute('''
-                INSERT INTO productos (codigo, nombre, precio_compra, precio_venta, 
-                                     stock_actual, stock_minimo, categoria)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (producto.codigo, producto.nombre, producto.precio_compra,
-                  producto.precio_venta, producto.stock_actual, 
-                  producto.stock_minimo, producto.categoria))
-            
-            cursor.execute('INSERT OR IGNORE INTO categorias (nombre) VALUES (?)', 
-                         (producto.categoria,))
-            
-            conn.commit()
-            return True, cursor.lastrowid
+            with self.transaccion() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    INSERT INTO productos (codigo, nombre, precio_compra, precio_venta, 
+                                         stock_actual, stock_minimo, categoria)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (producto.codigo, producto.nombre, producto.precio_compra,
+                      producto.precio_venta, producto.stock_actual, 
+                      producto.stock_minimo, producto.categoria))
+                id_producto = cursor.lastrowid
+                
+                cursor.execute('INSERT OR IGNORE INTO categorias (nombre) VALUES (?)', 
+                             (producto.categoria,))
+                
+                if entrada is not None:
+                    entrada.id_movimiento = self._insertar_movimiento(cursor, entrada)
+            return True, id_producto
         except sqlite3.IntegrityError:
             return False, "Ya existe ese código"
         except Exception as e:
             return False, f"Error: {str(e)}"
-        finally:
-            conn.close()
+    
+    def fila_producto(self, codigo):
+        cursor = self.conectar().cursor()
+        cursor.execute(f'SELECT {self.COLUMNAS_PRODUCTO} FROM productos WHERE codigo = ?', (codigo,))
+        return cursor.fetchone()
     
     def obtener_producto(self, codigo):
-        conn = self.conectar()
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM productos WHERE codigo = ?', (codigo,))
-        fila = cursor.fetchone()
-        conn.close()
+        fila = self.fila_producto(codigo)
         
         if fila:
-            return Producto(
-                codigo=fila[1], nombre=fila[2], precio_compra=fila[3],
-                precio_venta=fila[4], stock_actual=fila[5],
-                stock_minimo=fila[6], categoria=fila[7], id_producto=fila[0]
-            )
+            return Producto.desde_fila(fila)
         return None
     
-    def obtener_todos_productos(self):
+    def productos_stock_bajo(self):
+        cursor = self.conectar().cursor()
+        cursor.execute(f'SELECT {self.COLUMNAS_PRODUCTO} FROM productos WHERE stock_bajo ORDER BY codigo')
+        return [Producto.desde_fila(fila) for fila in cursor.fetchall()]
+    
+    def contar_stock_bajo(self):
+        # Solo recorre idx_productos_stock_bajo
+        cursor = self.conectar().cursor()
+        cursor.execute('SELECT COUNT(*) FROM productos WHERE stock_bajo')
+        return cursor.fetchone()[0]
+    
+    def codigos_stock_bajo(self):
+        cursor = self.conectar().cursor()
+        cursor.execute('SELECT codigo FROM productos WHERE stock_bajo')
+        return {fila[0] for fila in cursor.fetchall()}
+    
+    def ultima_alerta_stock(self):
+        cursor = self.conectar().cursor()
+        cursor.execute('SELECT COALESCE(MAX(id), 0) FROM alertas_stock')
+        return cursor.fetchone()[0]
+    
+    def tomar_alertas_stock(self, desde_id=0):
+        # Devuelve las alertas pendientes posteriores a desde_id y las borra
+        # en la misma transacción, así cada una se entrega una sola vez
+        # aunque haya varios procesos con la base abierta
+        with self.transaccion() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT id, producto_codigo, stock_actual, stock_minimo, fecha
+                FROM alertas_stock WHERE notificada = 0 AND id > ? ORDER BY id
+            ''', (desde_id,))
+            alertas = cursor.fetchall()
+            if alertas:
+                cursor.execute('DELETE FROM alertas_stock WHERE notificada = 0 AND id > ? AND id <= ?',
+                               (desde_id, alertas[-1][0]))
+        return [(codigo, stock, minimo, entero_a_fecha(fecha))
+                for _, codigo, stock, minimo, fecha in alertas]
+    
+    def data_version(self):
+        # Cambia cuando otra conexión (de este u otro proceso) confirma cambios
+        return self.conectar().execute('PRAGMA data_version').fetchone()[0]
+    
+    def iter_productos(self, tamano=1000):
+        # Recorre el catálogo por bloques sin cargarlo entero en memoria
+        cursor = self.conectar().cursor()
+        cursor.execute(f'SELECT {self.COLUMNAS_PRODUCTO} FROM productos ORDER BY codigo')
+        while True:
+            filas = cursor.fetchmany(tamano)
+            if not filas:
+                break
+            for fila in filas:
+                yield Producto.desde_fila(fila)
+    
+    def upsert_productos(self, productos, responsable="Sistema"):
+        # Inserta o actualiza un bloque de productos en una transacción.
+        # En productos existentes el stock no se toca (solo cambia con
+        # movimientos); los nuevos con stock inicial generan su ENTRADA.
+        with self.transaccion() as conn:
+            cursor = conn.cursor()
+            existentes = self._leer_stock(cursor, [p.codigo for p in productos])
+            
+            cursor.executemany('''
+                INSERT INTO productos (codigo, nombre, precio_compra, precio_venta,
+                                     stock_actual, stock_minimo, categoria)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(codigo) DO UPDATE SET
+                    nombre=excluded.nombre, precio_compra=excluded.precio_compra,
+                    precio_venta=excluded.precio_venta, stock_minimo=excluded.stock_minimo,
+                    categoria=excluded.categoria
+            ''', [(p.codigo, p.nombre, p.precio_compra, p.precio_venta,
+                   p.stock_actual, p.stock_minimo, p.categoria) for p in productos])
+            
+            cursor.executemany('INSERT OR IGNORE INTO categorias (nombre) VALUES (?)',
+                               [(c,) for c in {p.categoria for p in productos}])
+            
+            entradas = [Movimiento("ENTRADA", p.codigo, p.nombre, p.stock_actual, responsable,
+                                   precio_compra=p.precio_compra, precio_venta=p.precio_venta)
+                        for p in productos
+                        if p.codigo not in existentes and p.stock_actual > 0]
+            cursor.executemany(self.SQL_INSERTAR_MOVIMIENTO,
+                               [self._fila_movimiento(mov) for mov in entradas])
+        
+        nuevos = sum(1 for p in productos if p.codigo not in existentes)
+        return nuevos, len(productos) - nuevos
+    
+    def obtener_todos_productos(self, limite=None):
         conn = self.conectar()
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM productos ORDER BY codigo')
-        filas = cursor.fetchall()
-        conn.close()
-        
-        productos = []
-        for fila in filas:
-            productos.append(Producto(
-                codigo=fila[1], nombre=fila[2], precio_compra=fila[3],
-                precio_venta=fila[4], stock_actual=fila[5],
-                stock_minimo=fila[6], categoria=fila[7], id_producto=fila[0]
-            ))
-        return productos
+        cursor.execute(f'SELECT {self.COLUMNAS_PRODUCTO} FROM productos ORDER BY codigo LIMIT ?',
+                       (limite if limite else -1,))
+        return [Producto.desde_fila(fila) for fila in cursor.fetchall()]
+    
+    def codigos_y_nombres(self):
+        cursor = self.conectar().cursor()
+        cursor.execute('SELECT codigo, nombre FROM productos')
+        return cursor.fetchall()
     
     def actualizar_producto(self, producto):
+        # El stock no se toca aquí: solo cambia con los movimientos, y
+        # escribirlo pisaría los registrados mientras tanto
         conn = self.conectar()
         cursor = conn.cursor()
         
         cursor.execute('''
             UPDATE productos 
             SET nombre=?, precio_compra=?, precio_venta=?, 
-                stock_actual=?, stock_minimo=?, categoria=?
+                stock_minimo=?, categoria=?
             WHERE codigo=?
         ''', (producto.nombre, producto.precio_compra, producto.precio_venta,
-              producto.stock_actual, producto.stock_minimo, producto.categoria,
-              producto.codigo))
+              producto.stock_minimo, producto.categoria, producto.codigo))
         
         conn.commit()
-        filas = cursor.rowcount
-        conn.close()
-        return filas > 0
+        return cursor.rowcount > 0
     
     def eliminar_producto(self, codigo):
         conn = self.conectar()
         cursor = conn.cursor()
         cursor.execute('DELETE FROM productos WHERE codigo = ?', (codigo,))
         conn.commit()
-        filas = cursor.rowcount
-        conn.close()
-        return filas > 0
+        return cursor.rowcount > 0
+    
+    def _consulta_fts(self, valor):
+        # Cada palabra es un prefijo y deben aparecer todas: "caf lech"
+        # encuentra "Café con leche". Las comillas se escapan para que el
+        # texto del usuario nunca se interprete como sintaxis FTS5.
+        palabras = ['"' + p.replace('"', '""') + '"*' for p in str(valor).split()]
+        if not palabras:
+            return None
+        return 'nombre : (' + ' AND '.join(palabras) + ')'
     
-    def buscar_productos(self, criterio, valor):
+    def buscar_productos(self, criterio, valor, limite=None):
         conn = self.conectar()
         cursor = conn.cursor()
+        limite = limite if limite else -1
         
         if criterio == 'codigo':
-            cursor.execute('SELECT * FROM productos WHERE codigo = ?', (valor,))
+            cursor.execute(f'SELECT {self.COLUMNAS_PRODUCTO} FROM productos WHERE codigo = ?', (valor,))
+        elif criterio == 'codigo_prefijo':
+            # Para buscar mientras se escribe; el código exacto sale primero.
+            # Rango sobre el índice único en vez de LIKE.
+            cursor.execute(f'SELECT {self.COLUMNAS_PRODUCTO} FROM productos '
+                           f'WHERE codigo >= ? AND codigo < ? ORDER BY codigo LIMIT ?',
+                           (valor, valor + '\U0010ffff', limite))
+        elif criterio == 'nombre' and self.fts:
+            consulta = self._consulta_fts(valor)
+            if not consulta:
+                return []
+            # Los más relevantes primero. FTS5 resuelve ORDER BY rank LIMIT
+            # con un top-N: un término muy común no ordena miles de filas.
+            columnas = ', '.join('p.' + c for c in self.COLUMNAS_PRODUCTO.split(', '))
+            cursor.execute(f'''
+                SELECT {columnas} FROM (
+                    SELECT rowid, rank FROM productos_fts
+                    WHERE productos_fts MATCH ? ORDER BY rank LIMIT ?
+                ) f
+                JOIN productos p ON p.id = f.rowid
+                ORDER BY f.rank
+            ''', (consulta, limite))
         elif criterio == 'nombre':
-            cursor.execute('SELECT * FROM productos WHERE nombre LIKE ?', (f'%{valor}%',))
+            cursor.execute(f'SELECT {self.COLUMNAS_PRODUCTO} FROM productos WHERE nombre LIKE ? LIMIT ?',
+                           (f'%{valor}%', limite))
         elif criterio == 'categoria':
-            cursor.execute('SELECT * FROM productos WHERE categoria = ?', (valor,))
+            cursor.execute(f'SELECT {self.COLUMNAS_PRODUCTO} FROM productos WHERE categoria = ? LIMIT ?',
+                           (valor, limite))
         else:
-            conn.close()
             return []
         
-        filas = cursor.fetchall()
-        conn.close()
-        
-        productos = []
-        for fila in filas:
-            productos.append(Producto(
-                codigo=fila[1], nombre=fila[2], precio_compra=fila[3],
-                precio_venta=fila[4], stock_actual=fila[5],
-                stock_minimo=fila[6], categoria=fila[7], id_producto=fila[0]
-            ))
-        return productos
+        return [Producto.desde_fila(fila) for fila in cursor.fetchall()]
+    
+    SQL_INSERTAR_MOVIMIENTO = '''
+        INSERT INTO movimientos (fecha, tipo, producto_codigo, producto_nombre,
+                               cantidad, responsable, motivo, tipo_perdida,
+                               precio_compra, precio_venta)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+    
+    def _fila_movimiento(self, movimiento):
+        return (fecha_a_entero(movimiento.fecha), movimiento.tipo, movimiento.producto_codigo,
+                movimiento.producto_nombre, movimiento.cantidad,
+                movimiento.responsable, movimiento.motivo, movimiento.tipo_perdida,
+                movimiento.precio_compra, movimiento.precio_venta)
+    
+    def _insertar_movimiento(self, cursor, movimiento):
+        cursor.execute(self.SQL_INSERTAR_MOVIMIENTO, self._fila_movimiento(movimiento))
+        return cursor.lastrowid
     
     def guardar_movimiento(self, movimiento):
         conn = self.conectar()
         cursor = conn.cursor()
-        
-        fecha_str = movimiento.fecha.strftime("%Y-%m-%d %H:%M:%S")
-        
-        cursor.execute('''
-            INSERT INTO movimientos (fecha, tipo, producto_codigo, producto_nombre,
-                                   cantidad, responsable, motivo)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (fecha_str, movimiento.tipo, movimiento.producto_codigo,
-              movimiento.producto_nombre, movimiento.cantidad,
-              movimiento.responsable, movimiento.motivo))
-        
+        if movimiento.precio_compra is None:
+            cursor.execute('SELECT precio_compra, precio_venta FROM productos WHERE codigo = ?',
+                           (movimiento.producto_codigo,))
+            fila = cursor.fetchone()
+            if fila:
+                movimiento.precio_compra, movimiento.precio_venta = fila
+        id_mov = self._insertar_movimiento(cursor, movimiento)
         conn.commit()
-        id_mov = cursor.lastrowid
-        conn.close()
         return id_mov
     
-    def obtener_movimientos(self, limite=None):
-        conn = self.conectar()
-        cursor = conn.cursor()
+    def registrar_movimiento(self, movimiento, delta):
+        # Cambio de stock y fila del movimiento en una sola transacción.
+        # El UPDATE condicional nunca deja el stock en negativo.
+        with self.transaccion() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE productos SET stock_actual = stock_actual + ?
+                WHERE codigo = ? AND stock_actual + ? >= 0
+            ''', (delta, movimiento.producto_codigo, delta))
+            actualizado = cursor.rowcount > 0
+            
+            cursor.execute('SELECT nombre, stock_actual, precio_compra, precio_venta '
+                           'FROM productos WHERE codigo = ?', (movimiento.producto_codigo,))
+            fila = cursor.fetchone()
+            
+            if not fila:
+                return False, "Producto no encontrado"
+            if not actualizado:
+                return False, f"Stock insuficiente: {fila[1]}"
+            
+            movimiento.producto_nombre = fila[0]
+            if movimiento.precio_compra is None:
+                movimiento.precio_compra, movimiento.precio_venta = fila[2], fila[3]
+            movimiento.id_movimiento = self._insertar_movimiento(cursor, movimiento)
         
-        if limite:
-            cursor.execute('SELECT * FROM movimientos ORDER BY fecha DESC LIMIT ?', (limite,))
-        else:
-            cursor.execute('SELECT * FROM movimientos ORDER BY fecha DESC')
+        return True, fila[1]
+    
+    def _leer_stock(self, cursor, codigos):
+        # Nombre, stock y precios de varios productos, en bloques para no
+        # pasar el límite de parámetros de SQLite
+        codigos = list(codigos)
+        stock = {}
+        for i in range(0, len(codigos), 500):
+            bloque = codigos[i:i + 500]
+            marcas = ",".join("?" * len(bloque))
+            cursor.execute(f'SELECT codigo, nombre, stock_actual, precio_compra, precio_venta '
+                           f'FROM productos WHERE codigo IN ({marcas})', bloque)
+            for codigo, nombre, stock_actual, precio_compra, precio_venta in cursor.fetchall():
+                stock[codigo] = [nombre, stock_actual, precio_compra, precio_venta]
+        return stock
+    
+    def registrar_lote(self, movimientos, todo_o_nada=True):
+        # Valida todas las líneas contra el stock actual y las aplica en una
+        # sola transacción. Las líneas ya inválidas (None) cuentan como error.
+        # Devuelve un resultado (exito, stock o mensaje) por línea.
+        with self.transaccion() as conn:
+            cursor = conn.cursor()
+            stock = self._leer_stock(cursor, {m.producto_codigo for m in movimientos if m})
+            
+            resultados = []
+            aceptados = []
+            deltas = {}
+            for mov in movimientos:
+                if mov is None:
+                    resultados.append(None)
+                    continue
+                
+                actual = stock.get(mov.producto_codigo)
+                if actual is None:
+                    resultados.append((False, "Producto no encontrado"))
+                    continue
+                
+                delta = SIGNO_MOVIMIENTO[mov.tipo] * mov.cantidad
+                if actual[1] + delta < 0:
+                    resultados.append((False, f"Stock insuficiente: {actual[1]}"))
+                    continue
+                
+                actual[1] += delta
+                mov.producto_nombre = actual[0]
+                if mov.precio_compra is None:
+                    mov.precio_compra, mov.precio_venta = actual[2], actual[3]
+                deltas[mov.producto_codigo] = deltas.get(mov.producto_codigo, 0) + delta
+                aceptados.append(mov)
+                resultados.append((True, actual[1]))
+            
+            if todo_o_nada and len(aceptados) < len(movimientos):
+                conn.rollback()
+                return False, resultados
+            
+            cursor.executemany('UPDATE productos SET stock_actual = stock_actual + ? WHERE codigo = ?',
+                               [(delta, codigo) for codigo, delta in deltas.items() if delta])
+            cursor.executemany(self.SQL_INSERTAR_MOVIMIENTO,
+                               [self._fila_movimiento(mov) for mov in aceptados])
         
-        filas = cursor.fetchall()
-        conn.close()
+        return True, resultados
+    
+    def _filtro_movimientos(self, tipo=None, desde=None, hasta=None, producto=None, tipo_perdida=None):
+        # desde es inclusivo y hasta exclusivo; todos usan índices de movimientos
+        condiciones = []
+        parametros = []
+        if tipo:
+            condiciones.append('tipo = ?')
+            parametros.append(tipo)
+        if producto:
+            condiciones.append('producto_codigo = ?')
+            parametros.append(producto)
+        if tipo_perdida:
+            # Se guarda en minúsculas (ver Movimiento); el filtro no distingue
+            condiciones.append('tipo_perdida = ?')
+            parametros.append(str(tipo_perdida).strip().lower())
+        if desde:
+            condiciones.append('fecha >= ?')
+            parametros.append(fecha_a_entero(desde))
+        if hasta:
+            condiciones.append('fecha < ?')
+            parametros.append(fecha_a_entero(hasta))
+        
+        where = ' WHERE ' + ' AND '.join(condiciones) if condiciones else ''
+        return where, parametros
+    
+    def _consultar_movimientos(self, tipo=None, limite=None, desde=None, hasta=None, tipo_perdida=None):
+        where, parametros = self._filtro_movimientos(tipo, desde, hasta, tipo_perdida=tipo_perdida)
+        sql = f'SELECT {self.COLUMNAS_MOVIMIENTO} FROM movimientos{where} ORDER BY fecha DESC, id DESC'
+        if limite:
+            sql += ' LIMIT ?'
+            parametros.append(limite)
         
-        movimientos = []
-        for fila in filas:
-            fecha = datetime.strptime(fila[1], "%Y-%m-%d %H:%M:%S")
-            movimientos.append(Movimiento(
-                tipo=fila[2], producto_codigo=fila[3], producto_nombre=fila[4],
-                cantidad=fila[5], responsable=fila[6], motivo=fila[7],
-                fecha=fecha, id_movimiento=fila[0]
-            ))
-        return movimientos
-    
-    def obtener_movimientos_por_tipo(self, tipo, limite=None):
+        cursor = self.conectar().cursor()
+        cursor.execute(sql, parametros)
+        return [Movimiento.desde_fila(fila) for fila in cursor.fetchall()]
+    
+    def iter_movimientos(self, tipo=None, desde=None, hasta=None, producto=None, tamano=1000):
+        # Recorre el historial por bloques con fetchmany: la memoria no crece con él
+        where, parametros = self._filtro_movimientos(tipo, desde, hasta, producto)
+        cursor = self.conectar().cursor()
+        cursor.execute(f'SELECT {self.COLUMNAS_MOVIMIENTO} FROM movimientos{where} '
+                       f'ORDER BY fecha DESC, id DESC', parametros)
+        while True:
+            filas = cursor.fetchmany(tamano)
+            if not filas:
+                break
+            for fila in filas:
+                yield Movimiento.desde_fila(fila)
+    
+    def pagina_movimientos(self, tipo=None, despues_de=None, antes_de=None, limite=50, tipo_perdida=None,
+                           desde=None, hasta=None, producto=None):
+        # Paginación por clave (fecha, id), de más reciente a más antiguo.
+        # despues_de/antes_de son (fecha, id) del último/primer movimiento
+        # mostrado; cada página es una búsqueda en el índice, sin OFFSET.
+        where, parametros = self._filtro_movimientos(tipo, desde, hasta, producto, tipo_perdida)
+        
+        if antes_de:
+            where = where + ' AND ' if where else ' WHERE '
+            sql = (f'SELECT {self.COLUMNAS_MOVIMIENTO} FROM movimientos{where}(fecha, id) > (?, ?) '
+                   f'ORDER BY fecha, id LIMIT ?')
+            parametros += [fecha_a_entero(antes_de[0]), antes_de[1], limite]
+        elif despues_de:
+            where = where + ' AND ' if where else ' WHERE '
+            sql = (f'SELECT {self.COLUMNAS_MOVIMIENTO} FROM movimientos{where}(fecha, id) < (?, ?) '
+                   f'ORDER BY fecha DESC, id DESC LIMIT ?')
+            parametros += [fecha_a_entero(despues_de[0]), despues_de[1], limite]
+        else:
+            sql = f'SELECT {self.COLUMNAS_MOVIMIENTO} FROM movimientos{where} ORDER BY fecha DESC, id DESC LIMIT ?'
+            parametros.append(limite)
+        
+        cursor = self.conectar().cursor()
+        cursor.execute(sql, parametros)
+        pagina = [Movimiento.desde_fila(fila) for fila in cursor.fetchall()]
+        if antes_de:
+            pagina.reverse()
+        return pagina
+    
+    def contar_movimientos(self, tipo=None, desde=None, hasta=None, producto=None, tipo_perdida=None):
+        where, parametros = self._filtro_movimientos(tipo, desde, hasta, producto, tipo_perdida)
+        cursor = self.conectar().cursor()
+        cursor.execute(f'SELECT COUNT(*) FROM movimientos{where}', parametros)
+        return cursor.fetchone()[0]
+    
+    def obtener_movimientos(self, limite=None, desde=None, hasta=None):
+        return self._consultar_movimientos(None, limite, desde, hasta)
+    
+    def obtener_movimientos_por_tipo(self, tipo, limite=None, desde=None, hasta=None, tipo_perdida=None):
+        return self._consultar_movimientos(tipo, limite, desde, hasta, tipo_perdida)
+    
+    def revertir_ultimo_movimiento(self):
+        # Deshace el último movimiento en una transacción: primero devuelve
+        # el stock (sin dejarlo en negativo) y solo si se pudo borra la fila
+        with self.transaccion() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'SELECT {self.COLUMNAS_MOVIMIENTO} FROM movimientos ORDER BY id DESC LIMIT 1')
+            fila = cursor.fetchone()
+            
+            if not fila:
+                return False, "No hay operaciones para cancelar"
+            
+            movimiento = Movimiento.desde_fila(fila)
+            delta = -SIGNO_MOVIMIENTO[movimiento.tipo] * movimiento.cantidad
+            cursor.execute('''
+                UPDATE productos SET stock_actual = stock_actual + ?
+                WHERE codigo = ? AND stock_actual + ? >= 0
+            ''', (delta, movimiento.producto_codigo, delta))
+            
+            if cursor.rowcount == 0:
+                cursor.execute('SELECT 1 FROM productos WHERE codigo = ?', (movimiento.producto_codigo,))
+                if not cursor.fetchone():
+                    return False, "El producto no existe"
+                return False, "Stock insuficiente para cancelar"
+            
+            cursor.execute('DELETE FROM movimientos WHERE id = ?', (movimiento.id_movimiento,))
+        return True, movimiento
+    
+    # Las valoraciones usan el precio guardado en cada movimiento, así que
+    # no dependen de cambios de precio posteriores ni de unir con productos.
+    # Todas se resuelven en idx_movimientos_valoracion.
+    def resumen_perdidas(self, desde=None, hasta=None):
+        # Unidades y valor (a precio de compra) por tipo de pérdida
+        where, parametros = self._filtro_movimientos("PERDIDA", desde, hasta)
+        cursor = self.conectar().cursor()
+        cursor.execute(f'''
+            SELECT tipo_perdida, SUM(cantidad), COALESCE(SUM(cantidad * precio_compra), 0)
+            FROM movimientos{where} AND tipo_perdida IS NOT NULL
+            GROUP BY tipo_perdida
+        ''', parametros)
+        return cursor.fetchall()
+    
+    def resumen_devoluciones(self, desde=None, hasta=None):
+        where, parametros = self._filtro_movimientos("DEVOLUCION", desde, hasta)
+        cursor = self.conectar().cursor()
+        cursor.execute(f'''
+            SELECT COALESCE(SUM(cantidad), 0), COALESCE(SUM(cantidad * precio_venta), 0)
+            FROM movimientos{where}
+        ''', parametros)
+        return cursor.fetchone()
+    
+    def resumen_ventas(self, desde=None, hasta=None):
+        # Unidades vendidas, ingresos y coste de lo vendido
+        where, parametros = self._filtro_movimientos("SALIDA", desde, hasta)
+        cursor = self.conectar().cursor()
+        cursor.execute(f'''
+            SELECT COALESCE(SUM(cantidad), 0), COALESCE(SUM(cantidad * precio_venta), 0),
+                   COALESCE(SUM(cantidad * precio_compra), 0)
+            FROM movimientos{where}
+        ''', parametros)
+        return cursor.fetchone()
+    
+    def resumen(self):
+        cursor = self.conectar().cursor()
+        cursor.execute('''
+            SELECT total_productos, categorias, valor_inventario, productos_bajo_stock, total_movimientos
+            FROM resumen WHERE id = 1
+        ''')
+        fila = cursor.fetchone()
+        return {
+            'total_productos': fila[0],
+            'categorias': fila[1],
+            'valor_inventario': fila[2],
+            'productos_bajo_stock': fila[3],
+            'total_movimientos': fila[4]
+        }
+    
+    def recalcular_resumen(self):
+        # Rehace los totales desde las tablas (p. ej. tras editar la base a
+        # mano o para quitar el redondeo acumulado en valor_inventario)
+        with self.transaccion() as conn:
+            conn.execute(SQL_RECALCULAR_RESUMEN)
+        return self.resumen()
+    
+    def reconstruir_resumen_diario(self):
+        with self.transaccion() as conn:
+            conn.execute('DELETE FROM resumen_diario')
+            conn.execute(SQL_RECONSTRUIR_RESUMEN_DIARIO)
+            return conn.execute('SELECT COUNT(*) FROM resumen_diario').fetchone()[0]
+    
+    # ============================================================
+    # CONCILIACIÓN DEL STOCK CON EL LIBRO DE MOVIMIENTOS
+    # ============================================================
+    
+    def _ultimo_snapshot(self, cursor):
+        cursor.execute('SELECT id, movimiento_id FROM snapshots_stock ORDER BY id DESC LIMIT 1')
+        return cursor.fetchone() or (None, 0)
+    
+    def leer_conciliacion(self):
+        # Todo lo que se compara, leído en una misma transacción: el último
+        # snapshot y sus saldos, hasta qué movimiento llega el libro, el
+        # stock de cada producto y los dados de baja desde el snapshot
         conn = self.conectar()
         cursor = conn.cursor()
-        
-        if limite:
-            cursor.execute('SELECT * FROM movimientos WHERE tipo = ? ORDER BY fecha DESC LIMIT ?', 
-                         (tipo, limite))
+        cursor.execute('BEGIN')
+        try:
+            snapshot_id, desde_id = self._ultimo_snapshot(cursor)
+            cursor.execute('SELECT COALESCE(MAX(id), 0) FROM movimientos')
+            hasta_id = max(cursor.fetchone()[0], desde_id)
+            cursor.execute('SELECT codigo, stock_actual FROM productos')
+            stock = dict(cursor.fetchall())
+            cursor.execute('SELECT producto_codigo, stock FROM saldos_snapshot WHERE snapshot_id = ?',
+                           (snapshot_id,))
+            saldos = dict(cursor.fetchall())
+            cursor.execute('SELECT producto_codigo FROM bajas_productos WHERE movimiento_id >= ?', (desde_id,))
+            bajas = {codigo for codigo, in cursor.fetchall()}
+            cursor.execute('SELECT borrados FROM libro')
+            borrados = cursor.fetchone()[0]
+        finally:
+            conn.rollback()
+        return {'desde_id': desde_id, 'hasta_id': hasta_id, 'stock': stock, 'saldos': saldos,
+                'bajas': bajas, 'borrados': borrados}
+    
+    def saldo_libro(self, cursor, codigo, hasta_id=None):
+        # Saldo exacto de un producto según el libro: el del último snapshot
+        # más los movimientos posteriores. Si se dio de baja después del
+        # snapshot, solo cuentan los movimientos desde la baja.
+        snapshot_id, desde_id = self._ultimo_snapshot(cursor)
+        cursor.execute('SELECT movimiento_id FROM bajas_productos WHERE producto_codigo = ?', (codigo,))
+        baja = cursor.fetchone()
+        saldo = 0
+        if baja and baja[0] >= desde_id:
+            desde_id = baja[0]
         else:
-            cursor.execute('SELECT * FROM movimientos WHERE tipo = ? ORDER BY fecha DESC', (tipo,))
-        
-        filas = cursor.fetchall()
-        conn.close()
-        
-        movimientos = []
-        for fila in filas:
-            fecha = datetime.strptime(fila[1], "%Y-%m-%d %H:%M:%S")
-            movimientos.append(Movimiento(
-                tipo=fila[2], producto_codigo=fila[3], producto_nombre=fila[4],
-                cantidad=fila[5], responsable=fila[6], motivo=fila[7],
-                fecha=fecha, id_movimiento=fila[0]
-            ))
-        return movimientos
-    
-    def eliminar_ultimo_movimiento(self):
+            cursor.execute('SELECT stock FROM saldos_snapshot WHERE snapshot_id = ? AND producto_codigo = ?',
+                           (snapshot_id, codigo))
+            fila = cursor.fetchone()
+            saldo = fila[0] if fila else 0
+        
+        sql = (f'SELECT COALESCE(SUM({SQL_DELTA_STOCK}), 0) FROM movimientos '
+               'WHERE producto_codigo = ? AND id > ?')
+        parametros = [codigo, desde_id]
+        if hasta_id is not None:
+            sql += ' AND id <= ?'
+            parametros.append(hasta_id)
+        cursor.execute(sql, parametros)
+        return saldo + cursor.fetchone()[0]
+    
+    def saldos_libro(self, codigos, hasta_id=None):
+        # {codigo: saldo} de varios productos, en una misma lectura
         conn = self.conectar()
         cursor = conn.cursor()
-        
-        cursor.execute('SELECT * FROM movimientos ORDER BY id DESC LIMIT 1')
-        fila = cursor.fetchone()
-        
-        if not fila:
-            conn.close()
-            return None
-        
-        fecha = datetime.strptime(fila[1], "%Y-%m-%d %H:%M:%S")
-        movimiento = Movimiento(
-            tipo=fila[2], producto_codigo=fila[3], producto_nombre=fila[4],
-            cantidad=fila[5], responsable=fila[6], motivo=fila[7],
-            fecha=fecha, id_movimiento=fila[0]
-        )
-        
-        cursor.execute('DELETE FROM movimientos WHERE id = ?', (fila[0],))
-        conn.commit()
-        conn.close()
-        return movimiento
+        cursor.execute('BEGIN')
+        try:
+            return {codigo: self.saldo_libro(cursor, codigo, hasta_id) for codigo in codigos}
+        finally:
+            conn.rollback()
+    
+    def verificar_stock(self, codigos):
+        # [(codigo, stock_actual, saldo del libro)] de los productos cuyo
+        # stock no coincide, comprobados uno a uno en una misma lectura
+        conn = self.conectar()
+        cursor = conn.cursor()
+        cursor.execute('BEGIN')
+        try:
+            diferencias = []
+            for codigo in codigos:
+                cursor.execute('SELECT stock_actual FROM productos WHERE codigo = ?', (codigo,))
+                fila = cursor.fetchone()
+                if fila is None:
+                    continue
+                saldo = self.saldo_libro(cursor, codigo)
+                if saldo != fila[0]:
+                    diferencias.append((codigo, fila[0], saldo))
+            return diferencias
+        finally:
+            conn.rollback()
+    
+    def reparar_stock(self, codigos):
+        # Pone stock_actual al saldo del libro, recalculado dentro de la
+        # transacción de escritura. Un saldo negativo no se aplica: el libro
+        # también está mal y hay que revisarlo a mano.
+        reparados = []
+        with self.transaccion() as conn:
+            cursor = conn.cursor()
+            for codigo in codigos:
+                cursor.execute('SELECT stock_actual FROM productos WHERE codigo = ?', (codigo,))
+                fila = cursor.fetchone()
+                if fila is None:
+                    continue
+                saldo = self.saldo_libro(cursor, codigo)
+                if saldo != fila[0] and saldo >= 0:
+                    cursor.execute('UPDATE productos SET stock_actual = ? WHERE codigo = ?', (saldo, codigo))
+                    reparados.append((codigo, fila[0], saldo))
+        return reparados
+    
+    def guardar_snapshot(self, hasta_id, saldos, borrados, conservar=3):
+        # Guarda los saldos del libro hasta el movimiento hasta_id. Si desde
+        # que se leyeron se borró algún movimiento (borrados cambió), los
+        # saldos ya no valen y no se guarda nada.
+        with self.transaccion() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT borrados FROM libro')
+            if cursor.fetchone()[0] != borrados:
+                return None
+            
+            cursor.execute('INSERT INTO snapshots_stock (fecha, movimiento_id) VALUES (?, ?)',
+                           (fecha_a_entero(datetime.now()), hasta_id))
+            snapshot_id = cursor.lastrowid
+            cursor.executemany('INSERT INTO saldos_snapshot (snapshot_id, producto_codigo, stock) '
+                               'VALUES (?, ?, ?)',
+                               [(snapshot_id, codigo, saldo) for codigo, saldo in saldos.items()])
+            
+            cursor.execute('SELECT MIN(id) FROM (SELECT id FROM snapshots_stock ORDER BY id DESC LIMIT ?)',
+                           (conservar,))
+            primero = cursor.fetchone()[0]
+            cursor.execute('DELETE FROM saldos_snapshot WHERE snapshot_id < ?', (primero,))
+            cursor.execute('DELETE FROM snapshots_stock WHERE id < ?', (primero,))
+        return snapshot_id
+    
+    # Formatos de strftime para agrupar días; el día se pasa a fecha
+    # tratándolo como UTC porque ya se guardó en hora local
+    PERIODOS = {'dia': '%Y-%m-%d', 'semana': '%Y-%W', 'mes': '%Y-%m', 'anio': '%Y'}
+    
+    def serie_resumen(self, tipo, periodo='dia', desde=None, hasta=None, producto=None):
+        # Devuelve (periodo, movimientos, cantidad, valor_compra, valor_venta)
+        # en orden cronológico. Trabaja con días completos: desde se
+        # redondea al inicio de su día y hasta al final del suyo.
+        if periodo not in self.PERIODOS:
+            raise ValueError(f"Periodo desconocido: {periodo}")
+        
+        condiciones = ['tipo = ?']
+        parametros = [tipo]
+        if producto:
+            # Con producto conviene la clave primaria; el + impide que
+            # SQLite elija el índice por tipo para ahorrarse el orden
+            condiciones = ['+tipo = ?', 'producto_codigo = ?']
+            parametros.append(producto)
+        if desde:
+            condiciones.append('dia >= ?')
+            parametros.append(dia_de(desde))
+        if hasta:
+            condiciones.append('dia < ?')
+            parametros.append(dia_de(hasta, redondear_arriba=True))
+        
+        # Primero se suma por día sobre el índice (sin ordenar) y solo
+        # después se formatea cada día para agrupar por semana, mes o año
+        cursor = self.conectar().cursor()
+        cursor.execute(f'''
+            SELECT strftime('{self.PERIODOS[periodo]}', dia * 86400, 'unixepoch') AS clave,
+                   SUM(movimientos), SUM(cantidad), SUM(valor_compra), SUM(valor_venta)
+            FROM (
+                SELECT dia, SUM(movimientos) AS movimientos, SUM(cantidad) AS cantidad,
+                       SUM(valor_compra) AS valor_compra, SUM(valor_venta) AS valor_venta
+                FROM resumen_diario
+                WHERE {' AND '.join(condiciones)}
+                GROUP BY dia
+            )
+            GROUP BY clave
+            ORDER BY clave
+        ''', parametros)
+        return cursor.fetchall()
+    
+    ORDEN_RANKING = {'cantidad': 'unidades', 'ingresos': 'ingresos'}
+    
+    def ranking_ventas(self, limite=5, desde=None, hasta=None, categoria=None, orden='cantidad'):
+        # Top de productos vendidos agrupando en SQL; solo vuelven las
+        # filas del top. Devuelve (codigo, nombre, unidades, ingresos).
+        # El + en el GROUP BY evita que SQLite recorra el índice por producto
+        # (sin cubrir) y use idx_movimientos_valoracion, que sí cubre.
+        if orden not in self.ORDEN_RANKING:
+            raise ValueError(f"Orden de ranking desconocido: {orden}")
+        
+        where, parametros = self._filtro_movimientos("SALIDA", desde, hasta)
+        if categoria:
+            where += ' AND producto_codigo IN (SELECT codigo FROM productos WHERE categoria = ?)'
+            parametros.append(categoria)
+        
+        cursor = self.conectar().cursor()
+        cursor.execute(f'''
+            SELECT v.producto_codigo, COALESCE(p.nombre, v.producto_codigo), v.unidades, v.ingresos
+            FROM (
+                SELECT producto_codigo, SUM(cantidad) AS unidades,
+                       COALESCE(SUM(cantidad * precio_venta), 0) AS ingresos
+                FROM movimientos{where}
+                GROUP BY +producto_codigo
+                ORDER BY {self.ORDEN_RANKING[orden]} DESC, producto_codigo
+                LIMIT ?
+            ) v
+            LEFT JOIN productos p ON p.codigo = v.producto_codigo
+            ORDER BY v.{self.ORDEN_RANKING[orden]} DESC, v.producto_codigo
+        ''', parametros + [limite])
+        return cursor.fetchall()
     
     def obtener_categorias(self):
         conn = self.conectar()
         cursor = conn.cursor()
         cursor.execute('SELECT nombre FROM categorias ORDER BY nombre')
         filas = cursor.fetchall()
-        conn.close()
         return [fila[0] for fila in filas]
 
 
@@ -324,23 +1454,215 @@ class BD:
 # GESTOR DE INVENTARIO
 # ============================================================
 
+class CacheProductos:
+    # LRU acotada de filas de productos por código. Guarda la fila (tupla)
+    # y no el Producto para que nadie pueda modificar lo que hay en caché.
+    def __init__(self, capacidad=1000):
+        self.capacidad = capacidad
+        self.aciertos = 0
+        self.fallos = 0
+        self._filas = OrderedDict()
+        self._lock = threading.Lock()
+        self._versiones = threading.local()
+        # Sube con cada invalidación; guardar() la usa para no meter en la
+        # caché una fila leída antes de invalidarla
+        self.version = 0
+    
+    def __len__(self):
+        return len(self._filas)
+    
+    def obtener(self, codigo):
+        with self._lock:
+            fila = self._filas.get(codigo)
+            if fila is None:
+                self.fallos += 1
+                return None
+            self._filas.move_to_end(codigo)
+            self.aciertos += 1
+            return fila
+    
+    def guardar(self, codigo, fila, version):
+        # version es la que había antes de leer fila: si entretanto hubo una
+        # invalidación, fila puede ser anterior a ella y no se guarda
+        with self._lock:
+            if version != self.version:
+                return
+            self._filas[codigo] = fila
+            self._filas.move_to_end(codigo)
+            while len(self._filas) > self.capacidad:
+                self._filas.popitem(last=False)
+    
+    def invalidar(self, codigo=None):
+        with self._lock:
+            self.version += 1
+            if codigo is None:
+                self._filas.clear()
+            else:
+                self._filas.pop(codigo, None)
+    
+    def comprobar_version(self, data_version):
+        # data_version es propio de cada conexión (una por hilo) y cambia
+        # con los commits de cualquier otra conexión, también las de este
+        # proceso. No cuenta commits (varios seguidos pueden moverlo solo
+        # una vez), así que no se puede descontar lo que escribió este
+        # Gestor desde otro hilo: cualquier cambio vacía todo. La primera
+        # vez en un hilo no hay con qué comparar y también se vacía.
+        if getattr(self._versiones, 'valor', None) != data_version:
+            self.invalidar()
+        self._versiones.valor = data_version
+    
+    def estadisticas(self):
+        with self._lock:
+            total = self.aciertos + self.fallos
+            return {
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'tasa_aciertos': self.aciertos / total if total else 0.0,
+                'tamano': len(self._filas),
+                'capacidad': self.capacidad
+            }
+
+
+class IndiceProductos:
+    # Códigos ordenados en memoria para autocompletar por prefijo con bisect
+    def __init__(self, pares=()):
+        self.nombres = dict(pares)
+        self.codigos = sorted(self.nombres)
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self.codigos)
+    
+    def agregar(self, codigo, nombre):
+        with self._lock:
+            if codigo not in self.nombres:
+                bisect.insort(self.codigos, codigo)
+            self.nombres[codigo] = nombre
+    
+    def eliminar(self, codigo):
+        with self._lock:
+            if self.nombres.pop(codigo, None) is not None:
+                del self.codigos[bisect.bisect_left(self.codigos, codigo)]
+    
+    def buscar_prefijo(self, prefijo, limite=10):
+        with self._lock:
+            i = bisect.bisect_left(self.codigos, prefijo)
+            fin = min(i + limite, len(self.codigos))
+            resultado = []
+            while i < fin and self.codigos[i].startswith(prefijo):
+                resultado.append((self.codigos[i], self.nombres[self.codigos[i]]))
+                i += 1
+            return resultado
+
+
+def sumar_movimientos(archivo, desde_id, hasta_id):
+    # [(codigo, cambio de stock)] de los movimientos con id en (desde_id,
+    # hasta_id]. Puede correr en otro proceso: abre su propia conexión, de
+    # solo lectura.
+    ruta = os.path.abspath(archivo).replace('%', '%25').replace('?', '%3f').replace('#', '%23')
+    conn = sqlite3.connect(f'file:{ruta}?mode=ro', uri=True)
+    try:
+        return conn.execute(f'SELECT producto_codigo, SUM({SQL_DELTA_STOCK}) FROM movimientos '
+                            'WHERE id > ? AND id <= ? GROUP BY producto_codigo',
+                            (desde_id, hasta_id)).fetchall()
+    finally:
+        conn.close()
+
+
 class Gestor:
-    def __init__(self):
-        self.bd = BD()
+    LOTE_NO_APLICADO = "No aplicado: hay líneas con error"
+    
+    def __init__(self, tamano_cache=0, archivo="inventario.db"):
+        self.bd = BD(archivo)
+        self._indice = None
+        # Caché de productos opcional (tamano_cache=0 la desactiva)
+        self._cache = CacheProductos(tamano_cache) if tamano_cache > 0 else None
+        self._avisos_stock = []
+        self._alertas_desde = 0
+    
+    def al_bajar_stock(self, funcion):
+        # funcion(codigo, stock_actual, stock_minimo, fecha) se llama una vez
+        # cada vez que un producto cae en stock bajo. Se comprueba tras cada
+        # operación de este Gestor que cambia stock o mínimos. Solo se avisa
+        # de lo ocurrido desde la primera suscripción; las alertas anteriores
+        # quedan para `mantenimiento alertas`.
+        if not self._avisos_stock:
+            self._alertas_desde = self.bd.ultima_alerta_stock()
+        self._avisos_stock.append(funcion)
+    
+    def _avisar_stock_bajo(self):
+        if not self._avisos_stock:
+            return
+        for alerta in self.bd.tomar_alertas_stock(self._alertas_desde):
+            for funcion in self._avisos_stock:
+                try:
+                    funcion(*alerta)
+                except Exception:
+                    # La operación ya está confirmada; un aviso que falla
+                    # no debe hacerla parecer fallida
+                    pass
+    
+    def obtener_producto(self, codigo):
+        if self._cache is None:
+            return self.bd.obtener_producto(codigo)
+        
+        # Cambios confirmados por otras conexiones o procesos vacían la caché;
+        # los de este Gestor se invalidan en cada escritura
+        self._cache.comprobar_version(self.bd.data_version())
+        fila = self._cache.obtener(codigo)
+        if fila is None:
+            version = self._cache.version
+            fila = self.bd.fila_producto(codigo)
+            if fila is None:
+                return None
+            self._cache.guardar(codigo, fila, version)
+        return Producto.desde_fila(fila)
+    
+    def _invalidar(self, codigo=None):
+        if self._cache is not None:
+            self._cache.invalidar(codigo)
+    
+    def estadisticas_cache(self):
+        return self._cache.estadisticas() if self._cache is not None else None
+    
+    def descartar_caches(self):
+        # Tras cambios hechos por fuera de Gestor (SQL directo): la caché de
+        # productos se vacía y el índice de códigos se recarga al usarse
+        self._invalidar()
+        self._indice = None
+    
+    def indice_cargado(self):
+        return self._indice is not None
+    
+    def indice_codigos(self):
+        # Se carga la primera vez que se usa y luego se mantiene en cada cambio
+        if self._indice is None:
+            self._indice = IndiceProductos(self.bd.codigos_y_nombres())
+        return self._indice
+    
+    def autocompletar_codigo(self, prefijo, limite=10):
+        return self.indice_codigos().buscar_prefijo(prefijo, limite)
     
     def agregar_producto(self, producto, responsable="Sistema"):
         if not isinstance(producto, Producto):
             return False, "Error: Debe ser un Producto"
         
-        exito, resultado = self.bd.guardar_producto(producto)
+        mov = None
+        if producto.stock_actual > 0:
+            mov = Movimiento("ENTRADA", producto.codigo, producto.nombre,
+                           producto.stock_actual, responsable,
+                           precio_compra=producto.precio_compra, precio_venta=producto.precio_venta)
+        
+        exito, resultado = self.bd.guardar_producto(producto, mov)
         
         if not exito:
             return False, f"Error: {resultado}"
         
-        if producto.stock_actual > 0:
-            mov = Movimiento("ENTRADA", producto.codigo, producto.nombre,
-                           producto.stock_actual, responsable)
-            self.bd.guardar_movimiento(mov)
+        self._invalidar(producto.codigo)
+        self._avisar_stock_bajo()
+        
+        if self._indice is not None:
+            self._indice.agregar(producto.codigo, producto.nombre)
         
         return True, f"Producto {producto.nombre} agregado"
     
@@ -361,6 +1683,10 @@ class Gestor:
             producto.categoria = kwargs['categoria']
         
         if self.bd.actualizar_producto(producto):
+            self._invalidar(codigo)
+            self._avisar_stock_bajo()
+            if self._indice is not None:
+                self._indice.agregar(producto.codigo, producto.nombre)
             return True, "Producto actualizado"
         return False, "Error al actualizar"
     
@@ -370,77 +1696,186 @@ class Gestor:
             return False, "Producto no encontrado"
         
         if self.bd.eliminar_producto(codigo):
+            self._invalidar(codigo)
+            if self._indice is not None:
+                self._indice.eliminar(codigo)
             return True, f"Producto {producto.nombre} eliminado"
         return False, "Error al eliminar"
     
-    def buscar_producto(self, criterio, valor):
-        return self.bd.buscar_productos(criterio, valor)
+    def buscar_producto(self, criterio, valor, limite=None):
+        return self.bd.buscar_productos(criterio, valor, limite)
     
-    def listar_productos(self):
-        return self.bd.obtener_todos_productos()
+    def listar_productos(self, limite=None):
+        return self.bd.obtener_todos_productos(limite)
     
-    def registrar_entrada(self, codigo, cantidad, responsable="Sistema"):
-        producto = self.bd.obtener_producto(codigo)
-        if not producto:
-            return False, "Producto no encontrado"
-        
-        producto.stock_actual += int(cantidad)
-        self.bd.actualizar_producto(producto)
+    CAMPOS_PRODUCTO = ["codigo", "nombre", "precio_compra", "precio_venta",
+                       "stock_actual", "stock_minimo", "categoria"]
+    MAX_RECHAZOS = 100
+    
+    def _formato_archivo(self, archivo, formato):
+        if formato:
+            return formato
+        extension = os.path.splitext(archivo)[1].lower()
+        return "csv" if extension == ".csv" else "jsonl"
+    
+    def _leer_filas(self, archivo, formato):
+        # Generador de (número de línea, dict) para CSV o JSON Lines
+        if formato == "csv":
+            with open(archivo, newline='', encoding='utf-8-sig') as f:
+                lector = csv.DictReader(f)
+                for fila in lector:
+                    yield lector.line_num, fila
+        else:
+            with open(archivo, encoding='utf-8') as f:
+                for num, linea in enumerate(f, 1):
+                    if linea.strip():
+                        try:
+                            yield num, json.loads(linea)
+                        except ValueError as e:
+                            yield num, str(e)
+    
+    def importar_productos(self, archivo, formato=None, responsable="Sistema", tamano_lote=5000):
+        formato = self._formato_archivo(archivo, formato)
+        resumen = {'nuevos': 0, 'actualizados': 0, 'rechazados': 0, 'errores': []}
+        lote = {}
+        
+        def aplicar():
+            nuevos, actualizados = self.bd.upsert_productos(list(lote.values()), responsable)
+            resumen['nuevos'] += nuevos
+            resumen['actualizados'] += actualizados
+            for codigo in lote:
+                self._invalidar(codigo)
+            self._avisar_stock_bajo()
+            if self._indice is not None:
+                for p in lote.values():
+                    self._indice.agregar(p.codigo, p.nombre)
+            lote.clear()
+        
+        for num, fila in self._leer_filas(archivo, formato):
+            try:
+                if not isinstance(fila, dict):
+                    raise ValueError(fila)
+                producto = Producto(**{campo: fila[campo] for campo in self.CAMPOS_PRODUCTO})
+            except KeyError as e:
+                producto = None
+                error = f"Falta el campo {e}"
+            except (ValueError, TypeError) as e:
+                producto = None
+                error = str(e)
+            
+            if producto is None:
+                resumen['rechazados'] += 1
+                if len(resumen['errores']) < self.MAX_RECHAZOS:
+                    resumen['errores'].append((num, error))
+                continue
+            
+            # Un código repetido dentro del mismo bloque se queda con la última fila
+            lote.pop(producto.codigo, None)
+            lote[producto.codigo] = producto
+            if len(lote) >= tamano_lote:
+                aplicar()
+        
+        if lote:
+            aplicar()
+        return resumen
+    
+    def exportar_productos(self, archivo, formato=None):
+        formato = self._formato_archivo(archivo, formato)
+        total = 0
+        
+        with open(archivo, 'w', newline='', encoding='utf-8') as f:
+            if formato == "csv":
+                escritor = csv.writer(f)
+                escritor.writerow(self.CAMPOS_PRODUCTO)
+            for p in self.bd.iter_productos():
+                valores = [getattr(p, campo) for campo in self.CAMPOS_PRODUCTO]
+                if formato == "csv":
+                    escritor.writerow(valores)
+                else:
+                    f.write(json.dumps(dict(zip(self.CAMPOS_PRODUCTO, valores)), ensure_ascii=False) + "\n")
+                total += 1
         
-        mov = Movimiento("ENTRADA", codigo, producto.nombre, cantidad, responsable)
-        self.bd.guardar_movimiento(mov)
+        return total
+    
+    def registrar_entrada(self, codigo, cantidad, responsable="Sistema"):
+        mov = Movimiento("ENTRADA", codigo, None, cantidad, responsable)
+        exito, resultado = self.bd.registrar_movimiento(mov, mov.cantidad)
+        self._invalidar(codigo)
+        if not exito:
+            return False, resultado
         
-        return True, f"Entrada: +{cantidad} de {producto.nombre}"
+        return True, f"Entrada: +{cantidad} de {mov.producto_nombre}"
     
     def registrar_salida(self, codigo, cantidad, responsable="Sistema"):
-        producto = self.bd.obtener_producto(codigo)
-        if not producto:
-            return False, "Producto no encontrado"
-        
-        if producto.stock_actual < cantidad:
-            return False, f"Stock insuficiente: {producto.stock_actual}"
-        
-        producto.stock_actual -= int(cantidad)
-        self.bd.actualizar_producto(producto)
-        
-        mov = Movimiento("SALIDA", codigo, producto.nombre, cantidad, responsable)
-        self.bd.guardar_movimiento(mov)
+        mov = Movimiento("SALIDA", codigo, None, cantidad, responsable)
+        exito, resultado = self.bd.registrar_movimiento(mov, -mov.cantidad)
+        self._invalidar(codigo)
+        if not exito:
+            return False, resultado
+        self._avisar_stock_bajo()
         
-        return True, f"Salida: -{cantidad} de {producto.nombre}"
+        return True, f"Salida: -{cantidad} de {mov.producto_nombre}"
     
     def registrar_devolucion(self, codigo, cantidad, motivo, responsable="Sistema"):
-        producto = self.bd.obtener_producto(codigo)
-        if not producto:
-            return False, "Producto no encontrado"
-        
-        producto.stock_actual += int(cantidad)
-        self.bd.actualizar_producto(producto)
-        
-        mov = Movimiento("DEVOLUCION", codigo, producto.nombre, cantidad, responsable, motivo)
-        self.bd.guardar_movimiento(mov)
+        mov = Movimiento("DEVOLUCION", codigo, None, cantidad, responsable, motivo)
+        exito, resultado = self.bd.registrar_movimiento(mov, mov.cantidad)
+        self._invalidar(codigo)
+        if not exito:
+            return False, resultado
         
-        return True, f"Devolución: +{cantidad} de {producto.nombre}"
+        return True, f"Devolución: +{cantidad} de {mov.producto_nombre}"
     
     def registrar_perdida(self, codigo, cantidad, tipo_perdida, motivo, responsable="Sistema"):
-        producto = self.bd.obtener_producto(codigo)
-        if not producto:
-            return False, "Producto no encontrado"
-        
-        if producto.stock_actual < cantidad:
-            return False, f"Stock insuficiente: {producto.stock_actual}"
+        motivo_completo = f"[{tipo_perdida.upper()}] {motivo}"
+        mov = Movimiento("PERDIDA", codigo, None, cantidad, responsable, motivo_completo,
+                         tipo_perdida=tipo_perdida)
+        exito, resultado = self.bd.registrar_movimiento(mov, -mov.cantidad)
+        self._invalidar(codigo)
+        if not exito:
+            return False, resultado
+        self._avisar_stock_bajo()
         
-        producto.stock_actual -= int(cantidad)
-        self.bd.actualizar_producto(producto)
+        return True, f"Pérdida: -{cantidad} de {mov.producto_nombre}"
+    
+    def registrar_lote(self, lineas, responsable="Sistema", todo_o_nada=True):
+        # lineas: (codigo, tipo, cantidad, motivo). Con todo_o_nada=False se
+        # aplican las líneas válidas aunque otras fallen.
+        movimientos = []
+        errores = {}
+        for i, (codigo, tipo, cantidad, motivo) in enumerate(lineas):
+            try:
+                movimientos.append(Movimiento(tipo, codigo, None, cantidad, responsable, motivo,
+                                              tipo_perdida=tipo_perdida_de_motivo(motivo)))
+            except (ValueError, TypeError) as e:
+                movimientos.append(None)
+                errores[i] = str(e)
         
-        motivo_completo = f"[{tipo_perdida.upper()}] {motivo}"
-        mov = Movimiento("PERDIDA", codigo, producto.nombre, cantidad, responsable, motivo_completo)
-        self.bd.guardar_movimiento(mov)
+        aplicado, resultados = self.bd.registrar_lote(movimientos, todo_o_nada)
+        for mov in movimientos:
+            if mov is not None:
+                self._invalidar(mov.producto_codigo)
+        if aplicado:
+            self._avisar_stock_bajo()
+        
+        salida = []
+        for i, (mov, resultado) in enumerate(zip(movimientos, resultados)):
+            if mov is None:
+                salida.append((False, errores[i]))
+            elif not resultado[0]:
+                salida.append(resultado)
+            elif not aplicado:
+                salida.append((False, self.LOTE_NO_APLICADO))
+            else:
+                signo = "+" if SIGNO_MOVIMIENTO[mov.tipo] > 0 else "-"
+                salida.append((True, f"{ETIQUETA_MOVIMIENTO[mov.tipo]}: {signo}{mov.cantidad} de {mov.producto_nombre}"))
         
-        return True, f"Pérdida: -{cantidad} de {producto.nombre}"
+        return aplicado, salida
     
     def productos_con_stock_bajo(self):
-        todos = self.bd.obtener_todos_productos()
-        return [p for p in todos if p.necesita_reabastecimiento()]
+        return self.bd.productos_stock_bajo()
+    
+    def contar_stock_bajo(self):
+        return self.bd.contar_stock_bajo()
     
     def obtener_historial(self, limite=None):
         return self.bd.obtener_movimientos(limite)
@@ -448,120 +1883,335 @@ class Gestor:
     def obtener_devoluciones(self, limite=None):
         return self.bd.obtener_movimientos_por_tipo("DEVOLUCION", limite)
     
+    def pagina_devoluciones(self, despues_de=None, antes_de=None, limite=50):
+        return self.bd.pagina_movimientos("DEVOLUCION", despues_de, antes_de, limite)
+    
+    def contar_devoluciones(self):
+        return self.bd.contar_movimientos("DEVOLUCION")
+    
+    def iter_movimientos(self, tipo=None, desde=None, hasta=None, producto=None):
+        return self.bd.iter_movimientos(tipo, desde, hasta, producto)
+    
+    def pagina_historial(self, despues_de=None, antes_de=None, limite=50):
+        return self.bd.pagina_movimientos(None, despues_de, antes_de, limite)
+    
+    def pagina_movimientos(self, tipo=None, desde=None, hasta=None, producto=None, despues_de=None, limite=500):
+        # Como iter_movimientos pero por páginas independientes: sirve para
+        # recorrer el historial desde hilos o tareas que no comparten cursor
+        return self.bd.pagina_movimientos(tipo, despues_de, limite=limite, desde=desde, hasta=hasta,
+                                          producto=producto)
+    
+    def pagina_perdidas(self, tipo_filtro=None, despues_de=None, antes_de=None, limite=50):
+        return self.bd.pagina_movimientos("PERDIDA", despues_de, antes_de, limite, tipo_filtro)
+    
+    def contar_perdidas(self, tipo_filtro=None):
+        return self.bd.contar_movimientos("PERDIDA", tipo_perdida=tipo_filtro)
+    
     def obtener_perdidas(self, tipo_filtro=None):
-        perdidas = self.bd.obtener_movimientos_por_tipo("PERDIDA")
-        if tipo_filtro:
-            return [p for p in perdidas if p.motivo and tipo_filtro.upper() in p.motivo]
-        return perdidas
+        return self.bd.obtener_movimientos_por_tipo("PERDIDA", tipo_perdida=tipo_filtro)
     
     def calcular_perdidas_totales(self):
-        perdidas_por_tipo = {
-            'robo': {'cantidad': 0, 'valor': 0},
-            'merma': {'cantidad': 0, 'valor': 0},
-            'caducidad': {'cantidad': 0, 'valor': 0},
-            'daño': {'cantidad': 0, 'valor': 0}
-        }
-        
-        perdidas = self.bd.obtener_movimientos_por_tipo("PERDIDA")
+        perdidas_por_tipo = {tipo: {'cantidad': 0, 'valor': 0} for tipo in TIPOS_PERDIDA}
         
-        for mov in perdidas:
-            tipo_encontrado = None
-            for tipo in ['ROBO', 'MERMA', 'CADUCIDAD', 'DAÑO']:
-                if tipo in mov.motivo:
-                    tipo_encontrado = tipo.lower()
-                    break
-            
-            if tipo_encontrado:
-                perdidas_por_tipo[tipo_encontrado]['cantidad'] += mov.cantidad
-                producto = self.bd.obtener_producto(mov.producto_codigo)
-                if producto:
-                    perdidas_por_tipo[tipo_encontrado]['valor'] += mov.cantidad * producto.precio_compra
+        for tipo, cantidad, valor in self.bd.resumen_perdidas():
+            if tipo in perdidas_por_tipo:
+                perdidas_por_tipo[tipo] = {'cantidad': cantidad, 'valor': valor}
         
         return perdidas_por_tipo
     
     def calcular_valor_devoluciones(self):
-        devoluciones = self.bd.obtener_movimientos_por_tipo("DEVOLUCION")
-        valor_total = 0
-        cantidad_total = 0
-        
-        for mov in devoluciones:
-            cantidad_total += mov.cantidad
-            producto = self.bd.obtener_producto(mov.producto_codigo)
-            if producto:
-                valor_total += mov.cantidad * producto.precio_venta
-        
+        cantidad_total, valor_total = self.bd.resumen_devoluciones()
         return cantidad_total, valor_total
     
-    def productos_mas_vendidos(self, top=5):
-        ventas = {}
-        movimientos = self.bd.obtener_movimientos_por_tipo("SALIDA")
-        
-        for mov in movimientos:
-            if mov.producto_codigo not in ventas:
-                ventas[mov.producto_codigo] = {'nombre': mov.producto_nombre, 'cantidad': 0}
-            ventas[mov.producto_codigo]['cantidad'] += mov.cantidad
-        
-        ordenados = sorted(ventas.items(), key=lambda x: x[1]['cantidad'], reverse=True)
-        return [(datos['nombre'], datos['cantidad']) for _, datos in ordenados[:top]]
+    def calcular_ventas(self, desde=None, hasta=None):
+        cantidad, ingresos, costo = self.bd.resumen_ventas(desde, hasta)
+        return {
+            'cantidad': cantidad,
+            'ingresos': ingresos,
+            'costo': costo,
+            'margen': ingresos - costo
+        }
+    
+    def productos_mas_vendidos(self, top=5, desde=None, hasta=None, categoria=None, orden='cantidad'):
+        # orden: 'cantidad' (unidades) o 'ingresos'
+        return [(nombre, unidades, ingresos) for _, nombre, unidades, ingresos
+                in self.bd.ranking_ventas(top, desde, hasta, categoria, orden)]
     
     def valor_total_inventario(self):
-        productos = self.bd.obtener_todos_productos()
-        return sum(p.precio_compra * p.stock_actual for p in productos)
+        return self.bd.resumen()['valor_inventario']
     
     def reporte_general(self):
-        productos = self.bd.obtener_todos_productos()
-        categorias = self.bd.obtener_categorias()
-        movimientos = self.bd.obtener_movimientos()
+        # Lee la fila de resumen que mantienen los triggers: coste constante
+        return self.bd.resumen()
+    
+    def recalcular_resumen(self):
+        return self.bd.recalcular_resumen()
+    
+    def reconstruir_resumen_diario(self):
+        return self.bd.reconstruir_resumen_diario()
+    
+    # Por debajo de esta cantidad de movimientos no compensa arrancar procesos
+    MOVIMIENTOS_POR_PROCESO = 200000
+    
+    def _sumar_libro(self, desde_id, hasta_id, procesos):
+        # {codigo: cambio de stock} de los movimientos en (desde_id, hasta_id],
+        # repartidos por rangos de id entre un pool de procesos
+        total = hasta_id - desde_id
+        procesos = min(procesos or os.cpu_count() or 1, max(1, total // self.MOVIMIENTOS_POR_PROCESO))
+        if procesos == 1:
+            resultados = [sumar_movimientos(self.bd.archivo, desde_id, hasta_id)]
+        else:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            # Varios bloques por proceso para que ninguno se quede esperando al último
+            n_bloques = procesos * 4
+            limites = [desde_id + total * i // n_bloques for i in range(n_bloques + 1)]
+            # spawn y no fork: esto corre en el hilo escritor mientras otros
+            # hilos tienen conexiones y locks abiertos, que un fork copiaría
+            # a medias. Los procesos solo reciben el archivo y abren su
+            # propia conexión de solo lectura.
+            contexto = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(procesos, mp_context=contexto) as pool:
+                resultados = list(pool.map(sumar_movimientos, [self.bd.archivo] * n_bloques,
+                                           limites[:-1], limites[1:]))
+        
+        cambios = {}
+        for filas in resultados:
+            for codigo, cambio in filas:
+                cambios[codigo] = cambios.get(codigo, 0) + cambio
+        return cambios
+    
+    def reconciliar(self, reparar=False, guardar_snapshot=True, procesos=None):
+        # Compara el stock de cada producto con el que sale del libro de
+        # movimientos: saldos del último snapshot más los movimientos
+        # posteriores, sumados en paralelo. Las diferencias se comprueban de
+        # nuevo una a una, para no confundirlas con movimientos registrados
+        # mientras tanto. Con reparar, el stock pasa a ser el del libro.
+        estado = self.bd.leer_conciliacion()
+        desde_id, hasta_id = estado['desde_id'], estado['hasta_id']
+        cambios = self._sumar_libro(desde_id, hasta_id, procesos)
+        
+        saldos = self.bd.saldos_libro(estado['bajas'] & estado['stock'].keys(), hasta_id)
+        sospechosos = []
+        for codigo, stock in estado['stock'].items():
+            if codigo not in saldos:
+                saldos[codigo] = estado['saldos'].get(codigo, 0) + cambios.get(codigo, 0)
+            if saldos[codigo] != stock:
+                sospechosos.append(codigo)
+        diferencias = self.bd.verificar_stock(sospechosos)
+        
+        reparados = []
+        if reparar and diferencias:
+            reparados = self.bd.reparar_stock([codigo for codigo, _, _ in diferencias])
+            for codigo, _, _ in reparados:
+                self._invalidar(codigo)
+            self._avisar_stock_bajo()
+        
+        snapshot = None
+        if guardar_snapshot and hasta_id > desde_id:
+            snapshot = self.bd.guardar_snapshot(hasta_id, saldos, estado['borrados'])
         
         return {
-            'total_productos': len(productos),
-            'categorias': len(categorias),
-            'valor_inventario': self.valor_total_inventario(),
-            'productos_bajo_stock': len(self.productos_con_stock_bajo()),
-            'total_movimientos': len(movimientos)
+            'productos': len(estado['stock']),
+            'desde_movimiento': desde_id,
+            'hasta_movimiento': hasta_id,
+            'diferencias': diferencias,
+            'reparados': reparados,
+            'snapshot': snapshot,
         }
     
+    # Series temporales desde resumen_diario. periodo: 'dia', 'semana',
+    # 'mes' o 'anio'. Cada fila es (periodo, cantidad, valor).
+    def ventas_por_periodo(self, periodo='mes', desde=None, hasta=None, producto=None):
+        return [(clave, cantidad, valor_venta) for clave, _, cantidad, _, valor_venta
+                in self.bd.serie_resumen("SALIDA", periodo, desde, hasta, producto)]
+    
+    def perdidas_por_periodo(self, periodo='semana', desde=None, hasta=None, producto=None):
+        return [(clave, cantidad, valor_compra) for clave, _, cantidad, valor_compra, _
+                in self.bd.serie_resumen("PERDIDA", periodo, desde, hasta, producto)]
+    
+    def devoluciones_por_periodo(self, periodo='mes', desde=None, hasta=None, producto=None):
+        return [(clave, cantidad, valor_venta) for clave, _, cantidad, _, valor_venta
+                in self.bd.serie_resumen("DEVOLUCION", periodo, desde, hasta, producto)]
+    
+    def comparar_ventas_mensuales(self, desde=None, hasta=None, producto=None):
+        # Ventas por mes con la variación (%) de ingresos respecto al mes anterior
+        filas = []
+        anterior = None
+        for mes, cantidad, ingresos in self.ventas_por_periodo('mes', desde, hasta, producto):
+            variacion = (ingresos - anterior) / anterior * 100 if anterior else None
+            filas.append((mes, cantidad, ingresos, variacion))
+            anterior = ingresos
+        return filas
+    
     def cancelar_ultima_operacion(self):
-        ultimo_mov = self.bd.eliminar_ultimo_movimiento()
-        
-        if not ultimo_mov:
-            return False, "No hay operaciones para cancelar"
-        
-        producto = self.bd.obtener_producto(ultimo_mov.producto_codigo)
-        if not producto:
-            return False, "El producto no existe"
+        # (exito, msg, código del producto revertido o None). El último
+        # movimiento es el de mayor id, que tras un cambio de hora puede no
+        # ser el más reciente por fecha.
+        exito, resultado = self.bd.revertir_ultimo_movimiento()
+        if not exito:
+            return False, resultado, None
         
-        if ultimo_mov.tipo == "ENTRADA":
-            if producto.stock_actual < ultimo_mov.cantidad:
-                return False, "Stock insuficiente para cancelar"
-            producto.stock_actual -= ultimo_mov.cantidad
-        elif ultimo_mov.tipo == "SALIDA":
-            producto.stock_actual += ultimo_mov.cantidad
-        elif ultimo_mov.tipo == "DEVOLUCION":
-            if producto.stock_actual < ultimo_mov.cantidad:
-                return False, "Stock insuficiente para cancelar"
-            producto.stock_actual -= ultimo_mov.cantidad
-        elif ultimo_mov.tipo == "PERDIDA":
-            producto.stock_actual += ultimo_mov.cantidad
+        self._invalidar(resultado.producto_codigo)
+        self._avisar_stock_bajo()
+        return True, f"Operación cancelada: {resultado.tipo}", resultado.producto_codigo
+    
+    def ver_ultimas_operaciones(self, cantidad=5):
+        return self.obtener_historial(cantidad)
+    
+    def cerrar(self):
+        self.bd.cerrar()
+
+
+# ============================================================
+# INTERFAZ GRÁFICA
+# ============================================================
+
+# tkinter se importa al abrir la interfaz: el modelo, la base de datos y
+# el gestor se usan sin Tk ni pantalla (scripts, cron, línea de comandos)
+tk = ttk = messagebox = scrolledtext = filedialog = None
+
+
+def cargar_tk():
+    global tk, ttk, messagebox, scrolledtext, filedialog
+    import tkinter as tk
+    from tkinter import ttk, messagebox, scrolledtext, filedialog
+
+
+def iniciar_interfaz():
+    cargar_tk()
+    root = tk.Tk()
+    app = App(root)
+    
+    root.mainloop()
+
+
+class Tarea:
+    def __init__(self, al_terminar, al_fallar, dueno, escritura):
+        self.al_terminar = al_terminar
+        self.al_fallar = al_fallar
+        self.dueno = dueno
+        self.escritura = escritura
+        self.cancelada = False
+        self.futuro = None
+        # Conexión del hilo mientras la consulta se ejecuta, para interrumpirla
+        self.conexion = None
+
+
+class EjecutorFondo:
+    # Saca el trabajo de base de datos del hilo de Tk. Las lecturas van a
+    # un pool de hilos; las escrituras a un único hilo y en orden. Los
+    # resultados vuelven por una cola que el hilo de Tk vacía con root.after.
+    INTERVALO_MS = 25
+    
+    def __init__(self, root, bd, hilos_lectura=2):
+        # Solo lo usa la interfaz; fuera de ella no se paga la importación
+        from concurrent.futures import ThreadPoolExecutor
         
-        self.bd.actualizar_producto(producto)
-        return True, f"Operación cancelada: {ultimo_mov.tipo}"
+        self.root = root
+        self.bd = bd
+        self._lectores = ThreadPoolExecutor(hilos_lectura, thread_name_prefix="lectura")
+        self._escritor = ThreadPoolExecutor(1, thread_name_prefix="escritura")
+        self._cola = queue.SimpleQueue()
+        self._tareas = set()
+        self._lock = threading.Lock()
+        self._id_sondeo = self.root.after(self.INTERVALO_MS, self._sondear)
+    
+    def ejecutar(self, funcion, al_terminar=None, al_fallar=None, dueno=None, escritura=False):
+        # al_terminar(resultado) y al_fallar(excepcion) se llaman en el hilo
+        # de Tk, y no se llaman si la tarea se cancela o su ventana (dueno)
+        # ya no existe
+        tarea = Tarea(al_terminar, al_fallar, dueno, escritura)
+        with self._lock:
+            self._tareas.add(tarea)
+        pool = self._escritor if escritura else self._lectores
+        tarea.futuro = pool.submit(self._correr, tarea, funcion)
+        return tarea
+    
+    def _correr(self, tarea, funcion):
+        if tarea.cancelada:
+            return
+        if not tarea.escritura:
+            with self._lock:
+                tarea.conexion = self.bd.conectar()
+        try:
+            resultado, error = funcion(), None
+        except Exception as e:
+            resultado, error = None, e
+        finally:
+            with self._lock:
+                tarea.conexion = None
+        self._cola.put((tarea, resultado, error))
     
-    def ver_ultimas_operaciones(self, cantidad=5):
-        return self.obtener_historial(cantidad)
-
+    def en_tk(self, funcion, *args):
+        # Para que otros hilos actualicen widgets: funcion corre en el de Tk
+        self._cola.put((Tarea(lambda _: funcion(*args), None, None, False), None, None))
+    
+    def cancelar(self, tarea):
+        # Las escrituras no se interrumpen: solo se descarta su aviso
+        with self._lock:
+            tarea.cancelada = True
+            self._tareas.discard(tarea)
+            if tarea.conexion is not None:
+                tarea.conexion.interrupt()
+        if tarea.futuro is not None:
+            tarea.futuro.cancel()
+    
+    def cancelar_de(self, dueno):
+        with self._lock:
+            tareas = [t for t in self._tareas if t.dueno is dueno]
+        for tarea in tareas:
+            self.cancelar(tarea)
+    
+    def _sondear(self):
+        try:
+            while True:
+                try:
+                    tarea, resultado, error = self._cola.get_nowait()
+                except queue.Empty:
+                    break
+                with self._lock:
+                    self._tareas.discard(tarea)
+                if tarea.cancelada or (tarea.dueno is not None and not tarea.dueno.winfo_exists()):
+                    continue
+                if error is None:
+                    if tarea.al_terminar:
+                        tarea.al_terminar(resultado)
+                elif tarea.al_fallar:
+                    tarea.al_fallar(error)
+                else:
+                    messagebox.showerror("Error", str(error))
+        finally:
+            self._id_sondeo = self.root.after(self.INTERVALO_MS, self._sondear)
+    
+    def cerrar(self):
+        # Cancela las lecturas y espera a que terminen las escrituras pendientes
+        self.root.after_cancel(self._id_sondeo)
+        with self._lock:
+            lecturas = [t for t in self._tareas if not t.escritura]
+        for tarea in lecturas:
+            self.cancelar(tarea)
+        self._lectores.shutdown(wait=True, cancel_futures=True)
+        self._escritor.shutdown(wait=True)
 
-# ============================================================
-# INTERFAZ GRÁFICA
-# ============================================================
 
 class App:
     def __init__(self, root):
+        cargar_tk()
         self.root = root
         self.root.title("Sistema de Inventario v2.0")
         self.root.geometry("1200x700")
         
-        self.gestor = Gestor()
+        self.gestor = Gestor(tamano_cache=1000)
+        self.ejecutor = EjecutorFondo(self.root, self.gestor.bd)
+        self._ventanas_ocupadas = set()
+        
+        # Tabla principal: código -> item del Treeview (y al revés), códigos
+        # en el orden en que se muestran y data_version de la última carga
+        self._items = {}
+        self._codigo_de_item = {}
+        self._codigos_tabla = []
+        self._version_tabla = None
         
         self.c_primario = "#2c3e50"
         self.c_exito = "#27ae60"
@@ -571,6 +2221,48 @@ class App:
         self.crear_menu()
         self.crear_interfaz()
         self.actualizar_tabla()
+        self.ejecutor.ejecutar(lambda: self.gestor.al_bajar_stock(self.aviso_stock_bajo),
+                               escritura=True)
+        
+        self.root.protocol("WM_DELETE_WINDOW", self.salir)
+    
+    def salir(self):
+        self.ejecutor.cerrar()
+        self.gestor.cerrar()
+        self.root.destroy()
+    
+    def cancelar_al_cerrar(self, v):
+        # Al cerrar la ventana se cancelan sus consultas en curso
+        v.bind('<Destroy>', lambda e: self.ejecutor.cancelar_de(v) if e.widget is v else None, add='+')
+    
+    def escribir(self, operacion, codigos=(), ventana=None, titulo="Éxito"):
+        # operacion devuelve (exito, msg) y corre en el hilo escritor. Al
+        # terminar se avisa, se refrescan las filas de codigos y se cierra
+        # la ventana. Mientras tanto la ventana ignora nuevos envíos.
+        if ventana is not None:
+            if ventana in self._ventanas_ocupadas:
+                return None
+            self._ventanas_ocupadas.add(ventana)
+        
+        def terminado(resultado):
+            self._ventanas_ocupadas.discard(ventana)
+            exito, msg = resultado
+            if exito:
+                messagebox.showinfo(titulo, msg)
+                self.actualizar_tabla(list(codigos))
+                if ventana is not None:
+                    ventana.destroy()
+            else:
+                messagebox.showerror("Error", msg)
+        
+        def fallido(error):
+            self._ventanas_ocupadas.discard(ventana)
+            messagebox.showerror("Error", str(error))
+        
+        return self.ejecutor.ejecutar(operacion, terminado, fallido, escritura=True)
+    
+    def mostrar_error(self, error):
+        messagebox.showerror("Error", str(error))
     
     def crear_menu(self):
         menubar = tk.Menu(self.root)
@@ -603,6 +2295,11 @@ class App:
         menubar.add_cascade(label="Herramientas", menu=menu_her)
         menu_her.add_command(label="Cancelar Operación", command=self.cancelar_operacion)
         menu_her.add_command(label="Actualizar", command=self.actualizar_tabla)
+        menu_her.add_command(label="Reconstruir Resúmenes", command=self.reconstruir_resumenes)
+        menu_her.add_command(label="Conciliar Stock", command=self.conciliar_stock)
+        menu_her.add_separator()
+        menu_her.add_command(label="Importar Productos...", command=self.importar_productos)
+        menu_her.add_command(label="Exportar Productos...", command=self.exportar_productos)
     
     def crear_interfaz(self):
         main = ttk.Frame(self.root, padding=10)
@@ -628,6 +2325,10 @@ class App:
                           font=("Arial", 10, "bold"), padx=15, pady=8, relief=tk.FLAT)
             btn.pack(side=tk.LEFT, padx=5)
         
+        # Último producto que cayó en stock bajo (ver aviso_stock_bajo)
+        self.alerta_label = tk.Label(main, text="", font=("Arial", 10, "bold"), fg=self.c_peligro)
+        self.alerta_label.pack(side=tk.BOTTOM, fill=tk.X)
+        
         table_frame = ttk.Frame(main)
         table_frame.pack(fill=tk.BOTH, expand=True, pady=10)
         
@@ -653,24 +2354,85 @@ class App:
         self.tree.pack(fill=tk.BOTH, expand=True)
         self.tree.bind('<Double-1>', self.ver_detalles)
     
+    def aviso_stock_bajo(self, codigo, stock_actual, stock_minimo, fecha):
+        # Llega desde el hilo escritor
+        self.ejecutor.en_tk(
+            self.alerta_label.config,
+            {'text': f"⚠️ {fecha.strftime('%H:%M')} Stock bajo en {codigo}: "
+                     f"{stock_actual} unidades (mínimo {stock_minimo})"})
+    
     def actualizar_stats(self):
         pass  # Ya no se usa, pero se mantiene para evitar errores
     
-    def actualizar_tabla(self):
-        for item in self.tree.get_children():
-            self.tree.delete(item)
+    def valores_fila(self, p):
+        return (p.codigo, p.nombre, f"${p.precio_compra:.2f}", 
+                f"${p.precio_venta:.2f}", p.stock_actual, p.stock_minimo, p.categoria)
+    
+    def actualizar_tabla(self, codigos=None):
+        # Con codigos solo se actualizan, agregan o quitan esas filas. La
+        # tabla se rehace entera si no se indican, en la primera carga o si
+        # otra conexión cambió la base desde la última vez (data_version).
+        # La lectura va al hilo escritor, detrás de la escritura que pide
+        # el refresco; _version_tabla solo se usa desde ese hilo.
+        def leer():
+            version = self.gestor.bd.data_version()
+            completa = codigos is None or version != self._version_tabla
+            self._version_tabla = version
+            if completa:
+                return None, self.gestor.listar_productos()
+            return [(c, self.gestor.obtener_producto(c)) for c in set(codigos)], None
+        
+        def aplicar(resultado):
+            filas, productos = resultado
+            if productos is not None:
+                self.reconstruir_tabla(productos)
+            else:
+                for codigo, producto in filas:
+                    self.actualizar_fila(codigo, producto)
         
-        productos = self.gestor.listar_productos()
+        self.ejecutor.ejecutar(leer, aplicar, escritura=True)
+    
+    def reconstruir_tabla(self, productos):
+        self.tree.delete(*self.tree.get_children())
+        self._items = {}
+        self._codigo_de_item = {}
         
+        # listar_productos ya viene ordenado por código
         for p in productos:
-            valores = (p.codigo, p.nombre, f"${p.precio_compra:.2f}", 
-                      f"${p.precio_venta:.2f}", p.stock_actual, p.stock_minimo, p.categoria)
-            
             tag = 'bajo' if p.necesita_reabastecimiento() else ''
-            self.tree.insert('', tk.END, values=valores, tags=(tag,))
+            item = self.tree.insert('', tk.END, values=self.valores_fila(p), tags=(tag,))
+            self._items[p.codigo] = item
+            self._codigo_de_item[item] = p.codigo
+        self._codigos_tabla = list(self._items)
         
         self.tree.tag_configure('bajo', background='#ffe6e6')
     
+    def actualizar_fila(self, codigo, producto):
+        item = self._items.get(codigo)
+        
+        if producto is None:
+            if item is not None:
+                self.tree.delete(item)
+                del self._items[codigo]
+                del self._codigo_de_item[item]
+                del self._codigos_tabla[bisect.bisect_left(self._codigos_tabla, codigo)]
+            return
+        
+        tag = 'bajo' if producto.necesita_reabastecimiento() else ''
+        if item is not None:
+            self.tree.item(item, values=self.valores_fila(producto), tags=(tag,))
+        else:
+            posicion = bisect.bisect_left(self._codigos_tabla, codigo)
+            self._codigos_tabla.insert(posicion, codigo)
+            item = self.tree.insert('', posicion, values=self.valores_fila(producto), tags=(tag,))
+            self._items[codigo] = item
+            self._codigo_de_item[item] = codigo
+    
+    def codigo_seleccionado(self):
+        # El código tal cual; los values del Treeview convierten "007" en 7
+        sel = self.tree.selection()
+        return self._codigo_de_item.get(sel[0]) if sel else None
+    
     def ventana_agregar(self):
         v = tk.Toplevel(self.root)
         v.title("Agregar Producto")
@@ -715,14 +2477,10 @@ class App:
                     categoria=entries['categoria'].get()
                 )
                 
-                exito, msg = self.gestor.agregar_producto(producto, entries['responsable'].get())
+                responsable = entries['responsable'].get()
                 
-                if exito:
-                    messagebox.showinfo("Éxito", msg)
-                    self.actualizar_tabla()
-                    v.destroy()
-                else:
-                    messagebox.showerror("Error", msg)
+                self.escribir(lambda: self.gestor.agregar_producto(producto, responsable),
+                              [producto.codigo], v)
             except ValueError as e:
                 messagebox.showerror("Error", str(e))
         
@@ -743,9 +2501,12 @@ class App:
             messagebox.showwarning("Advertencia", "Seleccione un producto")
             return
         
-        codigo = self.tree.item(sel[0])['values'][0]
-        producto = self.gestor.bd.obtener_producto(codigo)
-        
+        codigo = self.codigo_seleccionado()
+        self.ejecutor.ejecutar(lambda: self.gestor.obtener_producto(codigo),
+                               lambda producto: self.mostrar_modificar(codigo, producto),
+                               self.mostrar_error)
+    
+    def mostrar_modificar(self, codigo, producto):
         if not producto:
             messagebox.showerror("Error", "Producto no encontrado")
             return
@@ -794,13 +2555,8 @@ class App:
                     cambios['categoria'] = entries['categoria'].get()
                 
                 if cambios:
-                    exito, msg = self.gestor.modificar_producto(codigo, **cambios)
-                    if exito:
-                        messagebox.showinfo("Éxito", msg)
-                        self.actualizar_tabla()
-                        v.destroy()
-                    else:
-                        messagebox.showerror("Error", msg)
+                    self.escribir(lambda: self.gestor.modificar_producto(codigo, **cambios),
+                                  [codigo], v)
                 else:
                     messagebox.showinfo("Info", "No hay cambios")
             except ValueError as e:
@@ -824,16 +2580,14 @@ class App:
             return
         
         valores = self.tree.item(sel[0])['values']
-        codigo = valores[0]
+        codigo = self.codigo_seleccionado()
         nombre = valores[1]
         
         if messagebox.askyesno("Confirmar", f"¿Eliminar {nombre}?"):
-            exito, msg = self.gestor.eliminar_producto(codigo)
-            if exito:
-                messagebox.showinfo("Éxito", msg)
-                self.actualizar_tabla()
-            else:
-                messagebox.showerror("Error", msg)
+            self.escribir(lambda: self.gestor.eliminar_producto(codigo), [codigo])
+    
+    LIMITE_BUSQUEDA = 200
+    ESPERA_BUSQUEDA_MS = 250
     
     def ventana_buscar(self):
         v = tk.Toplevel(self.root)
@@ -854,8 +2608,8 @@ class App:
         
         criterio_var = tk.StringVar(value="nombre")
         for texto, valor in [("Código", "codigo"), ("Nombre", "nombre"), ("Categoría", "categoria")]:
-            tk.Radiobutton(search_frame, text=texto, variable=criterio_var,
-                          value=valor, bg='white', font=("Arial", 10)).pack(side=tk.LEFT, padx=8)
+            tk.Radiobutton(search_frame, text=texto, variable=criterio_var, value=valor, bg='white',
+                          font=("Arial", 10), command=lambda: buscar()).pack(side=tk.LEFT, padx=8)
         
         # Entry de búsqueda
         input_frame = tk.Frame(frame, bg='white')
@@ -876,38 +2630,65 @@ class App:
                                                 relief=tk.SOLID, borderwidth=1)
         result_text.pack(fill=tk.BOTH, expand=True)
         
-        result_text.insert(tk.END, "Ingrese un criterio de búsqueda y presione 'Buscar'\n")
-        result_text.insert(tk.END, "O presione 'Ver Todos' para listar todos los productos...")
+        ayuda = "Escriba para buscar (o presione 'Ver Todos')..."
+        result_text.insert(tk.END, ayuda)
         result_text.config(state=tk.DISABLED)
         
-        # Función para mostrar productos
-        def mostrar_productos(productos, titulo):
+        # Se muestran como mucho LIMITE_BUSQUEDA productos; se pide uno más
+        # para saber si hay otros que no se muestran
+        limite = self.LIMITE_BUSQUEDA
+        
+        def ficha(i, p):
+            estado = "⚠️ STOCK BAJO" if p.necesita_reabastecimiento() else "✓ Stock OK"
+            return (f"{'='*65}\n"
+                    f"#{i}\n"
+                    f"Código:         {p.codigo}\n"
+                    f"Nombre:         {p.nombre}\n"
+                    f"Categoría:      {p.categoria}\n"
+                    f"Precio Compra:  ${p.precio_compra:.2f}\n"
+                    f"Precio Venta:   ${p.precio_venta:.2f}\n"
+                    f"Stock Actual:   {p.stock_actual} unidades\n"
+                    f"Stock Mínimo:   {p.stock_minimo} unidades\n"
+                    f"Estado:         {estado}\n"
+                    f"{'='*65}\n\n")
+        
+        def mostrar_texto(texto):
             result_text.config(state=tk.NORMAL)
             result_text.delete(1.0, tk.END)
+            result_text.insert(tk.END, texto)
+            result_text.config(state=tk.DISABLED)
+        
+        # Todo el texto se arma antes y se inserta de una vez
+        def mostrar_productos(productos, titulo):
+            if not productos:
+                mostrar_texto("❌ No se encontraron productos.\n\n")
+                return
             
-            if productos:
-                result_text.insert(tk.END, f"✓ {titulo}: {len(productos)} producto(s)\n\n")
-                for i, p in enumerate(productos, 1):
-                    result_text.insert(tk.END, f"{'='*65}\n")
-                    result_text.insert(tk.END, f"#{i}\n")
-                    result_text.insert(tk.END, f"Código:         {p.codigo}\n")
-                    result_text.insert(tk.END, f"Nombre:         {p.nombre}\n")
-                    result_text.insert(tk.END, f"Categoría:      {p.categoria}\n")
-                    result_text.insert(tk.END, f"Precio Compra:  ${p.precio_compra:.2f}\n")
-                    result_text.insert(tk.END, f"Precio Venta:   ${p.precio_venta:.2f}\n")
-                    result_text.insert(tk.END, f"Stock Actual:   {p.stock_actual} unidades\n")
-                    result_text.insert(tk.END, f"Stock Mínimo:   {p.stock_minimo} unidades\n")
-                    
-                    if p.necesita_reabastecimiento():
-                        result_text.insert(tk.END, f"Estado:         ⚠️ STOCK BAJO\n")
-                    else:
-                        result_text.insert(tk.END, f"Estado:         ✓ Stock OK\n")
-                    
-                    result_text.insert(tk.END, f"{'='*65}\n\n")
+            if len(productos) > limite:
+                encabezado = f"✓ {titulo}: primeros {limite} producto(s), afine la búsqueda para ver más\n\n"
             else:
-                result_text.insert(tk.END, "❌ No se encontraron productos.\n\n")
+                encabezado = f"✓ {titulo}: {len(productos)} producto(s)\n\n"
+            mostrar_texto(encabezado + "".join(ficha(i, p) for i, p in enumerate(productos[:limite], 1)))
+        
+        # Solo cuenta la última consulta: al lanzar una nueva se cancela la
+        # anterior, y una respuesta que llegue con otro número se descarta
+        busqueda = {'id_espera': None, 'tarea': None, 'numero': 0}
+        
+        def lanzar(consulta, titulo):
+            if busqueda['id_espera'] is not None:
+                v.after_cancel(busqueda['id_espera'])
+                busqueda['id_espera'] = None
+            if busqueda['tarea'] is not None:
+                self.ejecutor.cancelar(busqueda['tarea'])
+            busqueda['numero'] += 1
+            numero = busqueda['numero']
             
-            result_text.config(state=tk.DISABLED)
+            def recibir(productos):
+                if numero == busqueda['numero']:
+                    busqueda['tarea'] = None
+                    mostrar_productos(productos, titulo)
+            
+            busqueda['tarea'] = self.ejecutor.ejecutar(consulta, recibir, dueno=v)
         
         # Función buscar
         def buscar():
@@ -915,17 +2696,28 @@ class App:
             valor = entry.get().strip()
             
             if not valor:
-                messagebox.showwarning("Campo vacío", "Ingrese un valor para buscar")
-                entry.focus()
+                if busqueda['tarea'] is not None:
+                    self.ejecutor.cancelar(busqueda['tarea'])
+                busqueda['numero'] += 1
+                mostrar_texto(ayuda)
                 return
             
-            resultados = self.gestor.buscar_producto(criterio, valor)
-            mostrar_productos(resultados, f"Resultados de búsqueda por {criterio}")
+            # Por código se busca por prefijo mientras se escribe
+            por = 'codigo_prefijo' if criterio == 'codigo' else criterio
+            lanzar(lambda: self.gestor.buscar_producto(por, valor, limite + 1),
+                   f"Resultados de búsqueda por {criterio}")
+        
+        def al_escribir(event=None):
+            if event is not None and event.keysym in ("Return", "Tab", "Shift_L", "Shift_R"):
+                return
+            if busqueda['id_espera'] is not None:
+                v.after_cancel(busqueda['id_espera'])
+            busqueda['id_espera'] = v.after(self.ESPERA_BUSQUEDA_MS, buscar)
         
         # Función ver todos
         def ver_todos():
-            todos = self.gestor.listar_productos()
-            mostrar_productos(todos, "Todos los productos en inventario")
+            lanzar(lambda: self.gestor.listar_productos(limite + 1),
+                   "Todos los productos en inventario")
         
         # Botones
         btn_buscar = tk.Button(input_frame, text="🔍 Buscar", command=buscar,
@@ -938,8 +2730,90 @@ class App:
                                  relief=tk.FLAT, padx=25, pady=8, cursor='hand2')
         btn_ver_todos.pack(side=tk.LEFT, padx=5)
         
-        # Permitir buscar con Enter
+        # Busca al dejar de escribir; Enter busca sin esperar
+        entry.bind('<KeyRelease>', al_escribir)
         entry.bind('<Return>', lambda e: buscar())
+        self.cancelar_al_cerrar(v)
+        entry.focus()
+    
+    def autocompletar(self, entry, al_elegir=None, limite=8):
+        # Lista de sugerencias bajo el entry de código, por prefijo sobre el
+        # índice en memoria del gestor (no consulta la base en cada tecla)
+        lista = tk.Listbox(entry.winfo_toplevel(), height=limite, font=("Courier", 9),
+                           relief=tk.SOLID, borderwidth=1, activestyle='none')
+        sugerencias = []
+        
+        def ocultar(event=None):
+            lista.place_forget()
+        
+        def elegir(event=None):
+            sel = lista.curselection()
+            if not sel:
+                return
+            codigo = sugerencias[sel[0]][0]
+            entry.delete(0, tk.END)
+            entry.insert(0, codigo)
+            ocultar()
+            entry.focus()
+            entry.icursor(tk.END)
+            if al_elegir:
+                al_elegir()
+        
+        cargando = []
+        
+        def cargado(_):
+            cargando.clear()
+            if entry.winfo_exists():
+                sugerir()
+        
+        def al_escribir(event):
+            if event.keysym in ("Down", "Up", "Return", "Escape", "Tab"):
+                return
+            if not self.gestor.indice_cargado():
+                # El índice se lee una vez en segundo plano; al llegar se
+                # sugiere con lo escrito hasta entonces
+                if not cargando:
+                    cargando.append(self.ejecutor.ejecutar(self.gestor.indice_codigos, cargado,
+                                                           lambda e: cargando.clear(),
+                                                           dueno=entry.winfo_toplevel()))
+                return
+            sugerir()
+        
+        def sugerir():
+            prefijo = entry.get().strip()
+            sugerencias[:] = self.gestor.autocompletar_codigo(prefijo, limite) if prefijo else []
+            if not sugerencias or (len(sugerencias) == 1 and sugerencias[0][0] == prefijo):
+                ocultar()
+                return
+            
+            lista.delete(0, tk.END)
+            for codigo, nombre in sugerencias:
+                lista.insert(tk.END, f"{codigo}  {nombre}")
+            lista.config(height=len(sugerencias))
+            lista.place(in_=entry, x=0, rely=1.0, relwidth=1.0)
+            lista.lift()
+        
+        def bajar(event):
+            if lista.winfo_ismapped():
+                lista.focus()
+                lista.selection_clear(0, tk.END)
+                lista.selection_set(0)
+                lista.activate(0)
+        
+        def al_salir(event):
+            # Dar tiempo a que un clic en la lista llegue antes de ocultarla
+            def revisar():
+                if entry.winfo_exists() and entry.focus_get() is not lista:
+                    ocultar()
+            entry.after(150, revisar)
+        
+        entry.bind('<KeyRelease>', al_escribir, add='+')
+        entry.bind('<Down>', bajar, add='+')
+        entry.bind('<Escape>', ocultar, add='+')
+        entry.bind('<FocusOut>', al_salir, add='+')
+        lista.bind('<Return>', elegir)
+        lista.bind('<ButtonRelease-1>', elegir)
+        lista.bind('<Escape>', lambda e: (ocultar(), entry.focus()))
     
     def ventana_entrada(self):
         self.ventana_movimiento("ENTRADA", "📥 Entrada")
@@ -950,7 +2824,7 @@ class App:
     def ventana_movimiento(self, tipo, titulo):
         v = tk.Toplevel(self.root)
         v.title(titulo)
-        v.geometry("500x500")
+        v.geometry("500x680")
         v.resizable(False, False)
         
         frame = tk.Frame(v, bg='white', padx=30, pady=20)
@@ -976,14 +2850,23 @@ class App:
                              font=("Arial", 9), bg='#f8f9fa', fg='gray')
         info_label.pack()
         
-        # Botón buscar
+        # Botón buscar; la lectura va en segundo plano y una búsqueda nueva
+        # descarta la anterior
+        consulta = {'tarea': None}
+        
         def buscar():
             codigo = entry_codigo.get().strip()
             if not codigo:
                 info_label.config(text="⚠️ Ingrese un código primero", fg='orange')
                 return
             
-            producto = self.gestor.bd.obtener_producto(codigo)
+            if consulta['tarea'] is not None:
+                self.ejecutor.cancelar(consulta['tarea'])
+            consulta['tarea'] = self.ejecutor.ejecutar(lambda: self.gestor.obtener_producto(codigo),
+                                                       mostrar_producto, self.mostrar_error, dueno=v)
+        
+        def mostrar_producto(producto):
+            consulta['tarea'] = None
             if producto:
                 info_label.config(
                     text=f"✓ {producto.nombre}\nStock disponible: {producto.stock_actual} unidades",
@@ -998,6 +2881,8 @@ class App:
                               activebackground='#2980b9')
         btn_buscar.pack(pady=5)
         
+        self.autocompletar(entry_codigo, buscar)
+        
         # Separador
         tk.Frame(frame, height=2, bg='#ddd').pack(fill=tk.X, pady=15)
         
@@ -1013,53 +2898,102 @@ class App:
                 bg='white', anchor='w').pack(fill=tk.X, pady=(5, 2))
         entry_resp = tk.Entry(frame, width=40, font=("Arial", 11),
                              relief=tk.SOLID, borderwidth=1)
-        entry_resp.pack(pady=(0, 20))
+        entry_resp.pack(pady=(0, 10))
+        
+        # Lote: varias líneas registradas en una sola operación
+        lote = []
+        
+        lote_label = tk.Label(frame, text="Lote: 0 línea(s)", font=("Arial", 9),
+                             bg='white', fg='gray', anchor='w')
+        lote_label.pack(fill=tk.X)
+        
+        lote_lista = tk.Listbox(frame, height=5, font=("Courier", 9),
+                               relief=tk.SOLID, borderwidth=1)
+        lote_lista.pack(fill=tk.X, pady=(2, 10))
+        
+        # Lee y valida código y cantidad
+        def leer_linea():
+            codigo = entry_codigo.get().strip()
+            cantidad_str = entry_cantidad.get().strip()
+            
+            if not codigo:
+                messagebox.showwarning("Campo vacío", "Ingrese el código del producto")
+                entry_codigo.focus()
+                return None
+            
+            if not cantidad_str:
+                messagebox.showwarning("Campo vacío", "Ingrese la cantidad")
+                entry_cantidad.focus()
+                return None
+            
+            try:
+                cantidad = int(cantidad_str)
+                if cantidad <= 0:
+                    messagebox.showerror("Error", "La cantidad debe ser mayor a 0")
+                    return None
+            except ValueError:
+                messagebox.showerror("Error", "La cantidad debe ser un número entero")
+                return None
+            
+            return codigo, cantidad
+        
+        def agregar_lote():
+            linea = leer_linea()
+            if not linea:
+                return False
+            
+            codigo, cantidad = linea
+            lote.append((codigo, tipo, cantidad, None))
+            lote_lista.insert(tk.END, f"{codigo:<25} {cantidad:>10}")
+            lote_label.config(text=f"Lote: {len(lote)} línea(s)")
+            
+            entry_codigo.delete(0, tk.END)
+            entry_cantidad.delete(0, tk.END)
+            entry_codigo.focus()
+            return True
+        
+        def guardar_lote(resp):
+            if entry_codigo.get().strip() or entry_cantidad.get().strip():
+                if not agregar_lote():
+                    return
+            
+            lineas = list(lote)
+            
+            def terminado(resultado):
+                exito, resultados = resultado
+                if exito:
+                    return True, f"{len(lineas)} movimiento(s) registrados"
+                errores = [f"Línea {i} ({lineas[i - 1][0]}): {msg}"
+                           for i, (ok, msg) in enumerate(resultados, 1)
+                           if not ok and msg != self.gestor.LOTE_NO_APLICADO]
+                return False, "No se registró el lote:\n" + "\n".join(errores[:15])
+            
+            self.escribir(lambda: terminado(self.gestor.registrar_lote(lineas, resp)),
+                          [linea[0] for linea in lineas], v, "✓ Operación exitosa")
         
         # Función guardar
         def guardar():
             try:
-                codigo = entry_codigo.get().strip()
-                cantidad_str = entry_cantidad.get().strip()
                 resp = entry_resp.get().strip()
                 
-                # Validaciones
-                if not codigo:
-                    messagebox.showwarning("Campo vacío", "Ingrese el código del producto")
-                    entry_codigo.focus()
-                    return
-                
-                if not cantidad_str:
-                    messagebox.showwarning("Campo vacío", "Ingrese la cantidad")
-                    entry_cantidad.focus()
-                    return
-                
                 if not resp:
                     messagebox.showwarning("Campo vacío", "Ingrese el responsable")
                     entry_resp.focus()
                     return
                 
-                # Convertir cantidad
-                try:
-                    cantidad = int(cantidad_str)
-                    if cantidad <= 0:
-                        messagebox.showerror("Error", "La cantidad debe ser mayor a 0")
-                        return
-                except ValueError:
-                    messagebox.showerror("Error", "La cantidad debe ser un número entero")
+                if lote:
+                    guardar_lote(resp)
                     return
                 
-                # Registrar operación
-                if tipo == "ENTRADA":
-                    exito, msg = self.gestor.registrar_entrada(codigo, cantidad, resp)
-                else:
-                    exito, msg = self.gestor.registrar_salida(codigo, cantidad, resp)
+                linea = leer_linea()
+                if not linea:
+                    return
+                codigo, cantidad = linea
                 
-                if exito:
-                    messagebox.showinfo("✓ Operación exitosa", msg)
-                    self.actualizar_tabla()
-                    v.destroy()
-                else:
-                    messagebox.showerror("Error", msg)
+                # Registrar operación
+                registrar = self.gestor.registrar_entrada if tipo == "ENTRADA" else self.gestor.registrar_salida
+                self.escribir(lambda: registrar(codigo, cantidad, resp), [codigo], v,
+                              "✓ Operación exitosa")
                     
             except Exception as e:
                 messagebox.showerror("Error inesperado", str(e))
@@ -1068,6 +3002,13 @@ class App:
         btn_frame = tk.Frame(frame, bg='white')
         btn_frame.pack(pady=(10, 0))
         
+        # Botón lote
+        btn_lote = tk.Button(btn_frame, text="➕ Al lote", command=agregar_lote,
+                            bg='#3498db', fg='white', font=("Arial", 12, "bold"),
+                            relief=tk.FLAT, padx=15, pady=12, cursor='hand2',
+                            activebackground='#2980b9')
+        btn_lote.pack(side=tk.LEFT, padx=5)
+        
         # Botón guardar
         color_guardar = '#27ae60' if tipo == "ENTRADA" else '#e67e22'
         texto_guardar = "💾 Registrar Entrada" if tipo == "ENTRADA" else "💾 Registrar Salida"
@@ -1098,6 +3039,7 @@ class App:
         tk.Label(frame, text="Código del producto:").pack(anchor='w')
         entry_codigo = ttk.Entry(frame, width=40)
         entry_codigo.pack(pady=5)
+        self.autocompletar(entry_codigo)
         
         tk.Label(frame, text="Cantidad a devolver:").pack(anchor='w', pady=(10, 0))
         entry_cantidad = ttk.Entry(frame, width=40)
@@ -1126,16 +3068,9 @@ class App:
                     messagebox.showwarning("Advertencia", "Complete todos los campos")
                     return
                 
-                exito, msg = self.gestor.registrar_devolucion(
-                    codigo, int(cantidad), motivo, resp
-                )
-                
-                if exito:
-                    messagebox.showinfo("Éxito", msg)
-                    self.actualizar_tabla()
-                    v.destroy()
-                else:
-                    messagebox.showerror("Error", msg)
+                cantidad = int(cantidad)
+                self.escribir(lambda: self.gestor.registrar_devolucion(codigo, cantidad, motivo, resp),
+                              [codigo], v)
             except ValueError:
                 messagebox.showerror("Error", "La cantidad debe ser un número")
             except Exception as e:
@@ -1166,6 +3101,7 @@ class App:
         tk.Label(frame, text="Código del producto:").pack(anchor='w')
         entry_codigo = ttk.Entry(frame, width=40)
         entry_codigo.pack(pady=5)
+        self.autocompletar(entry_codigo)
         
         tk.Label(frame, text="Tipo de pérdida:").pack(anchor='w', pady=(10, 0))
         tipo_var = tk.StringVar(value="robo")
@@ -1202,16 +3138,9 @@ class App:
                     messagebox.showwarning("Advertencia", "Complete todos los campos")
                     return
                 
-                exito, msg = self.gestor.registrar_perdida(
-                    codigo, int(cantidad), tipo, motivo, resp
-                )
-                
-                if exito:
-                    messagebox.showinfo("Éxito", msg)
-                    self.actualizar_tabla()
-                    v.destroy()
-                else:
-                    messagebox.showerror("Error", msg)
+                cantidad = int(cantidad)
+                self.escribir(lambda: self.gestor.registrar_perdida(codigo, cantidad, tipo, motivo, resp),
+                              [codigo], v)
             except ValueError:
                 messagebox.showerror("Error", "La cantidad debe ser un número")
             except Exception as e:
@@ -1239,29 +3168,35 @@ class App:
         tk.Label(frame, text="📊 REPORTE GENERAL", 
                 font=("Arial", 16, "bold")).pack(pady=20)
         
-        reporte = self.gestor.reporte_general()
-        
         info = tk.Frame(frame, relief=tk.RAISED, borderwidth=2)
         info.pack(fill=tk.BOTH, expand=True)
         
-        datos = [
-            ("📦 Total Productos:", reporte['total_productos']),
-            ("🏷️ Categorías:", reporte['categorias']),
-            ("💰 Valor Inventario:", f"${reporte['valor_inventario']:.2f}"),
-            ("⚠️ Stock Bajo:", reporte['productos_bajo_stock']),
-            ("📝 Movimientos:", reporte['total_movimientos'])
-        ]
-        
-        for label, valor in datos:
+        etiquetas = {}
+        for clave, label in [('total_productos', "📦 Total Productos:"),
+                             ('categorias', "🏷️ Categorías:"),
+                             ('valor_inventario', "💰 Valor Inventario:"),
+                             ('productos_bajo_stock', "⚠️ Stock Bajo:"),
+                             ('total_movimientos', "📝 Movimientos:")]:
             f = tk.Frame(info)
             f.pack(fill=tk.X, padx=20, pady=10)
             tk.Label(f, text=label, font=("Arial", 11), anchor='w').pack(side=tk.LEFT)
-            tk.Label(f, text=str(valor), font=("Arial", 11, "bold"),
-                    fg=self.c_acento, anchor='e').pack(side=tk.RIGHT)
+            etiquetas[clave] = tk.Label(f, text="Cargando...", font=("Arial", 11, "bold"),
+                                        fg=self.c_acento, anchor='e')
+            etiquetas[clave].pack(side=tk.RIGHT)
+        
+        def mostrar(reporte):
+            reporte['valor_inventario'] = f"${reporte['valor_inventario']:.2f}"
+            for clave, etiqueta in etiquetas.items():
+                etiqueta.config(text=str(reporte[clave]))
+        
+        self.cancelar_al_cerrar(v)
+        self.ejecutor.ejecutar(self.gestor.reporte_general, mostrar, dueno=v)
     
     def reporte_stock_bajo(self):
-        productos = self.gestor.productos_con_stock_bajo()
-        
+        # La ventana solo se abre si hay productos, así que se consulta antes
+        self.ejecutor.ejecutar(self.gestor.productos_con_stock_bajo, self.mostrar_stock_bajo)
+    
+    def mostrar_stock_bajo(self, productos):
         if not productos:
             messagebox.showinfo("Stock Bajo", "Stock suficiente")
             return
@@ -1290,26 +3225,96 @@ class App:
     def reporte_vendidos(self):
         v = tk.Toplevel(self.root)
         v.title("Más Vendidos")
-        v.geometry("600x400")
+        v.geometry("700x520")
         
         frame = ttk.Frame(v, padding=20)
         frame.pack(fill=tk.BOTH, expand=True)
         
         tk.Label(frame, text="🏆 MÁS VENDIDOS", font=("Arial", 14, "bold")).pack(pady=20)
         
-        result_text = scrolledtext.ScrolledText(frame, height=15, font=("Courier", 10))
-        result_text.pack(fill=tk.BOTH, expand=True)
+        # Filtros: periodo, categoría, criterio y tamaño del top
+        periodo_frame = ttk.Frame(frame)
+        periodo_frame.pack(fill=tk.X, pady=5)
+        
+        tk.Label(periodo_frame, text="Periodo:", font=("Arial", 10)).pack(side=tk.LEFT, padx=5)
+        periodo_var = tk.StringVar(value="todo")
+        for texto, valor in [("Hoy", "hoy"), ("7 días", "7"), ("30 días", "30"),
+                             ("Este año", "anio"), ("Todo", "todo")]:
+            tk.Radiobutton(periodo_frame, text=texto, variable=periodo_var, value=valor,
+                          font=("Arial", 9), command=lambda: actualizar()).pack(side=tk.LEFT, padx=3)
+        
+        opciones_frame = ttk.Frame(frame)
+        opciones_frame.pack(fill=tk.X, pady=5)
+        
+        tk.Label(opciones_frame, text="Categoría:", font=("Arial", 10)).pack(side=tk.LEFT, padx=5)
+        categoria_var = tk.StringVar(value="Todas")
+        combo_categoria = ttk.Combobox(opciones_frame, textvariable=categoria_var, state="readonly",
+                                       values=["Todas"], width=15)
+        combo_categoria.pack(side=tk.LEFT, padx=5)
+        combo_categoria.bind('<<ComboboxSelected>>', lambda e: actualizar())
+        
+        orden_var = tk.StringVar(value="cantidad")
+        for texto, valor in [("Unidades", "cantidad"), ("Ingresos", "ingresos")]:
+            tk.Radiobutton(opciones_frame, text=texto, variable=orden_var, value=valor,
+                          font=("Arial", 9), command=lambda: actualizar()).pack(side=tk.LEFT, padx=3)
+        
+        tk.Label(opciones_frame, text="Top:", font=("Arial", 10)).pack(side=tk.LEFT, padx=5)
+        top_var = tk.StringVar(value="5")
+        top_spin = tk.Spinbox(opciones_frame, from_=1, to=100, textvariable=top_var, width=4,
+                              command=lambda: actualizar())
+        top_spin.pack(side=tk.LEFT)
+        top_spin.bind('<Return>', lambda e: actualizar())
         
-        resultado = self.gestor.productos_mas_vendidos(5)
+        result_text = scrolledtext.ScrolledText(frame, height=15, font=("Courier", 10))
+        result_text.pack(fill=tk.BOTH, expand=True, pady=10)
+        
+        def rango_periodo():
+            ahora = datetime.now()
+            hoy = ahora.replace(hour=0, minute=0, second=0, microsecond=0)
+            periodo = periodo_var.get()
+            if periodo == "hoy":
+                return hoy, None
+            if periodo == "anio":
+                return hoy.replace(month=1, day=1), None
+            if periodo == "todo":
+                return None, None
+            return hoy - timedelta(days=int(periodo) - 1), None
+        
+        consulta = {'tarea': None}
+        
+        def mostrar(resultado):
+            result_text.delete('1.0', tk.END)
+            if resultado:
+                lineas = [f"{'#':<5} {'Producto':<40} {'Vendidos':>10} {'Ingresos':>12}", "=" * 70]
+                for i, (nombre, cantidad, ingresos) in enumerate(resultado, 1):
+                    lineas.append(f"{i:<5} {nombre:<40} {cantidad:>10} {ingresos:>12.2f}")
+                result_text.insert(tk.END, "\n".join(lineas) + "\n")
+            else:
+                result_text.insert(tk.END, "No hay ventas")
         
-        if resultado:
-            result_text.insert(tk.END, f"{'#':<5} {'Producto':<40} {'Vendidos':<10}\n")
-            result_text.insert(tk.END, "="*60 + "\n")
+        def actualizar():
+            try:
+                top = max(1, int(top_var.get()))
+            except ValueError:
+                top = 5
+            desde, hasta = rango_periodo()
+            categoria = None if categoria_var.get() == "Todas" else categoria_var.get()
+            orden = orden_var.get()
             
-            for i, (nombre, cantidad) in enumerate(resultado, 1):
-                result_text.insert(tk.END, f"{i:<5} {nombre:<40} {cantidad:<10}\n")
-        else:
-            result_text.insert(tk.END, "No hay ventas")
+            # Un cambio de filtro deja obsoleta la consulta anterior
+            if consulta['tarea'] is not None:
+                self.ejecutor.cancelar(consulta['tarea'])
+            result_text.delete('1.0', tk.END)
+            result_text.insert(tk.END, "Cargando...")
+            consulta['tarea'] = self.ejecutor.ejecutar(
+                lambda: self.gestor.productos_mas_vendidos(top, desde, hasta, categoria, orden),
+                mostrar, dueno=v)
+        
+        self.cancelar_al_cerrar(v)
+        self.ejecutor.ejecutar(self.gestor.bd.obtener_categorias,
+                               lambda categorias: combo_categoria.config(values=["Todas"] + categorias),
+                               dueno=v)
+        actualizar()
     
     def reporte_historial(self):
         v = tk.Toplevel(self.root)
@@ -1321,21 +3326,29 @@ class App:
         
         tk.Label(frame, text="📝 HISTORIAL", font=("Arial", 14, "bold")).pack(pady=20)
         
-        tree = ttk.Treeview(frame,
+        table_frame = ttk.Frame(frame)
+        table_frame.pack(fill=tk.BOTH, expand=True)
+        
+        scroll_y = ttk.Scrollbar(table_frame)
+        scroll_y.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        tree = ttk.Treeview(table_frame,
                            columns=("Fecha", "Tipo", "Producto", "Cantidad", "Responsable"),
                            show='headings', height=20)
         
         for col in ["Fecha", "Tipo", "Producto", "Cantidad", "Responsable"]:
             tree.heading(col, text=col)
         
-        movimientos = self.gestor.obtener_historial(50)
-        
-        for m in movimientos:
-            fecha_str = m.fecha.strftime("%Y-%m-%d %H:%M")
-            tree.insert('', tk.END, values=(fecha_str, m.tipo, m.producto_nombre,
-                                           m.cantidad, m.responsable))
-        
         tree.pack(fill=tk.BOTH, expand=True)
+        
+        self.cancelar_al_cerrar(v)
+        cargar_historial = self.paginar_tabla(
+            tree, scroll_y,
+            lambda cursor, limite: self.gestor.pagina_historial(cursor, limite=limite),
+            lambda m: (m.fecha.strftime("%Y-%m-%d %H:%M"), m.tipo, m.producto_nombre,
+                       m.cantidad, m.responsable)
+        )
+        cargar_historial()
     
     def reporte_perdidas(self):
         v = tk.Toplevel(self.root)
@@ -1378,12 +3391,10 @@ class App:
         tree_resumen.column("Cantidad", width=150, anchor=tk.CENTER)
         tree_resumen.column("Valor", width=150, anchor=tk.CENTER)
         
-        def actualizar_resumen():
+        def mostrar_resumen(perdidas_totales):
             for item in tree_resumen.get_children():
                 tree_resumen.delete(item)
             
-            perdidas_totales = self.gestor.calcular_perdidas_totales()
-            
             total_cant = 0
             total_val = 0
             
@@ -1400,7 +3411,8 @@ class App:
                 tree_resumen.tag_configure('total', background='#ffcccc', font=('Arial', 10, 'bold'))
         
         tree_resumen.pack(pady=10, padx=10)
-        actualizar_resumen()
+        self.cancelar_al_cerrar(v)
+        self.ejecutor.ejecutar(self.gestor.calcular_perdidas_totales, mostrar_resumen, dueno=v)
         
         # Detalle de pérdidas
         tk.Label(frame, text="DETALLE DE PÉRDIDAS", font=("Arial", 11, "bold"), 
@@ -1414,9 +3426,7 @@ class App:
         
         tree_detalle = ttk.Treeview(detalle_frame,
                                     columns=("Fecha", "Producto", "Cantidad", "Tipo", "Motivo", "Responsable"),
-                                    show='headings', yscrollcommand=scroll_y.set, height=12)
-        
-        scroll_y.config(command=tree_detalle.yview)
+                                    show='headings', height=12)
         
         tree_detalle.heading("Fecha", text="Fecha")
         tree_detalle.heading("Producto", text="Producto")
@@ -1432,36 +3442,47 @@ class App:
         tree_detalle.column("Motivo", width=200)
         tree_detalle.column("Responsable", width=130)
         
-        def actualizar_detalle():
-            for item in tree_detalle.get_children():
-                tree_detalle.delete(item)
-            
-            tipo_filtro = None if tipo_var.get() == "todas" else tipo_var.get()
-            perdidas = self.gestor.obtener_perdidas(tipo_filtro)
+        def valores_detalle(p):
+            fecha_str = p.fecha.strftime("%Y-%m-%d %H:%M")
             
-            if perdidas:
-                for p in perdidas[:50]:  # Últimas 50
-                    fecha_str = p.fecha.strftime("%Y-%m-%d %H:%M")
-                    
-                    # Extraer tipo del motivo
-                    tipo_display = "Otro"
-                    for tipo in ['ROBO', 'MERMA', 'CADUCIDAD', 'DAÑO']:
-                        if tipo in p.motivo:
-                            tipo_display = tipo.capitalize()
-                            break
-                    
-                    motivo_limpio = p.motivo.replace(f"[{tipo_display.upper()}] ", "")
-                    
-                    tree_detalle.insert('', tk.END, 
-                                       values=(fecha_str, p.producto_nombre, p.cantidad, 
-                                              tipo_display, motivo_limpio, p.responsable))
+            tipo_display = p.tipo_perdida.capitalize() if p.tipo_perdida else "Otro"
+            motivo_limpio = (p.motivo or "").replace(f"[{tipo_display.upper()}] ", "")
             
-            info_text = f"Total de pérdidas: {len(perdidas)}"
+            return (fecha_str, p.producto_nombre, p.cantidad,
+                    tipo_display, motivo_limpio, p.responsable)
+        
+        # Se fija en el hilo de Tk al aplicar el filtro; las páginas se leen en otro hilo
+        filtro = {'tipo': None}
+        
+        tree_detalle.pack(fill=tk.BOTH, expand=True)
+        
+        info_label = tk.Label(frame, text="", font=("Arial", 9, "italic"), bg='white', fg='gray')
+        info_label.pack()
+        
+        reiniciar_detalle = self.paginar_tabla(
+            tree_detalle, scroll_y,
+            lambda cursor, limite: self.gestor.pagina_perdidas(filtro['tipo'], cursor, limite=limite),
+            valores_detalle
+        )
+        consulta = {'tarea': None}
+        
+        def mostrar_total(total, tipo_filtro):
+            info_text = f"Total de pérdidas: {total}"
             if tipo_filtro:
                 info_text += f" (filtradas por {tipo_filtro})"
-            tk.Label(frame, text=info_text, font=("Arial", 9, "italic"), bg='white', fg='gray').pack()
+            info_label.config(text=info_text)
         
-        tree_detalle.pack(fill=tk.BOTH, expand=True)
+        def actualizar_detalle():
+            tipo_filtro = None if tipo_var.get() == "todas" else tipo_var.get()
+            filtro['tipo'] = tipo_filtro
+            reiniciar_detalle()
+            
+            if consulta['tarea'] is not None:
+                self.ejecutor.cancelar(consulta['tarea'])
+            info_label.config(text="Cargando...")
+            consulta['tarea'] = self.ejecutor.ejecutar(
+                lambda: self.gestor.contar_perdidas(tipo_filtro),
+                lambda total: mostrar_total(total, tipo_filtro), dueno=v)
         
         btn_actualizar = tk.Button(filtro_frame, text="🔄 Aplicar Filtro", command=actualizar_detalle,
                                    bg=self.c_acento, fg='white', font=("Arial", 9, "bold"),
@@ -1470,6 +3491,57 @@ class App:
         
         actualizar_detalle()
     
+    def paginar_tabla(self, tree, scroll_y, obtener_pagina, valores, tamano=100):
+        # Carga la siguiente página (keyset por fecha e id) cuando el usuario
+        # llega al final del scroll. Devuelve la función que (re)carga desde
+        # la primera página. Las páginas se leen en segundo plano; mientras
+        # llega una se muestra una fila "Cargando..." al final.
+        estado = {'cursor': None, 'fin': False, 'tarea': None, 'fila_carga': None}
+        ventana = tree.winfo_toplevel()
+        
+        def recibir(pagina):
+            estado['tarea'] = None
+            tree.delete(estado['fila_carga'])
+            for m in pagina:
+                tree.insert('', tk.END, values=valores(m))
+            
+            if pagina:
+                estado['cursor'] = (pagina[-1].fecha, pagina[-1].id_movimiento)
+            estado['fin'] = len(pagina) < tamano
+        
+        def fallar(error):
+            # Se quita la fila de carga; al volver al final se reintenta
+            estado['tarea'] = None
+            tree.delete(estado['fila_carga'])
+            messagebox.showerror("Error", str(error), parent=ventana)
+        
+        def cargar():
+            if estado['fin'] or estado['tarea'] is not None:
+                return
+            
+            cursor = estado['cursor']
+            estado['fila_carga'] = tree.insert('', tk.END, values=("Cargando...",))
+            estado['tarea'] = self.ejecutor.ejecutar(
+                lambda: obtener_pagina(cursor, tamano), recibir, fallar, dueno=ventana)
+        
+        def al_desplazar(primero, ultimo):
+            scroll_y.set(primero, ultimo)
+            if float(ultimo) >= 1.0:
+                cargar()
+        
+        def reiniciar():
+            if estado['tarea'] is not None:
+                self.ejecutor.cancelar(estado['tarea'])
+                estado['tarea'] = None
+            tree.delete(*tree.get_children())
+            estado['cursor'] = None
+            estado['fin'] = False
+            cargar()
+        
+        tree.config(yscrollcommand=al_desplazar)
+        scroll_y.config(command=tree.yview)
+        return reiniciar
+    
     def reporte_devoluciones(self):
         v = tk.Toplevel(self.root)
         v.title("Historial de Devoluciones")
@@ -1481,25 +3553,13 @@ class App:
         tk.Label(frame, text="🔄 HISTORIAL DE DEVOLUCIONES", 
                 font=("Arial", 16, "bold"), bg='white', fg=self.c_acento).pack(pady=(0, 20))
         
-        devoluciones = self.gestor.obtener_devoluciones()
-        
-        if not devoluciones:
-            tk.Label(frame, text="No hay devoluciones registradas", 
-                    font=("Arial", 14), bg='white', fg='gray').pack(pady=100)
-            return
-        
         # Estadísticas
-        cantidad_total, valor_total = self.gestor.calcular_valor_devoluciones()
-        
         stats_frame = tk.Frame(frame, bg='#e3f2fd', relief=tk.SOLID, borderwidth=1)
         stats_frame.pack(fill=tk.X, pady=10)
         
-        stats_info = f"📊 Total de devoluciones: {len(devoluciones)}  |  " \
-                    f"📦 Unidades devueltas: {cantidad_total}  |  " \
-                    f"💰 Valor estimado: ${valor_total:.2f}"
-        
-        tk.Label(stats_frame, text=stats_info, font=("Arial", 11, "bold"), 
-                bg='#e3f2fd', fg='#1565c0').pack(pady=12)
+        stats_label = tk.Label(stats_frame, text="Cargando...", font=("Arial", 11, "bold"), 
+                               bg='#e3f2fd', fg='#1565c0')
+        stats_label.pack(pady=12)
         
         # Tabla de devoluciones
         table_frame = tk.Frame(frame, bg='white')
@@ -1510,9 +3570,7 @@ class App:
         
         tree = ttk.Treeview(table_frame,
                            columns=("Fecha", "Producto", "Cantidad", "Motivo", "Responsable"),
-                           show='headings', yscrollcommand=scroll_y.set, height=18)
-        
-        scroll_y.config(command=tree.yview)
+                           show='headings', height=18)
         
         tree.heading("Fecha", text="Fecha y Hora")
         tree.heading("Producto", text="Producto")
@@ -1526,39 +3584,130 @@ class App:
         tree.column("Motivo", width=280)
         tree.column("Responsable", width=150)
         
-        for d in devoluciones:
-            fecha_str = d.fecha.strftime("%Y-%m-%d %H:%M:%S")
-            tree.insert('', tk.END, 
-                       values=(fecha_str, d.producto_nombre, d.cantidad, d.motivo, d.responsable))
-        
         tree.pack(fill=tk.BOTH, expand=True)
         
+        self.cancelar_al_cerrar(v)
+        reiniciar_tabla = self.paginar_tabla(
+            tree, scroll_y,
+            lambda cursor, limite: self.gestor.pagina_devoluciones(cursor, limite=limite),
+            lambda d: (d.fecha.strftime("%Y-%m-%d %H:%M:%S"), d.producto_nombre,
+                       d.cantidad, d.motivo, d.responsable)
+        )
+        
+        def leer_estadisticas():
+            return (self.gestor.contar_devoluciones(),) + self.gestor.calcular_valor_devoluciones()
+        
+        def mostrar_estadisticas(estadisticas):
+            total, cantidad_total, valor_total = estadisticas
+            if not total:
+                stats_label.config(text="No hay devoluciones registradas")
+                return
+            stats_label.config(text=f"📊 Total de devoluciones: {total}  |  "
+                                    f"📦 Unidades devueltas: {cantidad_total}  |  "
+                                    f"💰 Valor estimado: ${valor_total:.2f}")
+        
+        def actualizar():
+            self.ejecutor.cancelar_de(v)
+            stats_label.config(text="Cargando...")
+            reiniciar_tabla()
+            self.ejecutor.ejecutar(leer_estadisticas, mostrar_estadisticas, dueno=v)
+        
+        actualizar()
+        
         # Botón exportar (placeholder)
         btn_frame = tk.Frame(frame, bg='white')
         btn_frame.pack(pady=10)
         
         tk.Button(btn_frame, text="🔄 Actualizar", 
-                 command=lambda: [v.destroy(), self.reporte_devoluciones()],
+                 command=actualizar,
                  bg=self.c_acento, fg='white', font=("Arial", 10, "bold"),
                  relief=tk.FLAT, padx=20, pady=8, cursor='hand2').pack(side=tk.LEFT, padx=5)
     
     def cancelar_operacion(self):
         if messagebox.askyesno("Confirmar", "¿Cancelar última operación?"):
-            exito, msg = self.gestor.cancelar_ultima_operacion()
-            if exito:
-                messagebox.showinfo("Éxito", msg)
-                self.actualizar_tabla()
-            else:
-                messagebox.showerror("Error", msg)
+            codigos = []
+            
+            def cancelar():
+                exito, msg, codigo = self.gestor.cancelar_ultima_operacion()
+                if codigo is not None:
+                    codigos.append(codigo)
+                return exito, msg
+            
+            # codigos se llena en el hilo escritor antes de que se refresque la tabla
+            self.escribir(cancelar, codigos)
+    
+    def reconstruir_resumenes(self):
+        if not messagebox.askyesno("Confirmar", "¿Recalcular los resúmenes desde los movimientos?"):
+            return
+        
+        def reconstruir():
+            self.gestor.recalcular_resumen()
+            filas = self.gestor.reconstruir_resumen_diario()
+            return True, f"Resúmenes reconstruidos ({filas} filas diarias)"
+        
+        self.escribir(reconstruir, titulo="Resúmenes")
+    
+    def conciliar_stock(self):
+        if not messagebox.askyesno("Confirmar", "¿Comparar el stock con el libro de movimientos "
+                                                "y corregir las diferencias?"):
+            return
+        
+        # Se llena en el hilo escritor; escribir refresca esas filas al terminar
+        reparados = []
+        
+        def conciliar():
+            resultado = self.gestor.reconciliar(reparar=True)
+            reparados.extend(codigo for codigo, _, _ in resultado['reparados'])
+            pendientes = [codigo for codigo, _, _ in resultado['diferencias'] if codigo not in reparados]
+            msg = f"{resultado['productos']} productos revisados, {len(reparados)} corregidos"
+            if pendientes:
+                msg += f"\nSin corregir (saldo negativo en el libro): {', '.join(pendientes[:20])}"
+            return True, msg
+        
+        self.escribir(conciliar, reparados, titulo="Conciliación")
+    
+    def importar_productos(self):
+        archivo = filedialog.askopenfilename(
+            title="Importar productos",
+            filetypes=[("CSV", "*.csv"), ("JSON Lines", "*.jsonl"), ("Todos", "*.*")])
+        if not archivo:
+            return
+        
+        def mostrar(resumen):
+            info = f"Nuevos: {resumen['nuevos']}\n" \
+                   f"Actualizados: {resumen['actualizados']}\n" \
+                   f"Rechazados: {resumen['rechazados']}"
+            for num, error in resumen['errores'][:10]:
+                info += f"\n  Línea {num}: {error}"
+            
+            messagebox.showinfo("Importación", info)
+            self.actualizar_tabla()
+        
+        # Errores de lectura (OSError, csv.Error) se muestran con showerror
+        self.ejecutor.ejecutar(lambda: self.gestor.importar_productos(archivo), mostrar,
+                               escritura=True)
+    
+    def exportar_productos(self):
+        archivo = filedialog.asksaveasfilename(
+            title="Exportar productos", defaultextension=".csv",
+            filetypes=[("CSV", "*.csv"), ("JSON Lines", "*.jsonl")])
+        if not archivo:
+            return
+        
+        self.ejecutor.ejecutar(
+            lambda: self.gestor.exportar_productos(archivo),
+            lambda total: messagebox.showinfo("Exportación", f"{total} producto(s) exportados"))
     
     def ver_detalles(self, event):
         sel = self.tree.selection()
         if not sel:
             return
         
-        codigo = self.tree.item(sel[0])['values'][0]
-        producto = self.gestor.bd.obtener_producto(codigo)
-        
+        codigo = self.codigo_seleccionado()
+        self.ejecutor.ejecutar(lambda: self.gestor.obtener_producto(codigo), self.mostrar_detalles,
+                               self.mostrar_error)
+    
+    def mostrar_detalles(self, producto):
         if producto:
             info = f"""
 Código:    {producto.codigo}
@@ -1574,12 +3723,262 @@ Mínimo:    {producto.stock_minimo}
             messagebox.showinfo("Detalles", info)
 
 
+# ============================================================
+# LÍNEA DE COMANDOS
+# ============================================================
+#
+#   python -m Inventory salida P001 3 -r "Caja 1"
+#   python -m Inventory reporte vendidos --desde 2024-01-01 --json
+#
+# Sin subcomando abre la interfaz gráfica. Termina con 0 si la operación
+# se hizo, 1 si fue rechazada y 2 si los argumentos no son válidos.
+
+def fecha_argumento(texto):
+    return datetime.strptime(texto, "%Y-%m-%d")
+
+
+def producto_a_dict(p):
+    return {campo: getattr(p, campo) for campo in Gestor.CAMPOS_PRODUCTO}
+
+
+def movimiento_a_dict(m):
+    return {'fecha': m.fecha.strftime("%Y-%m-%d %H:%M:%S"), 'tipo': m.tipo,
+            'codigo': m.producto_codigo, 'producto': m.producto_nombre, 'cantidad': m.cantidad,
+            'responsable': m.responsable, 'motivo': m.motivo}
+
+
+def _cmd_movimiento(gestor, args):
+    if args.comando == "entrada":
+        return gestor.registrar_entrada(args.codigo, args.cantidad, args.responsable)
+    if args.comando == "salida":
+        return gestor.registrar_salida(args.codigo, args.cantidad, args.responsable)
+    if args.comando == "devolucion":
+        return gestor.registrar_devolucion(args.codigo, args.cantidad, args.motivo, args.responsable)
+    return gestor.registrar_perdida(args.codigo, args.cantidad, args.tipo, args.motivo, args.responsable)
+
+
+def _cmd_lote(gestor, args):
+    # CSV con columnas codigo, tipo, cantidad y motivo (opcional)
+    with open(args.archivo, newline='', encoding='utf-8-sig') as f:
+        lineas = [(fila['codigo'], fila['tipo'].upper(), fila['cantidad'], fila.get('motivo') or None)
+                  for fila in csv.DictReader(f)]
+    exito, resultados = gestor.registrar_lote(lineas, args.responsable, not args.parcial)
+    errores = [{'linea': i, 'codigo': lineas[i - 1][0], 'error': msg}
+               for i, (ok, msg) in enumerate(resultados, 1)
+               if not ok and msg != gestor.LOTE_NO_APLICADO]
+    if exito:
+        return True, f"{len(lineas) - len(errores)} movimiento(s) registrados"
+    return False, errores
+
+
+def _cmd_cancelar(gestor, args):
+    exito, msg, _ = gestor.cancelar_ultima_operacion()
+    return exito, msg
+
+
+def _cmd_importar(gestor, args):
+    resumen = gestor.importar_productos(args.archivo, args.formato, args.responsable)
+    resumen['errores'] = [{'linea': num, 'error': error} for num, error in resumen['errores']]
+    return True, resumen
+
+
+def _cmd_exportar(gestor, args):
+    return True, f"{gestor.exportar_productos(args.archivo, args.formato)} producto(s) exportados"
+
+
+def _cmd_producto(gestor, args):
+    producto = gestor.obtener_producto(args.codigo)
+    if not producto:
+        return False, "Producto no encontrado"
+    return True, producto_a_dict(producto)
+
+
+def _cmd_buscar(gestor, args):
+    return True, [producto_a_dict(p) for p in gestor.buscar_producto(args.por, args.texto, args.limite)]
+
+
+REPORTES = ("general", "stock-bajo", "ventas", "vendidos", "perdidas", "devoluciones", "serie", "historial")
+
+
+def generar_reporte(gestor, tipo, desde=None, hasta=None, limite=10, categoria=None,
+                    orden="cantidad", periodo="mes"):
+    # Datos del reporte listos para JSON; lo usan la línea de comandos y el servidor
+    if tipo == "general":
+        return gestor.reporte_general()
+    if tipo == "stock-bajo":
+        return [producto_a_dict(p) for p in gestor.productos_con_stock_bajo()]
+    if tipo == "ventas":
+        return gestor.calcular_ventas(desde, hasta)
+    if tipo == "vendidos":
+        return [{'producto': nombre, 'unidades': unidades, 'ingresos': ingresos}
+                for nombre, unidades, ingresos
+                in gestor.productos_mas_vendidos(limite, desde, hasta, categoria, orden)]
+    if tipo == "perdidas":
+        return gestor.calcular_perdidas_totales()
+    if tipo == "devoluciones":
+        cantidad, valor = gestor.calcular_valor_devoluciones()
+        return {'devoluciones': gestor.contar_devoluciones(), 'cantidad': cantidad, 'valor': valor}
+    if tipo == "serie":
+        return [{'periodo': clave, 'cantidad': cantidad, 'valor': valor}
+                for clave, cantidad, valor in gestor.ventas_por_periodo(periodo, desde, hasta)]
+    if tipo == "historial":
+        return [movimiento_a_dict(m) for m in gestor.obtener_historial(limite)]
+    raise ValueError(f"Reporte desconocido: {tipo}")
+
+
+def _cmd_reporte(gestor, args):
+    return True, generar_reporte(gestor, args.tipo, args.desde, args.hasta, args.limite,
+                                 args.categoria, args.orden, args.periodo)
+
+
+def _cmd_mantenimiento(gestor, args):
+    if args.tarea == "recalcular":
+        gestor.recalcular_resumen()
+        filas = gestor.reconstruir_resumen_diario()
+        return True, f"Resúmenes reconstruidos ({filas} filas diarias)"
+    if args.tarea == "alertas":
+        return True, [{'codigo': codigo, 'stock_actual': stock, 'stock_minimo': minimo,
+                       'fecha': fecha.strftime("%Y-%m-%d %H:%M:%S")}
+                      for codigo, stock, minimo, fecha in gestor.bd.tomar_alertas_stock()]
+    conn = gestor.bd.conectar()
+    conn.execute('PRAGMA optimize')
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    return True, "Base optimizada"
+
+
+def _cmd_conciliar(gestor, args):
+    resultado = gestor.reconciliar(args.reparar, not args.sin_snapshot, args.procesos)
+    reparados = {codigo for codigo, _, _ in resultado['reparados']}
+    diferencias = [{'codigo': codigo, 'stock_actual': stock, 'stock_libro': saldo,
+                    'reparado': codigo in reparados}
+                   for codigo, stock, saldo in resultado['diferencias']]
+    # Falla (código de salida 1) si quedan diferencias sin reparar
+    return all(d['reparado'] for d in diferencias), {
+        'productos': resultado['productos'],
+        'movimientos': f"{resultado['desde_movimiento'] + 1}-{resultado['hasta_movimiento']}",
+        'snapshot': resultado['snapshot'],
+        'diferencias': diferencias,
+    }
+
+
+def _imprimir(datos):
+    if isinstance(datos, str):
+        print(datos)
+    elif isinstance(datos, dict):
+        for clave, valor in datos.items():
+            if isinstance(valor, list):
+                print(f"{clave}: {len(valor)}")
+                _imprimir(valor)
+                continue
+            if isinstance(valor, dict):
+                valor = ", ".join(f"{k}={v}" for k, v in valor.items())
+            print(f"{clave}: {valor}")
+    else:
+        for fila in datos:
+            print("\t".join(str(valor) for valor in fila.values()))
+
+
+def crear_parser():
+    import argparse
+    
+    parser = argparse.ArgumentParser(prog="python -m Inventory",
+                                     description="Inventario desde la línea de comandos")
+    parser.add_argument('--base', default=os.environ.get("INVENTARIO_DB", "inventario.db"),
+                        help="archivo de la base (por defecto $INVENTARIO_DB o inventario.db)")
+    parser.add_argument('--json', action='store_true', help="salida en JSON")
+    sub = parser.add_subparsers(dest='comando', metavar='comando')
+    
+    # Las mismas opciones valen también después del subcomando
+    comunes = argparse.ArgumentParser(add_help=False)
+    comunes.add_argument('--base', default=argparse.SUPPRESS)
+    comunes.add_argument('--json', action='store_true', default=argparse.SUPPRESS)
+    
+    def comando(nombre, funcion, ayuda, responsable=False):
+        p = sub.add_parser(nombre, help=ayuda, parents=[comunes])
+        p.set_defaults(funcion=funcion)
+        if responsable:
+            p.add_argument('-r', '--responsable', default="Sistema")
+        return p
+    
+    # Movimientos
+    for nombre, ayuda in [("entrada", "registrar una entrada"), ("salida", "registrar una venta"),
+                          ("devolucion", "registrar una devolución"), ("perdida", "registrar una pérdida")]:
+        p = comando(nombre, _cmd_movimiento, ayuda, responsable=True)
+        p.add_argument('codigo')
+        p.add_argument('cantidad', type=int)
+        if nombre == "perdida":
+            p.add_argument('tipo', choices=TIPOS_PERDIDA)
+        if nombre in ("devolucion", "perdida"):
+            p.add_argument('motivo')
+    
+    p = comando("lote", _cmd_lote, "registrar movimientos desde un CSV (codigo,tipo,cantidad,motivo)",
+                responsable=True)
+    p.add_argument('archivo')
+    p.add_argument('--parcial', action='store_true', help="aplicar las líneas válidas aunque otras fallen")
+    comando("cancelar", _cmd_cancelar, "cancelar la última operación")
+    
+    # Importación
+    p = comando("importar", _cmd_importar, "importar productos (CSV o JSON Lines)", responsable=True)
+    p.add_argument('archivo')
+    p.add_argument('--formato', choices=["csv", "jsonl"])
+    p = comando("exportar", _cmd_exportar, "exportar productos (CSV o JSON Lines)")
+    p.add_argument('archivo')
+    p.add_argument('--formato', choices=["csv", "jsonl"])
+    
+    # Consultas y reportes
+    p = comando("producto", _cmd_producto, "ver un producto")
+    p.add_argument('codigo')
+    p = comando("buscar", _cmd_buscar, "buscar productos")
+    p.add_argument('texto')
+    p.add_argument('--por', choices=["codigo", "nombre", "categoria"], default="nombre")
+    p.add_argument('--limite', type=int, default=20)
+    
+    p = comando("reporte", _cmd_reporte, "reportes")
+    p.add_argument('tipo', choices=REPORTES)
+    p.add_argument('--desde', type=fecha_argumento, help="AAAA-MM-DD")
+    p.add_argument('--hasta', type=fecha_argumento, help="AAAA-MM-DD")
+    p.add_argument('--limite', type=int, default=10, help="top de vendidos o filas del historial")
+    p.add_argument('--categoria')
+    p.add_argument('--orden', choices=list(BD.ORDEN_RANKING), default="cantidad")
+    p.add_argument('--periodo', choices=list(BD.PERIODOS), default="mes")
+    
+    # Mantenimiento
+    p = comando("mantenimiento", _cmd_mantenimiento, "tareas de mantenimiento")
+    p.add_argument('tarea', choices=["recalcular", "alertas", "optimizar"])
+    p = comando("conciliar", _cmd_conciliar, "comparar el stock con el libro de movimientos")
+    p.add_argument('--reparar', action='store_true', help="poner el stock que dice el libro")
+    p.add_argument('--sin-snapshot', action='store_true', help="no guardar un snapshot del libro")
+    p.add_argument('--procesos', type=int, help="procesos para sumar movimientos (por defecto, uno por CPU)")
+    return parser
+
+
+def main(argv=None):
+    args = crear_parser().parse_args(argv)
+    if args.comando is None:
+        iniciar_interfaz()
+        return 0
+    
+    gestor = Gestor(archivo=args.base)
+    try:
+        exito, datos = args.funcion(gestor, args)
+    except (OSError, csv.Error, sqlite3.Error, ValueError, KeyError) as e:
+        exito, datos = False, str(e)
+    finally:
+        gestor.cerrar()
+    
+    if args.json:
+        print(json.dumps({'exito': exito, 'resultado': datos}, ensure_ascii=False, default=str))
+    elif exito:
+        _imprimir(datos)
+    else:
+        print(datos if isinstance(datos, str) else json.dumps(datos, ensure_ascii=False, default=str),
+              file=sys.stderr)
+    return 0 if exito else 1
+
+
 # ============================================================
 # EJECUTAR
 # ============================================================
 
 if __name__ == "__main__":
-    root = tk.Tk()
-    app = App(root)
-
-    root.mainloop()
+    sys.exit(main())
@@ -0,0 +1,239 @@
+# Fachada asyncio sobre Gestor, para servicios que no pueden bloquear su
+# bucle de eventos con la E/S de SQLite.
+#
+#   async with AsyncGestor(archivo="inventario.db") as inventario:
+#       exito, msg = await inventario.registrar_salida("P001", 2, "Pedido 123")
+#       async for m in inventario.iter_movimientos(tipo="SALIDA"):
+#           ...
+#       async with inventario.transaccion() as tx:
+#           await tx.ejecutar("UPDATE productos SET stock_minimo = ? WHERE codigo = ?", (3, "P001"))
+#
+# Cada método público de Gestor tiene su versión awaitable con el mismo
+# nombre. Las lecturas van a un pool de hilos (cada hilo con su conexión,
+# en WAL no se bloquean entre sí) y las escrituras a un único hilo, en
+# orden. Como mucho max_pendientes llamadas esperan o se ejecutan a la vez;
+# las demás esperan turno en el bucle (contrapresión) en vez de encolarse
+# sin límite.
+#
+# Una escritura ya enviada no se interrumpe: si la tarea que la espera se
+# cancela, se espera a que termine (confirmada o deshecha, nunca a medias)
+# y luego se propaga la cancelación.
+
+import asyncio
+import contextvars
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+
+from Inventory import Gestor
+
+# Métodos de Gestor que escriben en la base y van al hilo escritor
+ESCRITURAS = {
+    'agregar_producto', 'modificar_producto', 'eliminar_producto', 'importar_productos',
+    'registrar_entrada', 'registrar_salida', 'registrar_devolucion', 'registrar_perdida',
+    'registrar_lote', 'cancelar_ultima_operacion', 'recalcular_resumen', 'reconstruir_resumen_diario',
+    'reconciliar',
+}
+# Métodos con versión propia en AsyncGestor
+PROPIOS = {'al_bajar_stock', 'iter_movimientos', 'cerrar'}
+# AsyncGestor con una transacción abierta en el contexto actual (la tarea
+# que está dentro del bloque y las que crea desde él)
+_transaccion_abierta = contextvars.ContextVar('transaccion_abierta', default=None)
+
+
+async def completar(futuro):
+    # Espera futuro aunque la tarea se cancele mientras tanto; la
+    # cancelación se propaga después, cuando ya terminó
+    cancelada = False
+    while True:
+        try:
+            resultado = await asyncio.shield(futuro)
+            break
+        except asyncio.CancelledError:
+            if futuro.done():
+                raise
+            cancelada = True
+    if cancelada:
+        raise asyncio.CancelledError
+    return resultado
+
+
+class TransaccionAsync:
+    # Pasos de una transacción abierta en el hilo escritor; ver AsyncGestor.transaccion
+    def __init__(self, cola, bucle):
+        self._cola = cola
+        self._bucle = bucle
+    
+    def llamar(self, funcion, *args):
+        # funcion(conn, *args) se ejecuta en el hilo escritor, dentro de la transacción
+        futuro = self._bucle.create_future()
+        self._cola.put((futuro, funcion, args))
+        return futuro
+    
+    async def ejecutar(self, sql, parametros=()):
+        return await self.llamar(lambda conn: conn.execute(sql, parametros).fetchall())
+    
+    async def ejecutar_muchos(self, sql, filas):
+        return await self.llamar(lambda conn: conn.executemany(sql, filas).rowcount)
+
+
+class AsyncGestor:
+    def __init__(self, gestor=None, hilos_lectura=4, max_pendientes=64, **opciones_gestor):
+        # opciones_gestor (archivo, tamano_cache) se pasan a Gestor si no se da uno
+        self.gestor = gestor if gestor is not None else Gestor(**opciones_gestor)
+        self._lectores = ThreadPoolExecutor(hilos_lectura, thread_name_prefix="lectura")
+        self._escritor = ThreadPoolExecutor(1, thread_name_prefix="escritura")
+        self._cupos = asyncio.Semaphore(max_pendientes)
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc):
+        await self.cerrar()
+    
+    def _comprobar_transaccion(self):
+        # Dentro de transaccion() el hilo escritor está ocupado esperando
+        # los pasos del bloque: otra escritura esperaría para siempre
+        if _transaccion_abierta.get() is self:
+            raise RuntimeError("Dentro de transaccion() solo se escribe con los pasos de la transacción")
+    
+    async def _ejecutar(self, funcion, args, kwargs, escritura):
+        if escritura:
+            self._comprobar_transaccion()
+        async with self._cupos:
+            bucle = asyncio.get_running_loop()
+            futuro = bucle.run_in_executor(self._escritor if escritura else self._lectores,
+                                           partial(funcion, *args, **kwargs))
+            if escritura:
+                return await completar(futuro)
+            return await futuro
+    
+    async def al_bajar_stock(self, funcion):
+        # Como Gestor.al_bajar_stock, pero funcion se llama en el bucle de
+        # eventos (los avisos se producen en el hilo escritor). La
+        # suscripción lee la base y cambia la lista de avisos que usa el
+        # hilo escritor, así que también se hace allí y no en el bucle.
+        bucle = asyncio.get_running_loop()
+        await self._ejecutar(self.gestor.al_bajar_stock,
+                             (lambda *args: bucle.call_soon_threadsafe(funcion, *args),), {}, True)
+    
+    async def iter_movimientos(self, tipo=None, desde=None, hasta=None, producto=None, tamano=500):
+        # Historial de más reciente a más antiguo, por páginas. Mientras se
+        # consume una página ya se está leyendo la siguiente.
+        siguiente = asyncio.ensure_future(
+            self._ejecutar(self.gestor.pagina_movimientos, (tipo, desde, hasta, producto),
+                           {'limite': tamano}, False))
+        try:
+            while True:
+                pagina = await siguiente
+                siguiente = None
+                if len(pagina) == tamano:
+                    ultimo = pagina[-1]
+                    siguiente = asyncio.ensure_future(
+                        self._ejecutar(self.gestor.pagina_movimientos, (tipo, desde, hasta, producto),
+                                       {'despues_de': (ultimo.fecha, ultimo.id_movimiento),
+                                        'limite': tamano}, False))
+                for m in pagina:
+                    yield m
+                if siguiente is None:
+                    break
+        finally:
+            if siguiente is not None:
+                siguiente.cancel()
+    
+    @asynccontextmanager
+    async def transaccion(self):
+        # Transacción con varios pasos, en el hilo escritor y con su
+        # conexión. Mientras está abierta, las demás escrituras esperan
+        # detrás. Se confirma al salir del bloque y se deshace si sale con
+        # una excepción o una cancelación. Dentro del bloque solo se escribe
+        # con tx: otra escritura del mismo AsyncGestor (o una transacción
+        # anidada) lanza RuntimeError en vez de quedarse esperando al hilo
+        # escritor, que está ocupado con este bloque.
+        self._comprobar_transaccion()
+        bucle = asyncio.get_running_loop()
+        pasos = queue.SimpleQueue()
+        abierta = bucle.create_future()
+        
+        def avisar(futuro, resultado=None, error=None):
+            if futuro.done():
+                return
+            if error is not None:
+                futuro.set_exception(error)
+            else:
+                futuro.set_result(resultado)
+        
+        def correr():
+            conn = self.gestor.bd.conectar()
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+            except Exception as e:
+                bucle.call_soon_threadsafe(avisar, abierta, None, e)
+                return
+            bucle.call_soon_threadsafe(avisar, abierta)
+            while True:
+                futuro, funcion, args = pasos.get()
+                if funcion is None:
+                    # Fin del bloque: args es (confirmar,)
+                    try:
+                        if args[0]:
+                            conn.commit()
+                        else:
+                            conn.rollback()
+                    except Exception as e:
+                        conn.rollback()
+                        bucle.call_soon_threadsafe(avisar, futuro, None, e)
+                    else:
+                        bucle.call_soon_threadsafe(avisar, futuro)
+                    return
+                try:
+                    resultado = funcion(conn, *args)
+                except Exception as e:
+                    bucle.call_soon_threadsafe(avisar, futuro, None, e)
+                else:
+                    bucle.call_soon_threadsafe(avisar, futuro, resultado)
+        
+        async with self._cupos:
+            hilo = bucle.run_in_executor(self._escritor, correr)
+            try:
+                await completar(abierta)
+            except BaseException:
+                # Si se canceló mientras se abría, la transacción se cierra igual
+                pasos.put((bucle.create_future(), None, (False,)))
+                await completar(hilo)
+                raise
+            
+            fin = bucle.create_future()
+            marca = _transaccion_abierta.set(self)
+            try:
+                yield TransaccionAsync(pasos, bucle)
+            except BaseException:
+                pasos.put((fin, None, (False,)))
+                await completar(hilo)
+                raise
+            finally:
+                _transaccion_abierta.reset(marca)
+            pasos.put((fin, None, (True,)))
+            await completar(hilo)
+            await fin
+            self.gestor.descartar_caches()
+    
+    async def cerrar(self):
+        # Espera lo pendiente y cierra los hilos y las conexiones
+        bucle = asyncio.get_running_loop()
+        await bucle.run_in_executor(None, self._lectores.shutdown)
+        await bucle.run_in_executor(None, self._escritor.shutdown)
+        self.gestor.cerrar()
+
+
+def _envolver(nombre, escritura):
+    async def metodo(self, *args, **kwargs):
+        return await self._ejecutar(getattr(self.gestor, nombre), args, kwargs, escritura)
+    metodo.__name__ = metodo.__qualname__ = nombre
+    return metodo
+
+
+for _nombre, _funcion in vars(Gestor).items():
+    if callable(_funcion) and not _nombre.startswith('_') and _nombre not in PROPIOS:
+        setattr(AsyncGestor, _nombre, _envolver(_nombre, _nombre in ESCRITURAS))
@@ -0,0 +1,81 @@
+# Mide AsyncGestor con distinto número de corrutinas concurrentes: lecturas
+# (búsqueda por nombre) y salidas por segundo, y el peor retraso que sufre
+# el bucle de eventos mientras tanto (lo que bloquearía a otros servicios).
+#
+#   python benchmarks/bench_async.py [productos] [operaciones]
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from Inventory import Gestor
+from asincrono import AsyncGestor
+
+PALABRAS = ["cafe", "leche", "pan", "arroz", "azucar", "aceite", "sal", "harina", "jugo", "agua"]
+
+
+def crear_base(archivo, n_productos):
+    gestor = Gestor(archivo=archivo)
+    with gestor.bd.transaccion() as conn:
+        conn.executemany(
+            'INSERT INTO productos (codigo, nombre, precio_compra, precio_venta, '
+            'stock_actual, stock_minimo, categoria) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [(f"B{i:07d}", f"{PALABRAS[i % 10]} {PALABRAS[i // 10 % 10]} {i}", 10.5, 15.25,
+              10 ** 9, 5, f"Cat{i % 30}") for i in range(n_productos)])
+    gestor.cerrar()
+
+
+async def vigilar_bucle(estado, intervalo=0.005):
+    # Peor retraso del bucle respecto a cuándo debía despertar
+    while True:
+        inicio = time.perf_counter()
+        await asyncio.sleep(intervalo)
+        estado['retraso'] = max(estado['retraso'], time.perf_counter() - inicio - intervalo)
+
+
+async def medir(nombre, crear_operacion, n_operaciones, concurrencia):
+    estado = {'retraso': 0.0}
+    vigilante = asyncio.ensure_future(vigilar_bucle(estado))
+    pendientes = iter(range(n_operaciones))
+    
+    async def trabajador():
+        for i in pendientes:
+            await crear_operacion(i)
+    
+    inicio = time.perf_counter()
+    await asyncio.gather(*[trabajador() for _ in range(concurrencia)])
+    segundos = time.perf_counter() - inicio
+    vigilante.cancel()
+    print(f"  {nombre:<10} {concurrencia:>4} corrutinas  {n_operaciones / segundos:9.0f} op/s   "
+          f"retraso máx. del bucle {estado['retraso'] * 1000:6.1f} ms")
+
+
+async def principal(archivo, n_productos, n_operaciones):
+    async with AsyncGestor(archivo=archivo, hilos_lectura=4) as inventario:
+        for concurrencia in (1, 8, 32):
+            await medir("búsqueda",
+                        lambda i: inventario.buscar_producto("nombre", PALABRAS[i % 10], 50),
+                        n_operaciones, concurrencia)
+        for concurrencia in (1, 8, 32):
+            await medir("salida",
+                        lambda i: inventario.registrar_salida(f"B{i % n_productos:07d}", 1, "bench"),
+                        n_operaciones, concurrencia)
+
+
+def main():
+    n_productos = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    n_operaciones = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    
+    with tempfile.TemporaryDirectory() as directorio:
+        archivo = os.path.join(directorio, "bench.db")
+        crear_base(archivo, n_productos)
+        print(f"AsyncGestor ({n_productos} productos, {n_operaciones} operaciones por prueba)")
+        asyncio.run(principal(archivo, n_productos, n_operaciones))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# Mide Gestor.reconciliar sobre una base generada: una pasada completa por
+# todo el libro de movimientos (sin snapshot), con 1 proceso y con uno por
+# CPU, y una pasada incremental desde el snapshot tras unos miles de
+# movimientos nuevos. Algunos stocks se estropean a propósito para
+# comprobar que se detectan.
+#
+#   python benchmarks/bench_conciliacion.py [productos] [movimientos] [--base archivo]
+#
+# Generar la base es lo lento (los triggers de los resúmenes corren por
+# cada movimiento); con --base se genera una vez y se reutiliza.
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from Inventory import Gestor, SQL_DELTA_STOCK, fecha_a_entero
+from datetime import datetime
+
+TIPOS = ["ENTRADA", "ENTRADA", "SALIDA", "SALIDA", "DEVOLUCION", "PERDIDA"]
+ESTROPEADOS = 25
+
+
+def crear_base(archivo, n_productos, n_movimientos):
+    gestor = Gestor(archivo=archivo)
+    aleatorio = random.Random(1)
+    ahora = fecha_a_entero(datetime.now())
+    with gestor.bd.transaccion() as conn:
+        conn.executemany(
+            'INSERT INTO productos (codigo, nombre, precio_compra, precio_venta, '
+            'stock_actual, stock_minimo, categoria) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [(f"B{i:07d}", f"Producto {i}", 10.5, 15.25, 0, 5, f"Cat{i % 30}")
+             for i in range(n_productos)])
+    # Cada producto empieza con una entrada grande para que el saldo no
+    # quede en negativo; el resto son movimientos al azar
+    def movimiento(i):
+        if i < n_productos:
+            return ahora - n_movimientos * 1000, "ENTRADA", f"B{i:07d}", 1000
+        return (ahora - (n_movimientos - i) * 1000, aleatorio.choice(TIPOS),
+                f"B{aleatorio.randrange(n_productos):07d}", aleatorio.randint(1, 20))
+    
+    for inicio in range(0, n_movimientos, 100000):
+        bloque = map(movimiento, range(inicio, min(inicio + 100000, n_movimientos)))
+        with gestor.bd.transaccion() as conn:
+            conn.executemany(
+                'INSERT INTO movimientos (fecha, tipo, producto_codigo, producto_nombre, cantidad, '
+                'responsable, precio_compra, precio_venta) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [(fecha, tipo, codigo, "Producto", cantidad, "bench", 10.5, 15.25)
+                 for fecha, tipo, codigo, cantidad in bloque])
+    # El stock de partida es el del libro; después se estropean unos pocos
+    with gestor.bd.transaccion() as conn:
+        conn.execute('CREATE TEMP TABLE saldos AS SELECT producto_codigo AS codigo, '
+                     f'SUM({SQL_DELTA_STOCK}) AS saldo FROM movimientos GROUP BY producto_codigo')
+        conn.execute('UPDATE productos SET stock_actual = '
+                     '(SELECT saldo FROM temp.saldos WHERE codigo = productos.codigo) '
+                     'WHERE codigo IN (SELECT codigo FROM temp.saldos)')
+        conn.execute('DROP TABLE temp.saldos')
+    gestor.cerrar()
+
+
+def estropear(gestor, n_productos):
+    aleatorio = random.Random()
+    with gestor.bd.transaccion() as conn:
+        conn.executemany('UPDATE productos SET stock_actual = stock_actual + 7 WHERE codigo = ?',
+                         [(f"B{aleatorio.randrange(n_productos):07d}",) for _ in range(ESTROPEADOS)])
+
+
+def medir(nombre, funcion):
+    inicio = time.perf_counter()
+    resultado = funcion()
+    segundos = time.perf_counter() - inicio
+    print(f"  {nombre:<34} {segundos:7.2f} s   movimientos {resultado['desde_movimiento'] + 1}-"
+          f"{resultado['hasta_movimiento']}, {len(resultado['diferencias'])} diferencias")
+    return resultado
+
+
+def main():
+    argumentos = sys.argv[1:]
+    archivo = None
+    if "--base" in argumentos:
+        i = argumentos.index("--base")
+        archivo = argumentos[i + 1]
+        del argumentos[i:i + 2]
+    n_productos = int(argumentos[0]) if len(argumentos) > 0 else 100000
+    n_movimientos = int(argumentos[1]) if len(argumentos) > 1 else 1000000
+    
+    directorio = tempfile.TemporaryDirectory()
+    if archivo is None:
+        archivo = os.path.join(directorio.name, "bench.db")
+    if not os.path.exists(archivo):
+        inicio = time.perf_counter()
+        crear_base(archivo, n_productos, n_movimientos)
+        print(f"Base generada en {time.perf_counter() - inicio:.1f} s")
+    
+    gestor = Gestor(archivo=archivo)
+    try:
+        n_productos = gestor.bd.conectar().execute('SELECT COUNT(*) FROM productos').fetchone()[0]
+        with gestor.bd.transaccion() as conn:
+            conn.execute('DELETE FROM saldos_snapshot')
+            conn.execute('DELETE FROM snapshots_stock')
+        estropear(gestor, n_productos)
+        
+        cpus = os.cpu_count() or 1
+        print(f"reconciliar ({n_productos} productos, {ESTROPEADOS} stocks estropeados, {cpus} CPU)")
+        medir("completa, 1 proceso", lambda: gestor.reconciliar(guardar_snapshot=False, procesos=1))
+        if cpus > 1:
+            medir(f"completa, {cpus} procesos", lambda: gestor.reconciliar(guardar_snapshot=False))
+        medir("completa, reparando y con snapshot", lambda: gestor.reconciliar(reparar=True))
+        
+        for i in range(5000):
+            gestor.registrar_entrada(f"B{i % n_productos:07d}", 1, "bench")
+        estropear(gestor, n_productos)
+        medir("incremental (5.000 movimientos)", gestor.reconciliar)
+    finally:
+        gestor.cerrar()
+        directorio.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# Compara cargar filas de la base con el constructor que valida
+# (Producto(...) / Movimiento(...)) contra desde_fila, en tiempo y memoria.
+# También mide la memoria del diseño anterior, con __dict__ por instancia.
+#
+#   python benchmarks/bench_modelos.py [productos] [movimientos]
+
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from Inventory import Producto, Movimiento, fecha_a_entero
+
+
+# Mismo __init__ pero sin __slots__, como eran las clases antes
+class ProductoConDict:
+    __init__ = Producto.__init__
+
+
+class MovimientoConDict:
+    __init__ = Movimiento.__init__
+
+
+def filas_productos(n):
+    return [(i, f"P{i:07d}", f"Producto {i}", 10.5, 15.25, i % 50, 5, f"Cat{i % 30}")
+            for i in range(1, n + 1)]
+
+
+def filas_movimientos(n):
+    fecha = fecha_a_entero(datetime(2024, 1, 1))
+    return [(i, fecha + i * 1000000, "SALIDA", f"P{i % 1000:07d}", f"Producto {i % 1000}",
+             1 + i % 5, "Caja 1", None, None, 10.5, 15.25)
+            for i in range(1, n + 1)]
+
+
+def con_validacion_producto(clase):
+    return lambda f: clase(f[1], f[2], f[3], f[4], f[5], f[6], f[7], f[0])
+
+
+def con_validacion_movimiento(clase):
+    return lambda f: clase(f[2], f[3], f[4], f[5], f[6], f[7], datetime(2024, 1, 1), f[0])
+
+
+def medir(nombre, filas, constructor):
+    inicio = time.perf_counter()
+    objetos = [constructor(f) for f in filas]
+    segundos = time.perf_counter() - inicio
+    del objetos
+    
+    tracemalloc.start()
+    objetos = [constructor(f) for f in filas]
+    memoria = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del objetos
+    
+    print(f"  {nombre:<32} {segundos * 1000:9.1f} ms   {memoria / len(filas):7.1f} bytes/objeto")
+
+
+def main():
+    n_productos = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    n_movimientos = int(sys.argv[2]) if len(sys.argv) > 2 else 1000000
+    
+    filas = filas_productos(n_productos)
+    print(f"Productos ({n_productos} filas)")
+    medir("__init__ con __dict__ (antes)", filas, con_validacion_producto(ProductoConDict))
+    medir("__init__ con __slots__", filas, con_validacion_producto(Producto))
+    medir("Producto.desde_fila", filas, Producto.desde_fila)
+    
+    filas = filas_movimientos(n_movimientos)
+    print(f"Movimientos ({n_movimientos} filas)")
+    medir("__init__ con __dict__ (antes)", filas, con_validacion_movimiento(MovimientoConDict))
+    medir("__init__ con __slots__", filas, con_validacion_movimiento(Movimiento))
+    medir("Movimiento.desde_fila", filas, Movimiento.desde_fila)
+
+
+if __name__ == "__main__":
+    main()
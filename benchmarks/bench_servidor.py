@@ -0,0 +1,120 @@
+# Generador de carga para servidor.py: levanta el servidor en otro proceso
+# sobre una base temporal y lanza clientes concurrentes, cada uno con su
+# conexión persistente, registrando salidas (registrar_salida) durante unos
+# segundos. Muestra peticiones/s y latencias.
+#
+#   python benchmarks/bench_servidor.py [clientes] [segundos] [productos]
+#   python benchmarks/bench_servidor.py 50 10 --url http://127.0.0.1:8080
+#
+# Con --url se ataca un servidor ya levantado (y su base) en vez de uno
+# temporal; los productos B0000000... deben existir con stock suficiente.
+
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+RAIZ = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, RAIZ)
+
+from Inventory import Gestor
+
+
+def crear_base(archivo, n_productos):
+    gestor = Gestor(archivo=archivo)
+    with gestor.bd.transaccion() as conn:
+        conn.executemany(
+            'INSERT INTO productos (codigo, nombre, precio_compra, precio_venta, '
+            'stock_actual, stock_minimo, categoria) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [(f"B{i:07d}", f"Producto {i}", 10.5, 15.25, 10 ** 9, 5, f"Cat{i % 30}")
+             for i in range(n_productos)])
+    gestor.cerrar()
+
+
+def levantar_servidor(archivo):
+    proceso = subprocess.Popen([sys.executable, "-m", "servidor", "--puerto", "0", "--base", archivo],
+                               cwd=RAIZ, stderr=subprocess.PIPE, text=True)
+    # Primera línea: "Inventario en http://host:puerto/"
+    linea = proceso.stderr.readline()
+    if not linea.startswith("Inventario en "):
+        proceso.kill()
+        raise RuntimeError(f"El servidor no arrancó: {linea}")
+    return proceso, linea.split()[-1]
+
+
+def cliente(url, n_productos, fin, latencias, errores):
+    partes = urlsplit(url)
+    conn = http.client.HTTPConnection(partes.hostname, partes.port, timeout=30)
+    aleatorio = random.Random()
+    propias = []
+    fallidas = 0
+    while time.perf_counter() < fin:
+        cuerpo = json.dumps({'codigo': f"B{aleatorio.randrange(n_productos):07d}",
+                             'cantidad': 1, 'responsable': "bench"})
+        inicio = time.perf_counter()
+        conn.request("POST", "/movimientos/salida", cuerpo, {'Content-Type': "application/json"})
+        respuesta = conn.getresponse()
+        respuesta.read()
+        propias.append(time.perf_counter() - inicio)
+        if respuesta.status != 200:
+            fallidas += 1
+    conn.close()
+    latencias.extend(propias)
+    errores.append(fallidas)
+
+
+def percentil(valores, p):
+    return valores[min(len(valores) - 1, int(len(valores) * p))]
+
+
+def main():
+    argumentos = sys.argv[1:]
+    url = None
+    if "--url" in argumentos:
+        i = argumentos.index("--url")
+        url = argumentos[i + 1]
+        del argumentos[i:i + 2]
+    
+    n_clientes = int(argumentos[0]) if len(argumentos) > 0 else 50
+    segundos = float(argumentos[1]) if len(argumentos) > 1 else 10
+    n_productos = int(argumentos[2]) if len(argumentos) > 2 else 1000
+    
+    proceso = None
+    directorio = tempfile.TemporaryDirectory()
+    if url is None:
+        archivo = os.path.join(directorio.name, "bench.db")
+        crear_base(archivo, n_productos)
+        proceso, url = levantar_servidor(archivo)
+    
+    try:
+        latencias, errores = [], []
+        fin = time.perf_counter() + segundos
+        hilos = [threading.Thread(target=cliente, args=(url, n_productos, fin, latencias, errores))
+                 for _ in range(n_clientes)]
+        inicio = time.perf_counter()
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        duracion = time.perf_counter() - inicio
+    finally:
+        if proceso is not None:
+            proceso.terminate()
+            proceso.wait()
+        directorio.cleanup()
+    
+    latencias.sort()
+    print(f"registrar_salida: {n_clientes} clientes, {duracion:.1f} s")
+    print(f"  {len(latencias)} peticiones ({sum(errores)} con error)   {len(latencias) / duracion:8.0f} peticiones/s")
+    print(f"  latencia p50 {percentil(latencias, 0.5) * 1000:6.1f} ms   "
+          f"p99 {percentil(latencias, 0.99) * 1000:6.1f} ms   máx {latencias[-1] * 1000:6.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
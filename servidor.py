@@ -0,0 +1,307 @@
+# Servidor HTTP/JSON opcional sobre Gestor, para que varias terminales
+# trabajen contra una misma base a través de un solo proceso. Solo usa la
+# biblioteca estándar.
+#
+#   python -m servidor [--host 127.0.0.1] [--puerto 8080] [--base inventario.db]
+#
+# Cada cliente se atiende en su propio hilo, que lee con su propia conexión
+# SQLite (en WAL las lecturas no se bloquean entre sí). Todas las escrituras
+# pasan por un único hilo escritor, en orden de llegada.
+#
+# Todas las respuestas son {"exito": bool, "resultado": ...}:
+#
+#   GET  /productos/<codigo>
+#   GET  /productos?q=texto&por=nombre|codigo|categoria&limite=20
+#   POST /movimientos/entrada        {"codigo", "cantidad", "responsable"}
+#   POST /movimientos/salida         {"codigo", "cantidad", "responsable"}
+#   POST /movimientos/devolucion     {"codigo", "cantidad", "motivo", "responsable"}
+#   POST /movimientos/perdida        {"codigo", "cantidad", "tipo", "motivo", "responsable"}
+#   POST /movimientos/lote           {"lineas": [[codigo, tipo, cantidad, motivo], ...],
+#                                     "responsable", "parcial"}
+#   POST /movimientos/cancelar
+#   GET  /reportes/<tipo>?desde=AAAA-MM-DD&hasta=&limite=&categoria=&orden=&periodo=
+#
+# Una operación rechazada (stock insuficiente, producto inexistente...)
+# responde 409; un producto no encontrado, 404; datos inválidos, 400.
+#
+# Rendimiento medido con benchmarks/bench_servidor.py (50 clientes con
+# conexión persistente, registrar_salida, 1 CPU): unas 1.000 peticiones/s,
+# con p50 de 47 ms y p99 de 66 ms.
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from Inventory import Gestor, REPORTES, TIPOS_PERDIDA, fecha_argumento, generar_reporte, producto_a_dict
+
+
+class ErrorPeticion(Exception):
+    def __init__(self, estado, mensaje):
+        super().__init__(mensaje)
+        self.estado = estado
+
+
+def _entero(valor, nombre):
+    try:
+        return int(valor)
+    except (TypeError, ValueError):
+        raise ErrorPeticion(400, f"'{nombre}' debe ser un entero")
+
+
+def _cantidad(valor):
+    # Del cuerpo JSON: solo enteros (ni 2.9 ni true, que int() aceptaría)
+    if not isinstance(valor, int) or isinstance(valor, bool):
+        raise ErrorPeticion(400, "'cantidad' debe ser un entero")
+    return valor
+
+
+def _requerido(datos, nombre, tipo=str):
+    if datos.get(nombre) in (None, ""):
+        raise ErrorPeticion(400, f"Falta '{nombre}'")
+    return _del_tipo(datos[nombre], nombre, tipo)
+
+
+def _del_tipo(valor, nombre, tipo=str):
+    # Un JSON bien formado puede traer cualquier tipo; se rechaza antes de
+    # que llegue al gestor
+    if not isinstance(valor, tipo):
+        raise ErrorPeticion(400, f"'{nombre}' no tiene un tipo válido")
+    return valor
+
+
+def _responsable(datos):
+    return _del_tipo(datos.get('responsable') or "Sistema", 'responsable')
+
+
+# ============================================================
+# RUTAS
+# ============================================================
+# Cada ruta recibe (servidor, parametros de la ruta, query, cuerpo) y
+# devuelve (exito, resultado)
+
+def ruta_producto(servidor, partes, consulta, datos):
+    producto = servidor.gestor.obtener_producto(partes[0])
+    if not producto:
+        raise ErrorPeticion(404, "Producto no encontrado")
+    return True, producto_a_dict(producto)
+
+
+def ruta_buscar(servidor, partes, consulta, datos):
+    texto = _requerido(consulta, 'q')
+    por = consulta.get('por', 'nombre')
+    if por not in ('codigo', 'nombre', 'categoria'):
+        raise ErrorPeticion(400, f"Criterio no soportado: {por}")
+    limite = _entero(consulta.get('limite', 20), 'limite')
+    return True, [producto_a_dict(p) for p in servidor.gestor.buscar_producto(por, texto, limite)]
+
+
+def ruta_movimiento(servidor, partes, consulta, datos):
+    gestor = servidor.gestor
+    tipo = partes[0]
+    codigo = _requerido(datos, 'codigo')
+    cantidad = _cantidad(_requerido(datos, 'cantidad', object))
+    responsable = _responsable(datos)
+    
+    if tipo == "entrada":
+        return servidor.escribir(gestor.registrar_entrada, codigo, cantidad, responsable)
+    if tipo == "salida":
+        return servidor.escribir(gestor.registrar_salida, codigo, cantidad, responsable)
+    motivo = _requerido(datos, 'motivo')
+    if tipo == "devolucion":
+        return servidor.escribir(gestor.registrar_devolucion, codigo, cantidad, motivo, responsable)
+    # Un tipo fuera de TIPOS_PERDIDA bajaría el stock sin salir en los reportes
+    tipo_perdida = _requerido(datos, 'tipo').strip().lower()
+    if tipo_perdida not in TIPOS_PERDIDA:
+        raise ErrorPeticion(400, f"Tipo de pérdida no válido: {datos['tipo']}")
+    return servidor.escribir(gestor.registrar_perdida, codigo, cantidad,
+                             tipo_perdida, motivo, responsable)
+
+
+def ruta_lote(servidor, partes, consulta, datos):
+    lineas = _requerido(datos, 'lineas', list)
+    try:
+        lineas = [(codigo, str(tipo).upper(), cantidad, motivo) for codigo, tipo, cantidad, motivo in lineas]
+    except (TypeError, ValueError):
+        raise ErrorPeticion(400, "Cada línea es [codigo, tipo, cantidad, motivo]")
+    for codigo, tipo, cantidad, motivo in lineas:
+        _del_tipo(codigo, 'codigo')
+        _cantidad(cantidad)
+        _del_tipo(motivo, 'motivo', (str, type(None)))
+    
+    exito, resultados = servidor.escribir(servidor.gestor.registrar_lote, lineas,
+                                          _responsable(datos), not datos.get('parcial', False))
+    return exito, [{'exito': ok, 'resultado': msg} for ok, msg in resultados]
+
+
+def ruta_cancelar(servidor, partes, consulta, datos):
+    exito, msg, _ = servidor.escribir(servidor.gestor.cancelar_ultima_operacion)
+    return exito, msg
+
+
+def ruta_reporte(servidor, partes, consulta, datos):
+    tipo = partes[0]
+    if tipo not in REPORTES:
+        raise ErrorPeticion(404, f"Reporte desconocido: {tipo}")
+    opciones = {}
+    for nombre in ('desde', 'hasta'):
+        if consulta.get(nombre):
+            opciones[nombre] = fecha_argumento(consulta[nombre])
+    if 'limite' in consulta:
+        opciones['limite'] = _entero(consulta['limite'], 'limite')
+    for nombre in ('categoria', 'orden', 'periodo'):
+        if consulta.get(nombre):
+            opciones[nombre] = consulta[nombre]
+    return True, generar_reporte(servidor.gestor, tipo, **opciones)
+
+
+# (método, primer segmento, segmentos restantes) -> ruta
+RUTAS = {
+    ('GET', 'productos', 0): ruta_buscar,
+    ('GET', 'productos', 1): ruta_producto,
+    ('POST', 'movimientos', 1): ruta_movimiento,
+    ('GET', 'reportes', 1): ruta_reporte,
+}
+RUTAS_FIJAS = {
+    ('POST', '/movimientos/lote'): ruta_lote,
+    ('POST', '/movimientos/cancelar'): ruta_cancelar,
+}
+MOVIMIENTOS = ("entrada", "salida", "devolucion", "perdida")
+
+
+# ============================================================
+# SERVIDOR
+# ============================================================
+
+class ManejadorInventario(BaseHTTPRequestHandler):
+    # HTTP/1.1: cada terminal reutiliza su conexión entre peticiones
+    protocol_version = "HTTP/1.1"
+    
+    def do_GET(self):
+        self.atender('GET')
+    
+    def do_POST(self):
+        self.atender('POST')
+    
+    def buscar_ruta(self, metodo, camino):
+        ruta = RUTAS_FIJAS.get((metodo, camino.rstrip('/')))
+        if ruta:
+            return ruta, []
+        partes = [unquote(p) for p in camino.split('/') if p]
+        if not partes:
+            return None, []
+        ruta = RUTAS.get((metodo, partes[0], len(partes) - 1))
+        if ruta is ruta_movimiento and partes[1] not in MOVIMIENTOS:
+            return None, []
+        return ruta, partes[1:]
+    
+    def leer_cuerpo(self):
+        try:
+            largo = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            largo = -1
+        if largo < 0:
+            # Sin un largo válido no se sabe dónde acaba el cuerpo: la
+            # conexión no puede seguir con la siguiente petición
+            self.close_connection = True
+            raise ErrorPeticion(400, "Content-Length no válido")
+        if not largo:
+            return {}
+        try:
+            datos = json.loads(self.rfile.read(largo))
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            raise ErrorPeticion(400, "El cuerpo debe ser JSON")
+        if not isinstance(datos, dict):
+            raise ErrorPeticion(400, "El cuerpo debe ser un objeto JSON")
+        return datos
+    
+    def atender(self, metodo):
+        url = urlsplit(self.path)
+        consulta = {clave: valores[-1] for clave, valores in parse_qs(url.query).items()}
+        
+        try:
+            # El cuerpo se lee siempre, para dejar la conexión lista para la siguiente petición
+            datos = self.leer_cuerpo()
+            ruta, partes = self.buscar_ruta(metodo, url.path)
+            if ruta is None:
+                raise ErrorPeticion(404, "Ruta no encontrada")
+            exito, resultado = ruta(self.server, partes, consulta, datos)
+            estado = 200 if exito else 409
+        except ErrorPeticion as e:
+            estado, exito, resultado = e.estado, False, str(e)
+        except ValueError as e:
+            estado, exito, resultado = 400, False, str(e)
+        except sqlite3.Error as e:
+            estado, exito, resultado = 500, False, str(e)
+        except Exception as e:
+            # Siempre se responde, para no dejar colgada la conexión del cliente
+            self.log_error("Error en %s %s: %r", metodo, url.path, e)
+            estado, exito, resultado = 500, False, "Error interno del servidor"
+        
+        cuerpo = json.dumps({'exito': exito, 'resultado': resultado},
+                            ensure_ascii=False, default=str).encode('utf-8')
+        self.send_response(estado)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(cuerpo)))
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(cuerpo)
+    
+    def finish(self):
+        super().finish()
+        # El hilo termina con el cliente: su conexión SQLite no se reutiliza
+        self.server.gestor.bd.cerrar_hilo()
+    
+    def log_message(self, formato, *args):
+        if self.server.registrar:
+            super().log_message(formato, *args)
+
+
+class ServidorInventario(ThreadingHTTPServer):
+    daemon_threads = True
+    # Cola de conexiones pendientes holgada para muchas terminales a la vez
+    request_queue_size = 128
+    
+    def __init__(self, direccion, gestor, registrar=False):
+        super().__init__(direccion, ManejadorInventario)
+        self.gestor = gestor
+        self.registrar = registrar
+        self._escritor = ThreadPoolExecutor(1, thread_name_prefix="escritura")
+    
+    def escribir(self, funcion, *args):
+        # Serializa las escrituras en el hilo escritor y espera su resultado
+        return self._escritor.submit(funcion, *args).result()
+    
+    def server_close(self):
+        super().server_close()
+        self._escritor.shutdown(wait=True)
+        self.gestor.cerrar()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m servidor",
+                                     description="Servidor HTTP/JSON del inventario")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--puerto', type=int, default=8080)
+    parser.add_argument('--base', default=os.environ.get("INVENTARIO_DB", "inventario.db"))
+    parser.add_argument('--registrar', action='store_true', help="mostrar cada petición")
+    args = parser.parse_args(argv)
+    
+    servidor = ServidorInventario((args.host, args.puerto), Gestor(archivo=args.base), args.registrar)
+    print(f"Inventario en http://{args.host}:{servidor.server_address[1]}/", file=sys.stderr)
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())